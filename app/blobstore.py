@@ -0,0 +1,86 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+from .config import BLOB_DIR
+
+
+class BlobStore:
+    """按 SHA-256 内容寻址的媒体存储：相同内容只保存一份。
+    成员目录下的文件名与路径保持不变（硬链接到 blob），数据库 file_path 与对外 URL 无需修改。
+    成员目录与 blob 目录不在同一文件系统、或文件系统不支持硬链接时，退化为直接保存在成员目录。
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    def has(self, sha256: str) -> bool:
+        return bool(sha256) and self.path_for(sha256).exists()
+
+    def _link(self, blob: Path, path: Path) -> bool:
+        # 先链接到临时名再原子替换，避免目标路径出现中间状态
+        tmp = path.with_name(path.name + ".link")
+        try:
+            if tmp.exists():
+                tmp.unlink()
+            os.link(blob, tmp)
+            os.replace(tmp, path)
+            return True
+        except OSError:
+            return False
+
+    def link(self, sha256: str, path: Path) -> bool:
+        """已有该内容时直接把 path 链接到 blob，返回是否成功（成功即无需下载）。"""
+        if not self.has(sha256):
+            return False
+        if path.exists() and os.path.samefile(path, self.path_for(sha256)):
+            return True
+        return self._link(self.path_for(sha256), path)
+
+    def commit(self, tmp_file: Path, path: Path, sha256: str) -> Optional[Path]:
+        """把已校验的临时文件放入存储并链接到 path。返回 blob 路径；无法使用存储时直接落到 path 并返回 None。"""
+        blob = self.path_for(sha256)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            if blob.exists():
+                # 重复内容：丢弃新下载的副本
+                os.remove(tmp_file)
+            else:
+                os.replace(tmp_file, blob)
+        except OSError:
+            os.replace(tmp_file, path)
+            return None
+        if self._link(blob, path):
+            return blob
+        # 无法硬链接（跨文件系统等）：复制一份到成员目录
+        if tmp_file.exists():
+            os.replace(tmp_file, path)
+        else:
+            _copy(blob, path)
+        return None
+
+
+def _copy(src: Path, dst: Path):
+    tmp = dst.with_name(dst.name + ".copy")
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            chunk = fin.read(1024 * 1024)
+            if not chunk:
+                break
+            fout.write(chunk)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, dst)
+
+
+_store: BlobStore | None = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        _store = BlobStore(BLOB_DIR)
+    return _store
@@ -0,0 +1,50 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """按规范化查询参数缓存已序列化的响应（LRU）。
+    每个条目记录生成时的数据代数（generation，即消息变更序号），消息插入或内容变化后代数递增，旧条目自然失效。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[int, bytes, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(path: str, params: Dict[str, Any]) -> Tuple:
+        return (path,) + tuple(sorted((k, str(v)) for k, v in params.items() if v is not None))
+
+    @staticmethod
+    def etag(key: Tuple, generation: int) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+        return f'W/"{generation}-{digest}"'
+
+    @staticmethod
+    def matches(if_none_match: str | None, etag: str) -> bool:
+        if not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    def get(self, key: Tuple, generation: int) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: Tuple, generation: int, body: bytes, headers: Dict[str, str]):
+        with self._lock:
+            self._entries[key] = (generation, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,20 +1,142 @@
+import os
 from pathlib import Path
 
 # 基础配置
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "data"
+# 数据目录可用环境变量 MESSAGE_BACKEND_DATA_DIR 指定（压测与本地模拟时使用独立目录）
+DATA_DIR = Path(os.environ.get("MESSAGE_BACKEND_DATA_DIR") or BASE_DIR / "data")
 MESSAGE_DIR = DATA_DIR / "messages"
 DB_PATH = DATA_DIR / "app.db"
+# 媒体内容寻址存储（按 SHA-256 去重），成员目录中的文件为指向这里的硬链接
+BLOB_DIR = DATA_DIR / "blobs"
+# 缩略图与视频封面缓存（派生文件，可随时删除）
+THUMB_DIR = DATA_DIR / "thumbs"
 
 # 文件服务器基础URL（可按需改为你的域名）
 # 需求指定：file.densu.cc/data/messages/{membername}/{file}
 # 如需在本机访问，可改为 http://localhost:8000
 FILE_BASE_URL = "http://file.densu.cc"
 
+# 上游接口地址（按组）；设置环境变量 MESSAGE_BACKEND_API_BASE_URL 时所有组统一指向该地址（如本地模拟器 bench/simulator.py）
+API_BASE_URL = {
+    "nogi": "https://api.n46.glastonr.net",
+    "saku": "https://api.s46.glastonr.net",
+    "hina": "https://api.kh.glastonr.net",
+}
+if os.environ.get("MESSAGE_BACKEND_API_BASE_URL"):
+    API_BASE_URL = {grp: os.environ["MESSAGE_BACKEND_API_BASE_URL"].rstrip("/") for grp in API_BASE_URL}
+
 # 目录确保存在
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 MESSAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 # 定时任务配置说明（具体在main中配置CronTrigger）
 # gettoken: 0-7不执行；8-23每10分钟
-# getmessage: 0-7不执行；8-19每小时；20-23每10分钟
\ No newline at end of file
+# getmessage: 默认使用自适应轮询（见下方 POLL_*）；ADAPTIVE_POLLING = False 时恢复固定窗口：
+#   0-7不执行；8-19每小时；20-23每10分钟
+
+# 抓取并发配置
+# 每个组同时抓取的成员时间线数量
+MEMBER_CONCURRENCY = 8
+# 媒体下载阶段的并发数与队列长度（有界，避免大量视频同时占用带宽和内存）
+MEDIA_CONCURRENCY = 4
+MEDIA_QUEUE_SIZE = 64
+# 时间线分页：每页条数与单个成员单次抓取的最大页数（防止异常数据导致无限翻页）
+TIMELINE_PAGE_SIZE = 100
+TIMELINE_MAX_PAGES = 1000
+# 历史回填：时间窗口天数与并发窗口数
+BACKFILL_WINDOW_DAYS = 30
+BACKFILL_CONCURRENCY = 4
+
+# 媒体下载分块大小（流式写入临时文件，峰值内存与文件大小无关）
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# access token 管理：接口未返回 expires_in 时的默认有效期、提前刷新余量、每组保留的历史记录数
+TOKEN_TTL_SECONDS = 30 * 60
+TOKEN_REFRESH_MARGIN = 5 * 60
+TOKEN_KEEP_ROWS = 10
+
+# 数据库只读连接池大小（API 查询使用；写入使用单独的写连接）
+DB_READ_POOL_SIZE = 4
+
+# 后台任务：进度写入数据库的最小间隔（秒）；心跳超过该时长未更新的运行视为已中断
+JOB_PROGRESS_INTERVAL = 2
+JOB_STALE_SECONDS = 10 * 60
+# 运行中的任务即使没有进度事件（长视频下载、限速等待）也按此间隔（秒）刷新心跳，需远小于 JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = 30
+
+# /messages 响应缓存条目数（按查询参数，数据代数变化后自动失效）
+RESPONSE_CACHE_SIZE = 256
+
+# 新消息推送（SSE）：变更日志保留条数、API 进程检查变更的间隔（秒）、
+# 每个订阅者的缓冲队列长度（消费过慢时断开，由客户端凭 Last-Event-ID 重连补齐）、心跳间隔（秒）
+MESSAGE_EVENTS_KEEP = 100000
+EVENTS_POLL_INTERVAL = 0.5
+SSE_QUEUE_SIZE = 1000
+SSE_HEARTBEAT_SECONDS = 15
+# 跟踪变更日志出错（数据库锁定、磁盘错误等）后的最长重试间隔（秒），从 EVENTS_POLL_INTERVAL 起逐次加倍
+EVENTS_ERROR_BACKOFF_MAX = 30
+
+# 批量导出每批读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+# 文字内容的文件存储方式（数据库中始终保存文字）：
+# files   - 旧版布局（默认）：每条消息一个 .txt 文件（便于直接浏览文件夹）
+# archive - 每个成员按月追加到压缩归档 {yyyyMM}.jsonl.gz（附 .idx 偏移索引），文件数量少，便于备份；
+#           需手动启用，已有数据可用 python main.py --compact-text 迁移
+TEXT_STORAGE = "files"
+
+# 自适应轮询：按成员历史发帖分布（星期 x 小时）决定各自的轮询间隔，并受每组请求预算约束
+ADAPTIVE_POLLING = True
+# 调度器检查到期成员的间隔（秒）
+POLL_TICK_SECONDS = 60
+# 单个成员轮询间隔上下限（秒）
+POLL_MIN_INTERVAL = 2 * 60
+POLL_MAX_INTERVAL = 2 * 60 * 60
+# 期望每次轮询平均取到的新消息数：间隔 ≈ 该值 / 当前时段的预计发帖速率
+POLL_TARGET_MESSAGES = 0.5
+# 统计发帖分布的回看天数，及重新统计的间隔（秒）
+POLL_HISTORY_DAYS = 56
+POLL_MODEL_REFRESH_SECONDS = 60 * 60
+# 每组每小时最多轮询的成员次数，以及可累积的突发额度
+POLL_BUDGET_PER_HOUR = 120
+POLL_BUDGET_BURST = 40
+# 连续无新消息时间隔按 2^n 退避，n 的上限
+POLL_BACKOFF_MAX_EXP = 4
+
+# 分片抓取（main.py --scheduler --worker）：各调度器进程通过租约表分摊成员
+# 租约有效期（秒）：持有者超过该时长未续约（进程退出）后，成员由其它进程接管
+WORKER_LEASE_SECONDS = 60
+# 续约与重新均衡的间隔（秒），应明显小于 WORKER_LEASE_SECONDS
+WORKER_HEARTBEAT_SECONDS = 15
+
+# 上游请求保护（按主机）：令牌桶速率（每秒请求数）与突发量；收到 429 时速率减半，不低于 UPSTREAM_MIN_RATE
+UPSTREAM_RATE = 10.0
+UPSTREAM_MIN_RATE = 0.5
+UPSTREAM_BURST = 20
+# 429/5xx/连接错误的最大尝试次数，以及指数退避的基数与上限（秒，带全抖动；有 Retry-After 时优先）
+UPSTREAM_MAX_ATTEMPTS = 4
+UPSTREAM_BACKOFF_BASE = 0.5
+UPSTREAM_BACKOFF_MAX = 30
+# 熔断：连续失败的请求数阈值（每个请求按重试后的最终结果计一次），以及暂停该主机的时长（秒）
+UPSTREAM_BREAKER_THRESHOLD = 5
+UPSTREAM_BREAKER_COOLDOWN = 60
+
+# 指标：调度器进程把本进程指标写入数据库的间隔（秒），API 进程的 /metrics 一并输出
+METRICS_PUSH_SECONDS = 15
+
+# 抓取台账（ingest_runs）保留的最近运行次数
+INGEST_RUNS_KEEP = 10000
+
+# 缩略图（GET /media/{msg_id}/thumb?w=...）：请求的宽度向上取整到以下档位之一，限制变体数量
+THUMB_WIDTHS = (160, 320, 640, 1280)
+# 抓取时预先生成的宽度（空元组表示只在首次请求时生成）
+THUMB_PREGENERATE_WIDTHS = (320,)
+# 生成缩略图的进程数与 JPEG 质量
+THUMB_WORKERS = 2
+THUMB_QUALITY = 80
+# 缩略图缓存总大小上限（字节），超出后按最近访问时间淘汰
+THUMB_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# 截取视频封面使用的 ffmpeg 可执行文件，及截取的时间点（秒，视频更短时取第一帧）
+THUMB_FFMPEG = "ffmpeg"
+THUMB_VIDEO_SEEK = 1.0
@@ -1,18 +1,199 @@
+import asyncio
+import base64
+import functools
+import json
+import os
+import queue
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Any, Iterable, Iterator, Tuple
 from pathlib import Path
 
-from .config import DB_PATH
+from .metrics import SQLITE_COMMIT_SECONDS, SQLITE_WRITE_SECONDS
+from .config import DB_PATH, DB_READ_POOL_SIZE, MESSAGE_EVENTS_KEEP, FILE_BASE_URL
+
+
+# 非数字 msg_id 的排序键：排在所有数字 msg_id 之后
+NON_NUMERIC_SEQ = 2 ** 63 - 1
+
+
+def msg_seq(msg_id: str | None) -> int:
+    """msg_id 的数字排序键（msg_id 为 TEXT，直接排序会出现 "10" < "9"）。"""
+    s = str(msg_id or "")
+    return int(s) if s.isdigit() and len(s) < 19 else NON_NUMERIC_SEQ
+
+
+def encode_cursor(seq: int, row_id: int) -> str:
+    """分页游标：对 (msg_seq, id) 编码，对调用方不透明。"""
+    return base64.urlsafe_b64encode(f"{seq}:{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """解析 encode_cursor 生成的游标，格式错误时抛出 ValueError。"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        seq, row_id = raw.split(":", 1)
+        return int(seq), int(row_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+
+
+def encode_rank_cursor(rank: float, row_id: int) -> str:
+    """检索分页游标：对 (相关度, id) 编码。"""
+    return base64.urlsafe_b64encode(f"{rank!r}:{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, row_id = raw.split(":", 1)
+        return float(rank), int(row_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+
+
+def _published_at_from_path(file_path: str | None) -> str | None:
+    # 文件名形如：{msg_id}_{typeIndex}_{yyyyMMddHHmmss}.ext
+    parts = os.path.splitext(os.path.basename(file_path or ""))[0].split("_")
+    if len(parts) >= 3 and parts[2][:14].isdigit():
+        return parts[2][:14]
+    return None
+
+
+def _locked(fn):
+    """写连接只允许一个线程同时使用（APScheduler、抓取流水线与API线程共享同一个 Database）。"""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+_UPSERT_MESSAGE_SQL = """
+INSERT INTO messages (msg_id, message_type, text_content, file_path, grp, member_id, member_name, created_at, published_at, msg_seq)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(msg_id) DO UPDATE SET
+  -- 如果这次有文件，则以这次的类型为准；否则保留原类型
+  message_type = CASE WHEN excluded.file_path IS NOT NULL AND excluded.file_path <> '' THEN excluded.message_type ELSE messages.message_type END,
+  -- 文本内容：优先使用非空的新值，否则保留原值，避免被空覆盖
+  text_content = COALESCE(NULLIF(excluded.text_content, ''), messages.text_content),
+  -- 文件路径：如果这次有文件则更新，否则保留原值
+  file_path = COALESCE(NULLIF(excluded.file_path, ''), messages.file_path),
+  -- 其余字段优先新值，否则保留原值
+  grp = COALESCE(NULLIF(excluded.grp, ''), messages.grp),
+  member_id = COALESCE(NULLIF(excluded.member_id, ''), messages.member_id),
+  member_name = COALESCE(NULLIF(excluded.member_name, ''), messages.member_name),
+  published_at = COALESCE(NULLIF(excluded.published_at, ''), messages.published_at),
+  msg_seq = excluded.msg_seq
+"""
+
+
+# /messages 快速路径只取输出需要的列；file_path 只对有文件的媒体消息返回（文本消息不返回 URL）
+_MESSAGE_ITEM_COLUMNS = """
+COALESCE(msg_id, ''), message_type, text_content, grp, member_id, member_name,
+CASE WHEN message_type IN ('image', 'audio', 'video') AND file_path <> '' THEN file_path END,
+created_at, published_at, msg_seq, id
+"""
+
+
+def message_items(rows: List[tuple]) -> Tuple[List[Dict[str, Any]], Tuple[int, int] | None]:
+    """把 list_message_rows 的元组行转换为 /messages 输出字典（每行只构造一次，字段与 main._to_message_out 一致）。
+    返回 (items, 最后一行的 (msg_seq, id))，后者用于生成下一页游标。
+    """
+    url_prefix = f"{FILE_BASE_URL}/data/messages/"
+    basename = os.path.basename
+    items = [
+        {
+            "msg_id": mid,
+            "msg_type": mt,
+            "text_content": text,
+            "grp": group,
+            "member_id": member,
+            "member_name": name,
+            "url": f"{url_prefix}{name or ''}/{basename(fp)}" if fp else None,
+            "created_at": created,
+            "published_at": published,
+        }
+        for mid, mt, text, group, member, name, fp, created, published, _, _ in rows
+    ]
+    return items, (rows[-1][-2], rows[-1][-1]) if rows else None
 
 
 class Database:
-    def __init__(self, db_path: Path):
+    """连接池：一个写连接（加锁串行使用）+ 若干只读连接（WAL 模式下与写入并发）。
+    异步接口中通过 arun() 把查询放到专用线程池执行，不阻塞事件循环。
+    """
+
+    def __init__(self, db_path: Path, read_pool_size: int = DB_READ_POOL_SIZE):
         self.db_path = db_path
-        # 允许跨线程访问同一连接，适配 APScheduler 在线程中执行任务
+        # 写连接允许跨线程访问，由 _lock 保证同一时刻只有一个线程使用
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
         self.conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        # 事务嵌套深度：在 transaction() 内的写操作不单独提交
+        self._tx_depth = 0
+        # SQLite 编译时未启用 FTS5/trigram 时为 False，检索接口不可用
+        self.fts_enabled = False
+        # 只读连接池按需创建（需在 init_db 建表并开启 WAL 之后）
+        self._read_pool_size = read_pool_size
+        self._readers: queue.Queue = queue.Queue()
+        self._readers_created = 0
+        self._readers_guard = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=read_pool_size + 1, thread_name_prefix="db")
+
+    @contextmanager
+    def transaction(self) -> Iterator["Database"]:
+        """将多次写操作合并为一个事务（一次提交）；支持嵌套，最外层退出时提交，异常时回滚。"""
+        with self._lock:
+            self._tx_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self.conn.rollback()
+                raise
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                with SQLITE_COMMIT_SECONDS.time():
+                    self.conn.commit()
 
+    def open_reader(self) -> sqlite3.Connection:
+        """新建一个只读连接（连接池与需要独占连接的调用方使用）。"""
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """借用一个只读连接；池中没有空闲连接且未达到上限时新建，否则等待归还。"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_guard:
+                create = self._readers_created < self._read_pool_size
+                if create:
+                    self._readers_created += 1
+            conn = self.open_reader() if create else self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    async def arun(self, fn: Callable, *args, **kwargs):
+        """在数据库线程池中执行同步方法，供 async 接口调用。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def _commit(self):
+        if self._tx_depth == 0:
+            with SQLITE_COMMIT_SECONDS.time():
+                self.conn.commit()
+
+    @_locked
     def init_db(self):
         cur = self.conn.cursor()
         # 提升并发读写能力
@@ -31,6 +212,13 @@ class Database:
             );
             """
         )
+        try:
+            token_cols = {row[1] for row in cur.execute("PRAGMA table_info(tokens)").fetchall()}
+            if "expires_at" not in token_cols:
+                cur.execute("ALTER TABLE tokens ADD COLUMN expires_at TEXT")
+        except Exception:
+            pass
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_grp ON tokens(grp, id)")
 
         # 消息：文字消息内容也保存在数据库；图片/语音/视频保存文件路径在数据库
         # 增加分组与成员信息，便于查询
@@ -46,11 +234,14 @@ class Database:
                 member_name TEXT,
                 msg_id TEXT,
                 published_at TEXT,          -- 消息发布时间：yyyyMMddHHmmss
-                created_at TEXT NOT NULL
+                created_at TEXT NOT NULL,
+                msg_seq INTEGER,            -- msg_id 的数字排序键
+                change_seq INTEGER          -- 最近一次插入或内容变化时的变更序号（触发器维护，增量同步使用）
             );
             """
         )
         # 兼容旧库：如果缺少列则动态添加
+        migrate_change_seq = False
         try:
             info = cur.execute("PRAGMA table_info(messages)").fetchall()
             cols = {row[1] for row in info}
@@ -58,6 +249,12 @@ class Database:
                 cur.execute("ALTER TABLE messages ADD COLUMN msg_id TEXT")
             if "published_at" not in cols:
                 cur.execute("ALTER TABLE messages ADD COLUMN published_at TEXT")
+            if "msg_seq" not in cols:
+                cur.execute("ALTER TABLE messages ADD COLUMN msg_seq INTEGER")
+                self._migrate_msg_seq(cur)
+            if "change_seq" not in cols:
+                cur.execute("ALTER TABLE messages ADD COLUMN change_seq INTEGER")
+                migrate_change_seq = True
         except Exception:
             pass
         # 为 msg_id 建唯一索引，确保同一消息仅一条记录
@@ -65,17 +262,401 @@ class Database:
             cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_msg_id ON messages(msg_id)")
         except Exception:
             pass
+        # 查询索引：按 msg_id 数字顺序的游标分页、按日期/成员/成员名过滤
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_seq ON messages(msg_seq, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_published_at ON messages(published_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_member_published ON messages(grp, member_id, published_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_member_name ON messages(member_name)")
+        # 按组/成员过滤的游标分页：等值条件后紧跟排序键，直接按索引顺序读取，无需临时排序
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_grp_member_seq ON messages(grp, member_id, msg_seq, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_member_seq ON messages(member_id, msg_seq, id)")
+        # 全文检索：FTS5 外部内容表 + trigram 分词（适合日文等无空格文本），由触发器与 messages 保持同步
+        self.fts_enabled = self._init_fts(cur)
+        # 每个成员的同步游标：记录已入库的最新发布时间，替代扫描目录文件
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_cursors (
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                last_published_at TEXT,
+                last_msg_id TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (grp, member_id)
+            );
+            """
+        )
+        # 历史回填进度：按时间窗口记录，便于中断后续跑
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backfill_windows (
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                window_start TEXT NOT NULL,
+                window_end TEXT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                done_at TEXT NOT NULL,
+                PRIMARY KEY (grp, member_id, window_start)
+            );
+            """
+        )
+        # 消息变更日志：messages 插入或内容变化时由触发器追加，API 进程据此向订阅者推送（跨进程）
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS message_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                row_id INTEGER NOT NULL,     -- messages.id
+                grp TEXT,
+                member_id TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS message_events_ai AFTER INSERT ON messages BEGIN
+              INSERT INTO message_events (row_id, grp, member_id, created_at)
+              VALUES (new.id, new.grp, new.member_id, strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+            END;
+            CREATE TRIGGER IF NOT EXISTS message_events_au AFTER UPDATE ON messages
+            WHEN old.text_content IS NOT new.text_content
+              OR old.file_path IS NOT new.file_path
+              OR old.message_type IS NOT new.message_type BEGIN
+              INSERT INTO message_events (row_id, grp, member_id, created_at)
+              VALUES (new.id, new.grp, new.member_id, strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+            END;
+            """
+        )
+        # 旧版的数据代数表（每次写入提交都递增），已由变更序号代替
+        cur.execute("DROP TABLE IF EXISTS data_generation")
+        # 变更序号：任何写入路径插入消息或改变其内容（类型、文字、文件、发布时间、成员名）时，由触发器分配新的序号；
+        # change_counter.seq 同时作为数据代数，API 响应缓存与 ETag 据此判断数据是否变化（跨进程可见，无变化的重复写入不递增）
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS change_counter (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                seq INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO change_counter (id, seq) VALUES (1, 0);
+            CREATE INDEX IF NOT EXISTS idx_messages_change_seq ON messages(change_seq);
+            CREATE TRIGGER IF NOT EXISTS messages_change_ai AFTER INSERT ON messages BEGIN
+              UPDATE change_counter SET seq = seq + 1 WHERE id = 1;
+              UPDATE messages SET change_seq = (SELECT seq FROM change_counter WHERE id = 1) WHERE id = new.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_change_au AFTER UPDATE ON messages
+            WHEN old.text_content IS NOT new.text_content
+              OR old.file_path IS NOT new.file_path
+              OR old.message_type IS NOT new.message_type
+              OR old.published_at IS NOT new.published_at
+              OR old.member_name IS NOT new.member_name BEGIN
+              UPDATE change_counter SET seq = seq + 1 WHERE id = 1;
+              UPDATE messages SET change_seq = (SELECT seq FROM change_counter WHERE id = 1) WHERE id = new.id;
+            END;
+            """
+        )
+        if migrate_change_seq:
+            # 旧库升级：已有记录按插入顺序编号
+            cur.execute("UPDATE messages SET change_seq = id")
+        cur.execute(
+            "UPDATE change_counter SET seq = MAX(seq, COALESCE((SELECT MAX(change_seq) FROM messages), 0)) WHERE id = 1"
+        )
+        self._init_message_stats(cur)
+        # 后台任务：手动触发与定时任务共用，同一类任务同时只允许一个运行（部分唯一索引跨进程保证）
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,          -- getmessage | gettoken
+                shard TEXT NOT NULL DEFAULT '', -- 分片抓取时为执行进程，同一分片内单飞；'' 表示不分片
+                status TEXT NOT NULL,        -- running | succeeded | failed
+                owner TEXT,                  -- 执行进程：host:pid
+                progress TEXT,               -- JSON
+                result TEXT,                 -- JSON
+                error TEXT,
+                started_at TEXT NOT NULL,
+                heartbeat_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+            """
+        )
+        job_cols = {row[1] for row in cur.execute("PRAGMA table_info(jobs)").fetchall()}
+        if "shard" not in job_cols:
+            cur.execute("ALTER TABLE jobs ADD COLUMN shard TEXT NOT NULL DEFAULT ''")
+        cur.execute("DROP INDEX IF EXISTS idx_jobs_running")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_running_shard ON jobs(kind, shard) WHERE status = 'running'")
+        # 分片抓取：存活的调度器进程（心跳）与成员租约，每个成员同一时刻只属于一个进程
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS workers (
+                owner TEXT PRIMARY KEY,      -- host:pid
+                started_at TEXT NOT NULL,
+                heartbeat_at TEXT NOT NULL,
+                requested_at TEXT            -- 手动触发的抓取请求，由该进程下一次心跳领取
+            );
+            CREATE TABLE IF NOT EXISTS member_leases (
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                acquired_at TEXT NOT NULL,
+                expires_at TEXT NOT NULL,
+                PRIMARY KEY (grp, member_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_member_leases_owner ON member_leases(owner);
+            """
+        )
+        worker_cols = {row[1] for row in cur.execute("PRAGMA table_info(workers)").fetchall()}
+        if "requested_at" not in worker_cols:
+            cur.execute("ALTER TABLE workers ADD COLUMN requested_at TEXT")
+        # 媒体下载记录：保存期望大小与校验和，用于识别未下载完整的文件
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_files (
+                file_path TEXT PRIMARY KEY,
+                file_url TEXT,
+                expected_size INTEGER,
+                sha256 TEXT,
+                etag TEXT,
+                completed_at TEXT NOT NULL
+            );
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_media_files_url ON media_files(file_url)")
+        # 待下载的媒体：与消息记录在同一事务中登记，下载完成后删除；同步游标越过的消息仍可在下次抓取时续传
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pending_media (
+                file_path TEXT PRIMARY KEY,
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                file_url TEXT NOT NULL,
+                timeout REAL,
+                record TEXT NOT NULL,        -- JSON：下载完成后 upsert_message 的参数（不含 file_path）
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pending_media_member ON pending_media(grp, member_id);
+            """
+        )
+        # 缩略图缓存索引：记录大小与最近访问时间，API 与调度器进程共用，按 LRU 淘汰
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                path TEXT PRIMARY KEY,       -- THUMB_DIR 下的相对路径
+                size INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                last_access TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_thumbnails_last_access ON thumbnails(last_access);
+            """
+        )
+        # 抓取台账：每次运行一行汇总，另有每个成员一行明细，用于追踪耗时变化与漏抓
+        cur.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,          -- getmessage
+                job_id TEXT,                 -- jobs.id；命令行直接运行时为空
+                status TEXT NOT NULL,        -- running | succeeded | failed
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                duration REAL,               -- 秒
+                members INTEGER,
+                messages INTEGER,
+                counts TEXT,                 -- JSON：按消息类型的条数
+                bytes_downloaded INTEGER,
+                stages TEXT,                 -- JSON：各阶段累计耗时（秒，所有成员之和）
+                errors TEXT                  -- JSON
+            );
+            CREATE TABLE IF NOT EXISTS ingest_run_members (
+                run_id INTEGER NOT NULL,
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                member_name TEXT,
+                started_at TEXT,
+                finished_at TEXT,
+                duration REAL,
+                cursor_from TEXT,            -- 本次使用的同步游标
+                cursor_to TEXT,              -- 本次取到的最新发布时间
+                pages INTEGER,
+                messages INTEGER,
+                counts TEXT,
+                bytes_downloaded INTEGER,
+                stages TEXT,
+                errors TEXT,
+                PRIMARY KEY (run_id, grp, member_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_ingest_run_members_member ON ingest_run_members(grp, member_id, run_id);
+            """
+        )
+        # 指标快照：调度器等非 API 进程定期写入，API 进程的 /metrics 合并输出
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                process TEXT PRIMARY KEY,
+                data TEXT NOT NULL,          -- JSON
+                updated_at TEXT NOT NULL
+            );
+            """
+        )
         self.conn.commit()
 
-    def save_token(self, token: str, grp: str | None = None) -> int:
+    def _init_fts(self, cur: sqlite3.Cursor) -> bool:
+        exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        try:
+            cur.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    text_content, content='messages', content_rowid='id', tokenize='trigram'
+                )
+                """
+            )
+        except sqlite3.OperationalError:
+            return False
+        cur.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+              INSERT INTO messages_fts(rowid, text_content) VALUES (new.id, new.text_content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+              INSERT INTO messages_fts(messages_fts, rowid, text_content) VALUES ('delete', old.id, old.text_content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text_content ON messages
+            WHEN old.text_content IS NOT new.text_content BEGIN
+              INSERT INTO messages_fts(messages_fts, rowid, text_content) VALUES ('delete', old.id, old.text_content);
+              INSERT INTO messages_fts(rowid, text_content) VALUES (new.id, new.text_content);
+            END;
+            """
+        )
+        if not exists:
+            # 首次创建时为已有消息建立索引
+            cur.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return True
+
+    def _init_message_stats(self, cur: sqlite3.Cursor):
+        """按 (组, 成员, 日, 类型) 汇总的消息统计，由触发器在写入消息的同一事务中维护。
+        只统计 grp、member_id、published_at 都有值的消息；类型或发布时间变化时从旧分组移出、计入新分组，
+        移出的恰好是分组的首条/末条时，借助 idx_messages_member_published 重新计算该分组的首末时间。
+        """
+        exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_stats'").fetchone()
+        remove_old = """
+              UPDATE message_stats SET count = count - 1
+              WHERE grp = old.grp AND member_id = old.member_id AND day = substr(old.published_at, 1, 8) AND message_type = old.message_type;
+              DELETE FROM message_stats
+              WHERE grp = old.grp AND member_id = old.member_id AND day = substr(old.published_at, 1, 8) AND message_type = old.message_type
+                AND count <= 0;
+              UPDATE message_stats SET
+                first_published_at = (
+                  SELECT MIN(published_at) FROM messages
+                  WHERE grp = old.grp AND member_id = old.member_id AND message_type = old.message_type
+                    AND published_at BETWEEN substr(old.published_at, 1, 8) AND substr(old.published_at, 1, 8) || '999999'),
+                last_published_at = (
+                  SELECT MAX(published_at) FROM messages
+                  WHERE grp = old.grp AND member_id = old.member_id AND message_type = old.message_type
+                    AND published_at BETWEEN substr(old.published_at, 1, 8) AND substr(old.published_at, 1, 8) || '999999')
+              WHERE grp = old.grp AND member_id = old.member_id AND day = substr(old.published_at, 1, 8) AND message_type = old.message_type
+                AND (first_published_at = old.published_at OR last_published_at = old.published_at);
+        """
+        add_new = """
+              INSERT INTO message_stats (grp, member_id, day, message_type, count, first_published_at, last_published_at)
+              SELECT new.grp, new.member_id, substr(new.published_at, 1, 8), new.message_type, 1, new.published_at, new.published_at
+              WHERE new.grp IS NOT NULL AND new.member_id IS NOT NULL AND new.published_at IS NOT NULL
+              ON CONFLICT(grp, member_id, day, message_type) DO UPDATE SET
+                count = count + 1,
+                first_published_at = MIN(first_published_at, excluded.first_published_at),
+                last_published_at = MAX(last_published_at, excluded.last_published_at);
+        """
+        cur.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS message_stats (
+                grp TEXT NOT NULL,
+                member_id TEXT NOT NULL,
+                day TEXT NOT NULL,               -- yyyyMMdd（published_at 的日期部分）
+                message_type TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                first_published_at TEXT NOT NULL,
+                last_published_at TEXT NOT NULL,
+                PRIMARY KEY (grp, member_id, day, message_type)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_message_stats_day ON message_stats(day);
+            CREATE TRIGGER IF NOT EXISTS message_stats_ai AFTER INSERT ON messages BEGIN
+              {add_new}
+            END;
+            CREATE TRIGGER IF NOT EXISTS message_stats_ad AFTER DELETE ON messages BEGIN
+              {remove_old}
+            END;
+            CREATE TRIGGER IF NOT EXISTS message_stats_au AFTER UPDATE OF message_type, published_at, grp, member_id ON messages
+            WHEN old.message_type IS NOT new.message_type
+              OR old.published_at IS NOT new.published_at
+              OR old.grp IS NOT new.grp
+              OR old.member_id IS NOT new.member_id BEGIN
+              {remove_old}
+              {add_new}
+            END;
+            """
+        )
+        if not exists:
+            # 首次创建时汇总已有消息
+            self._fill_message_stats(cur)
+
+    def _fill_message_stats(self, cur: sqlite3.Cursor):
+        cur.execute("DELETE FROM message_stats")
+        cur.execute(
+            """
+            INSERT INTO message_stats (grp, member_id, day, message_type, count, first_published_at, last_published_at)
+            SELECT grp, member_id, substr(published_at, 1, 8), message_type, COUNT(*), MIN(published_at), MAX(published_at)
+            FROM messages
+            WHERE grp IS NOT NULL AND member_id IS NOT NULL AND published_at IS NOT NULL
+            GROUP BY grp, member_id, substr(published_at, 1, 8), message_type
+            """
+        )
+
+    @_locked
+    def rebuild_message_stats(self) -> int:
+        """从 messages 全量重建统计表（一次性修复用），返回统计行数。"""
+        with self.transaction():
+            cur = self.conn.cursor()
+            self._fill_message_stats(cur)
+            return cur.execute("SELECT COUNT(*) FROM message_stats").fetchone()[0]
+
+    def _migrate_msg_seq(self, cur: sqlite3.Cursor):
+        """旧库升级：填充 msg_seq；缺少 published_at 的旧记录从文件名补齐，使日期过滤可在 SQL 中完成。"""
+        rows = cur.execute("SELECT id, msg_id, file_path, published_at FROM messages").fetchall()
+        cur.executemany(
+            "UPDATE messages SET msg_seq = ?, published_at = ? WHERE id = ?",
+            [
+                (msg_seq(r["msg_id"]), r["published_at"] or _published_at_from_path(r["file_path"]), r["id"])
+                for r in rows
+            ],
+        )
+
+    @_locked
+    def save_token(self, token: str, grp: str | None = None, expires_at: str | None = None) -> int:
         cur = self.conn.cursor()
         cur.execute(
-            "INSERT INTO tokens(token, grp, created_at) VALUES (?, ?, ?)",
-            (token, grp, datetime.utcnow().isoformat()),
+            "INSERT INTO tokens(token, grp, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (token, grp, datetime.utcnow().isoformat(), expires_at),
         )
         self.conn.commit()
         return cur.lastrowid
 
+    @_locked
+    def latest_token(self, grp: str) -> Dict[str, Any] | None:
+        row = self.conn.execute(
+            "SELECT token, created_at, expires_at FROM tokens WHERE grp = ? ORDER BY id DESC LIMIT 1",
+            (grp,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    @_locked
+    def prune_tokens(self, grp: str, keep: int = 10) -> int:
+        """仅保留该组最近 keep 条 token 记录，返回删除条数。"""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            DELETE FROM tokens WHERE grp = ? AND id NOT IN (
+                SELECT id FROM tokens WHERE grp = ? ORDER BY id DESC LIMIT ?
+            )
+            """,
+            (grp, grp, keep),
+        )
+        self.conn.commit()
+        return cur.rowcount
+
+    @_locked
     def save_text_message(
         self,
         text: str,
@@ -88,19 +669,15 @@ class Database:
         cur = self.conn.cursor()
         cur.execute(
             """
-            INSERT INTO messages(message_type, text_content, file_path, created_at)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO messages(message_type, text_content, file_path, grp, member_id, member_name, msg_id, created_at, msg_seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            ("text", text, file_path, datetime.utcnow().isoformat()),
+            ("text", text, file_path, grp, member_id, member_name, msg_id, datetime.utcnow().isoformat(), msg_seq(msg_id)),
         )
-        # 更新新增列（为保持兼容，使用UPDATE填充）
-        cur.execute(
-            "UPDATE messages SET grp = ?, member_id = ?, member_name = ?, msg_id = ? WHERE id = last_insert_rowid()",
-            (grp, member_id, member_name, msg_id),
-        )
-        self.conn.commit()
+        self._commit()
         return cur.lastrowid
 
+    @_locked
     def save_media_message(
         self,
         media_type: str,
@@ -113,16 +690,12 @@ class Database:
         cur = self.conn.cursor()
         cur.execute(
             """
-            INSERT INTO messages(message_type, text_content, file_path, created_at)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO messages(message_type, text_content, file_path, grp, member_id, member_name, msg_id, created_at, msg_seq)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (media_type, None, file_path, datetime.utcnow().isoformat()),
+            (media_type, None, file_path, grp, member_id, member_name, msg_id, datetime.utcnow().isoformat(), msg_seq(msg_id)),
         )
-        cur.execute(
-            "UPDATE messages SET grp = ?, member_id = ?, member_name = ?, msg_id = ? WHERE id = last_insert_rowid()",
-            (grp, member_id, member_name, msg_id),
-        )
-        self.conn.commit()
+        self._commit()
         return cur.lastrowid
 
     def upsert_message(
@@ -136,51 +709,790 @@ class Database:
         member_name: str | None = None,
         published_at: str | None = None,
     ) -> None:
-        cur = self.conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO messages (msg_id, message_type, text_content, file_path, grp, member_id, member_name, created_at, published_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(msg_id) DO UPDATE SET
-              -- 如果这次有文件，则以这次的类型为准；否则保留原类型
-              message_type = CASE WHEN excluded.file_path IS NOT NULL AND excluded.file_path <> '' THEN excluded.message_type ELSE messages.message_type END,
-              -- 文本内容：优先使用非空的新值，否则保留原值，避免被空覆盖
-              text_content = COALESCE(NULLIF(excluded.text_content, ''), messages.text_content),
-              -- 文件路径：如果这次有文件则更新，否则保留原值
-              file_path = COALESCE(NULLIF(excluded.file_path, ''), messages.file_path),
-              -- 其余字段优先新值，否则保留原值
-              grp = COALESCE(NULLIF(excluded.grp, ''), messages.grp),
-              member_id = COALESCE(NULLIF(excluded.member_id, ''), messages.member_id),
-              member_name = COALESCE(NULLIF(excluded.member_name, ''), messages.member_name),
-              published_at = COALESCE(NULLIF(excluded.published_at, ''), messages.published_at)
-            """,
-            (
-                msg_id,
-                msg_type,
-                text_content,
-                file_path,
+        self.bulk_upsert_messages([{
+            "msg_id": msg_id,
+            "msg_type": msg_type,
+            "text_content": text_content,
+            "file_path": file_path,
+            "grp": grp,
+            "member_id": member_id,
+            "member_name": member_name,
+            "published_at": published_at,
+        }])
+
+    @_locked
+    def bulk_upsert_messages(self, records: Iterable[Dict[str, Any]], pending_media: Iterable[Dict[str, Any]] = ()) -> int:
+        """批量写入消息（字段同 upsert_message），一次 executemany、一次提交；
+        同步游标在同一事务中推进到每个成员的最新发布时间。
+        pending_media：本批消息中待下载的媒体（file_path、file_url、timeout、record），同一事务中登记，
+        游标推进后即使下载失败或进程退出，下次抓取仍会重新下载。返回写入条数。
+        """
+        now = datetime.utcnow().isoformat()
+        rows = []
+        # (grp, member_id) -> (published_at, msg_id)
+        latest: Dict[tuple, tuple] = {}
+        for r in records:
+            grp, member_id, published_at = r.get("grp"), r.get("member_id"), r.get("published_at")
+            rows.append((
+                r["msg_id"],
+                r["msg_type"],
+                r.get("text_content"),
+                r.get("file_path"),
                 grp,
                 member_id,
-                member_name,
-                datetime.utcnow().isoformat(),
+                r.get("member_name"),
+                now,
                 published_at,
-            ),
+                msg_seq(r["msg_id"]),
+            ))
+            if grp and member_id and published_at:
+                key = (grp, member_id)
+                if key not in latest or published_at >= latest[key][0]:
+                    latest[key] = (published_at, r["msg_id"])
+        if not rows:
+            return 0
+        with SQLITE_WRITE_SECONDS.time(op="bulk_upsert_messages"), self.transaction():
+            cur = self.conn.cursor()
+            cur.executemany(_UPSERT_MESSAGE_SQL, rows)
+            cur.executemany(
+                """
+                INSERT INTO pending_media (file_path, grp, member_id, file_url, timeout, record, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(file_path) DO UPDATE SET file_url = excluded.file_url, timeout = excluded.timeout, record = excluded.record
+                """,
+                [
+                    (
+                        m["file_path"],
+                        m["record"]["grp"],
+                        m["record"]["member_id"],
+                        m["file_url"],
+                        m.get("timeout"),
+                        json.dumps(m["record"], ensure_ascii=False),
+                        now,
+                    )
+                    for m in pending_media
+                ],
+            )
+            for (grp, member_id), (published_at, msg_id) in latest.items():
+                self._advance_cursor(cur, grp, member_id, published_at, msg_id)
+            # 变更日志只保留最近 MESSAGE_EVENTS_KEEP 条，断线太久的客户端需重新全量拉取
+            cur.execute(
+                "DELETE FROM message_events WHERE seq <= (SELECT MAX(seq) FROM message_events) - ?",
+                (MESSAGE_EVENTS_KEEP,),
+            )
+        return len(rows)
+
+    def get_generation(self) -> int:
+        """当前数据代数（主键读取，供响应缓存比较）：即变更序号，只有消息实际插入或内容变化时才递增。"""
+        with self.reader() as conn:
+            row = conn.execute("SELECT seq FROM change_counter WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def _advance_cursor(self, cur: sqlite3.Cursor, grp: str, member_id: str, published_at: str, msg_id: str | None):
+        cur.execute(
+            """
+            INSERT INTO sync_cursors (grp, member_id, last_published_at, last_msg_id, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(grp, member_id) DO UPDATE SET
+              last_published_at = excluded.last_published_at,
+              last_msg_id = excluded.last_msg_id,
+              updated_at = excluded.updated_at
+            WHERE sync_cursors.last_published_at IS NULL OR excluded.last_published_at >= sync_cursors.last_published_at
+            """,
+            (grp, member_id, published_at, msg_id, datetime.utcnow().isoformat()),
         )
-        self.conn.commit()
 
-    def list_messages(self, limit: int = 100, offset: int = 0, msg_id: str | None = None) -> List[Dict[str, Any]]:
+    @_locked
+    def get_sync_cursor(self, grp: str, member_id: str) -> Dict[str, Any] | None:
+        """读取成员的同步游标（主键查询）；首次使用时从 messages 表重建。"""
+        row = self.conn.execute(
+            "SELECT last_published_at, last_msg_id FROM sync_cursors WHERE grp = ? AND member_id = ?",
+            (grp, member_id),
+        ).fetchone()
+        if row:
+            return dict(row)
+        latest = self.conn.execute(
+            """
+            SELECT published_at, msg_id FROM messages
+            WHERE grp = ? AND member_id = ? AND published_at IS NOT NULL AND published_at <> ''
+            ORDER BY published_at DESC LIMIT 1
+            """,
+            (grp, member_id),
+        ).fetchone()
+        if not latest:
+            return None
         cur = self.conn.cursor()
-        if msg_id:
+        self._advance_cursor(cur, grp, member_id, latest["published_at"], latest["msg_id"])
+        self.conn.commit()
+        return {"last_published_at": latest["published_at"], "last_msg_id": latest["msg_id"]}
+
+    @_locked
+    def get_backfill_windows(self, grp: str, member_id: str) -> Dict[str, str]:
+        """返回已完成的回填窗口：window_start -> window_end"""
+        rows = self.conn.execute(
+            "SELECT window_start, window_end FROM backfill_windows WHERE grp = ? AND member_id = ?",
+            (grp, member_id),
+        ).fetchall()
+        return {r["window_start"]: r["window_end"] for r in rows}
+
+    @_locked
+    def mark_backfill_window(self, grp: str, member_id: str, window_start: str, window_end: str, messages: int) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO backfill_windows (grp, member_id, window_start, window_end, messages, done_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(grp, member_id, window_start) DO UPDATE SET
+              window_end = excluded.window_end,
+              messages = excluded.messages,
+              done_at = excluded.done_at
+            """,
+            (grp, member_id, window_start, window_end, messages, datetime.utcnow().isoformat()),
+        )
+        self.conn.commit()
+
+    @_locked
+    def claim_job(self, kind: str, job_id: str, owner: str, stale_seconds: int, shard: str = "") -> Dict[str, Any]:
+        """登记一次新任务；如同类任务（同一分片）正在运行（心跳未超时）则返回该任务，调用方据此附加到已有运行。
+        心跳超时的运行视为进程已退出，标记为失败后重新登记。
+        """
+        now = datetime.utcnow()
+        stale_before = (now - timedelta(seconds=stale_seconds)).isoformat()
+        with self.transaction():
+            self.conn.execute(
+                """
+                UPDATE jobs SET status = 'failed', error = 'abandoned', finished_at = ?
+                WHERE kind = ? AND shard = ? AND status = 'running' AND heartbeat_at < ?
+                """,
+                (now.isoformat(), kind, shard, stale_before),
+            )
+            try:
+                self.conn.execute(
+                    """
+                    INSERT INTO jobs (id, kind, shard, status, owner, progress, started_at, heartbeat_at)
+                    VALUES (?, ?, ?, 'running', ?, '{}', ?, ?)
+                    """,
+                    (job_id, kind, shard, owner, now.isoformat(), now.isoformat()),
+                )
+            except sqlite3.IntegrityError:
+                pass
+        row = self.conn.execute(
+            "SELECT * FROM jobs WHERE kind = ? AND shard = ? AND status = 'running'", (kind, shard)
+        ).fetchone()
+        return dict(row) if row else self.get_job(job_id)
+
+    @_locked
+    def update_job(
+        self,
+        job_id: str,
+        progress: str | None = None,
+        status: str | None = None,
+        result: str | None = None,
+        error: str | None = None,
+    ) -> None:
+        """更新任务进度（JSON 字符串）并刷新心跳；status 为终态时记录结束时间。"""
+        now = datetime.utcnow().isoformat()
+        finished_at = now if status in ("succeeded", "failed") else None
+        self.conn.execute(
+            """
+            UPDATE jobs SET
+              progress = COALESCE(?, progress),
+              status = COALESCE(?, status),
+              result = COALESCE(?, result),
+              error = COALESCE(?, error),
+              heartbeat_at = ?,
+              finished_at = COALESCE(?, finished_at)
+            WHERE id = ?
+            """,
+            (progress, status, result, error, now, finished_at, job_id),
+        )
+        self._commit()
+
+    @_locked
+    def balance_member_leases(
+        self,
+        owner: str,
+        members: List[Tuple[str, str]],
+        lease_seconds: int,
+        busy: Iterable[Tuple[str, str]] = (),
+    ) -> List[Tuple[str, str]]:
+        """分片抓取的心跳与均衡（一个事务内完成）：
+        - 登记本进程心跳，清理超过 lease_seconds 未心跳的进程；
+        - 每个进程的份额为 ceil(成员数 / 存活进程数)：超出份额时释放多余的租约（busy 中正在抓取的成员除外），
+          不足时认领无人持有或已过期的租约（来自已退出的进程）；
+        - 续约保留的租约。members 为当前配置的全部 (组, 成员ID)，返回本进程持有的成员。
+        """
+        now = datetime.utcnow()
+        now_iso = now.isoformat()
+        expires_at = (now + timedelta(seconds=lease_seconds)).isoformat()
+        configured = set(members)
+        busy = set(busy)
+        with self.transaction():
+            cur = self.conn.cursor()
             cur.execute(
-                "SELECT * FROM messages WHERE msg_id = ? ORDER BY msg_id ASC LIMIT ? OFFSET ?",
-                (msg_id, limit, offset),
+                """
+                INSERT INTO workers (owner, started_at, heartbeat_at) VALUES (?, ?, ?)
+                ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+                """,
+                (owner, now_iso, now_iso),
             )
-        else:
+            dead_before = (now - timedelta(seconds=lease_seconds)).isoformat()
+            # 已退出进程的指标快照（分片模式按进程写入）一并清理
+            cur.execute(
+                "DELETE FROM metrics_snapshots WHERE process IN (SELECT owner FROM workers WHERE heartbeat_at < ?)",
+                (dead_before,),
+            )
+            cur.execute("DELETE FROM workers WHERE heartbeat_at < ?", (dead_before,))
+            live = cur.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+            target = -(-len(configured) // max(live, 1))
+
+            held = [
+                (r[0], r[1])
+                for r in cur.execute(
+                    "SELECT grp, member_id FROM member_leases WHERE owner = ? AND expires_at >= ? ORDER BY grp, member_id",
+                    (owner, now_iso),
+                )
+            ]
+            # 配置中已移除的成员、超出份额的成员：释放
+            release = [k for k in held if k not in configured]
+            held = [k for k in held if k in configured]
+            extra = len(held) - target
+            if extra > 0:
+                for key in reversed(held):
+                    if extra <= 0:
+                        break
+                    if key not in busy:
+                        release.append(key)
+                        extra -= 1
+            cur.executemany(
+                "DELETE FROM member_leases WHERE grp = ? AND member_id = ? AND owner = ?",
+                [(grp, member_id, owner) for grp, member_id in release],
+            )
+            held = [k for k in held if k not in release]
+            cur.execute("UPDATE member_leases SET expires_at = ? WHERE owner = ? AND expires_at >= ?", (expires_at, owner, now_iso))
+
+            if len(held) < target:
+                taken = {
+                    (r[0], r[1])
+                    for r in cur.execute("SELECT grp, member_id FROM member_leases WHERE expires_at >= ?", (now_iso,))
+                }
+                for key in sorted(configured - taken):
+                    if len(held) >= target:
+                        break
+                    cur.execute(
+                        """
+                        INSERT INTO member_leases (grp, member_id, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(grp, member_id) DO UPDATE SET
+                          owner = excluded.owner, acquired_at = excluded.acquired_at, expires_at = excluded.expires_at
+                        WHERE member_leases.expires_at < ?
+                        """,
+                        (key[0], key[1], owner, now_iso, expires_at, now_iso),
+                    )
+                    if cur.rowcount:
+                        held.append(key)
+        return held
+
+    @_locked
+    def request_worker_runs(self, lease_seconds: int) -> List[str]:
+        """手动触发抓取（分片模式）：为每个存活的调度器进程登记一次请求，由各进程在自己的分片内执行。
+        返回收到请求的进程；没有存活进程时返回空列表，调用方在本进程执行。
+        """
+        now = datetime.utcnow()
+        with self.transaction():
+            cur = self.conn.cursor()
             cur.execute(
-                "SELECT * FROM messages ORDER BY msg_id ASC LIMIT ? OFFSET ?",
-                (limit, offset),
+                "UPDATE workers SET requested_at = ? WHERE heartbeat_at >= ?",
+                (now.isoformat(), (now - timedelta(seconds=lease_seconds)).isoformat()),
+            )
+            if not cur.rowcount:
+                return []
+            rows = cur.execute("SELECT owner FROM workers WHERE requested_at = ? ORDER BY owner", (now.isoformat(),)).fetchall()
+        return [r[0] for r in rows]
+
+    @_locked
+    def take_worker_request(self, owner: str) -> bool:
+        """领取本进程的抓取请求（领取后清除），有请求时返回 True。"""
+        with self.transaction():
+            cur = self.conn.execute(
+                "UPDATE workers SET requested_at = NULL WHERE owner = ? AND requested_at IS NOT NULL",
+                (owner,),
             )
-        rows = cur.fetchall()
+            return cur.rowcount > 0
+
+    def list_member_leases(self, owner: str | None = None) -> List[Dict[str, Any]]:
+        """未过期的租约；owner 为空时返回全部。"""
+        sql = "SELECT * FROM member_leases WHERE expires_at >= ?"
+        params: List[Any] = [datetime.utcnow().isoformat()]
+        if owner:
+            sql += " AND owner = ?"
+            params.append(owner)
+        sql += " ORDER BY grp, member_id"
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    @_locked
+    def release_member_leases(self, owner: str) -> None:
+        """进程正常退出时释放全部租约、注销心跳并删除本进程的指标快照，其它进程下一次均衡即可接管。"""
+        with self.transaction():
+            self.conn.execute("DELETE FROM member_leases WHERE owner = ?", (owner,))
+            self.conn.execute("DELETE FROM workers WHERE owner = ?", (owner,))
+            self.conn.execute("DELETE FROM metrics_snapshots WHERE process = ?", (owner,))
+
+    def get_job(self, job_id: str) -> Dict[str, Any] | None:
+        with self.reader() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    @_locked
+    def get_media_file(self, file_path: str) -> Dict[str, Any] | None:
+        row = self.conn.execute("SELECT * FROM media_files WHERE file_path = ?", (file_path,)).fetchone()
+        return dict(row) if row else None
+
+    @_locked
+    def find_media_by_url(self, file_url: str) -> Dict[str, Any] | None:
+        """按源地址查找已完成的下载记录（重新抓取时可直接复用已有内容）。"""
+        row = self.conn.execute(
+            "SELECT * FROM media_files WHERE file_url = ? AND sha256 IS NOT NULL ORDER BY completed_at DESC LIMIT 1",
+            (file_url,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    @_locked
+    def list_pending_media(self, grp: str, member_id: str) -> List[Dict[str, Any]]:
+        """成员尚未下载完成的媒体（record 已解析为字典），按登记时间排序。"""
+        with self.reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM pending_media WHERE grp = ? AND member_id = ? ORDER BY created_at, file_path",
+                (grp, member_id),
+            ).fetchall()
+        return [{**dict(r), "record": json.loads(r["record"])} for r in rows]
+
+    @_locked
+    def complete_media(self, file_path: str, record: Dict[str, Any], manifest: Dict[str, Any] | None = None) -> None:
+        """媒体下载完成：记录下载信息（manifest 为 save_media_file 的参数）、补齐消息的 file_path、删除待下载记录，一个事务。"""
+        with self.transaction():
+            if manifest is not None:
+                self.save_media_file(file_path, **manifest)
+            self.upsert_message(file_path=file_path, **record)
+            self.conn.execute("DELETE FROM pending_media WHERE file_path = ?", (file_path,))
+
+    @_locked
+    def save_media_file(
+        self,
+        file_path: str,
+        file_url: str,
+        expected_size: int,
+        sha256: str,
+        etag: str | None = None,
+    ) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO media_files (file_path, file_url, expected_size, sha256, etag, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+              file_url = excluded.file_url,
+              expected_size = excluded.expected_size,
+              sha256 = excluded.sha256,
+              etag = excluded.etag,
+              completed_at = excluded.completed_at
+            """,
+            (file_path, file_url, expected_size, sha256, etag, datetime.utcnow().isoformat()),
+        )
+        self._commit()
+
+    def get_message(self, msg_id: str) -> Dict[str, Any] | None:
+        with self.reader() as conn:
+            row = conn.execute("SELECT * FROM messages WHERE msg_id = ?", (msg_id,)).fetchone()
+        return dict(row) if row else None
+
+    @_locked
+    def touch_thumbnail(self, path: str, size: int) -> None:
+        """登记或刷新缩略图的最近访问时间。"""
+        now = datetime.utcnow().isoformat()
+        self.conn.execute(
+            """
+            INSERT INTO thumbnails (path, size, created_at, last_access) VALUES (?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access
+            """,
+            (path, size, now, now),
+        )
+        self._commit()
+
+    @_locked
+    def evict_thumbnails(self, max_bytes: int) -> List[str]:
+        """总大小超过 max_bytes 时，按最近访问时间从旧到新删除记录，直到降到上限的 90%；返回需删除的文件。"""
+        with self.transaction():
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+            if total <= max_bytes:
+                return []
+            target = total - int(max_bytes * 0.9)
+            evicted: List[str] = []
+            freed = 0
+            for row in self.conn.execute("SELECT path, size FROM thumbnails ORDER BY last_access ASC"):
+                if freed >= target:
+                    break
+                evicted.append(row["path"])
+                freed += row["size"]
+            self.conn.executemany("DELETE FROM thumbnails WHERE path = ?", [(p,) for p in evicted])
+        return evicted
+
+    @_locked
+    def start_ingest_run(self, kind: str, job_id: str | None = None) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO ingest_runs (kind, job_id, status, started_at) VALUES (?, ?, 'running', ?)",
+            (kind, job_id, datetime.utcnow().isoformat()),
+        )
+        self._commit()
+        return cur.lastrowid
+
+    @_locked
+    def finish_ingest_run(self, run_id: int, summary: Dict[str, Any], members: List[Dict[str, Any]], keep: int = 10000) -> None:
+        """写入运行汇总与成员明细（同一事务），并只保留最近 keep 次运行。"""
+        with self.transaction():
+            self.conn.execute(
+                """
+                UPDATE ingest_runs SET
+                  status = :status, finished_at = :finished_at, duration = :duration, members = :members,
+                  messages = :messages, counts = :counts, bytes_downloaded = :bytes_downloaded,
+                  stages = :stages, errors = :errors
+                WHERE id = :id
+                """,
+                {**summary, "id": run_id, "finished_at": datetime.utcnow().isoformat()},
+            )
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO ingest_run_members (
+                  run_id, grp, member_id, member_name, started_at, finished_at, duration, cursor_from, cursor_to,
+                  pages, messages, counts, bytes_downloaded, stages, errors
+                ) VALUES (
+                  :run_id, :grp, :member_id, :member_name, :started_at, :finished_at, :duration, :cursor_from, :cursor_to,
+                  :pages, :messages, :counts, :bytes_downloaded, :stages, :errors
+                )
+                """,
+                [{**m, "run_id": run_id} for m in members],
+            )
+            self.conn.execute("DELETE FROM ingest_run_members WHERE run_id <= ?", (run_id - keep,))
+            self.conn.execute("DELETE FROM ingest_runs WHERE id <= ?", (run_id - keep,))
+
+    def list_ingest_runs(self, limit: int = 50, before: int | None = None, kind: str | None = None) -> List[Dict[str, Any]]:
+        """按 id 倒序列出运行汇总；before 为上一页最后一个 id。"""
+        sql = "SELECT * FROM ingest_runs"
+        where = []
+        params: List[Any] = []
+        if before is not None:
+            where.append("id < ?")
+            params.append(before)
+        if kind:
+            where.append("kind = ?")
+            params.append(kind)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_ingest_run(self, run_id: int) -> Dict[str, Any] | None:
+        with self.reader() as conn:
+            row = conn.execute("SELECT * FROM ingest_runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            members = conn.execute(
+                "SELECT * FROM ingest_run_members WHERE run_id = ? ORDER BY duration DESC", (run_id,)
+            ).fetchall()
+        return {**dict(row), "member_runs": [dict(m) for m in members]}
+
+    def list_member_runs(self, grp: str, member_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """单个成员最近的抓取明细（按运行倒序），用于观察该成员抓取是否越来越慢。"""
+        with self.reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM ingest_run_members WHERE grp = ? AND member_id = ? ORDER BY run_id DESC LIMIT ?",
+                (grp, member_id, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    @_locked
+    def save_metrics_snapshot(self, process: str, data: str) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO metrics_snapshots (process, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(process) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (process, data, datetime.utcnow().isoformat()),
+        )
+        self._commit()
+
+    def list_metrics_snapshots(self) -> Dict[str, str]:
+        with self.reader() as conn:
+            rows = conn.execute("SELECT process, data FROM metrics_snapshots").fetchall()
+        return {r["process"]: r["data"] for r in rows}
+
+    def list_messages(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        msg_id: str | None = None,
+        date: str | None = None,
+        grp: str | None = None,
+        member_id: str | None = None,
+        msg_type: str | None = None,
+        after: Tuple[int, int] | None = None,
+    ) -> List[Dict[str, Any]]:
+        """按 msg_id 数字升序分页查询，所有过滤条件在 SQL 中完成。
+        - date：YYYYMMDD，按 published_at 前缀过滤（走 published_at 索引的范围查询）；
+        - after：游标 (msg_seq, id)，传入时忽略 offset（键集分页，深页不再扫描跳过的行）。
+        """
+        sql, params = self._message_query("*", limit, offset, msg_id, date, grp, member_id, msg_type, after)
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    def list_message_rows(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        msg_id: str | None = None,
+        date: str | None = None,
+        grp: str | None = None,
+        member_id: str | None = None,
+        msg_type: str | None = None,
+        after: Tuple[int, int] | None = None,
+    ) -> List[tuple]:
+        """/messages 快速路径：参数同 list_messages，SQL 只取输出字段，返回元组行（不构造 sqlite3.Row），
+        由 message_items() 转换为输出字典。
+        """
+        sql, params = self._message_query(_MESSAGE_ITEM_COLUMNS, limit, offset, msg_id, date, grp, member_id, msg_type, after)
+        with self.reader() as conn:
+            cur = conn.cursor()
+            cur.row_factory = None
+            return cur.execute(sql, params).fetchall()
+
+    def _message_query(
+        self,
+        columns: str,
+        limit: int,
+        offset: int,
+        msg_id: str | None,
+        date: str | None,
+        grp: str | None,
+        member_id: str | None,
+        msg_type: str | None,
+        after: Tuple[int, int] | None,
+    ) -> Tuple[str, List[Any]]:
+        where = []
+        params: List[Any] = []
+        if msg_id:
+            where.append("msg_id = ?")
+            params.append(msg_id)
+        if date:
+            next_day = (datetime.strptime(date, "%Y%m%d") + timedelta(days=1)).strftime("%Y%m%d")
+            where.append("published_at >= ? AND published_at < ?")
+            params.extend([date, next_day])
+        if grp:
+            where.append("grp = ?")
+            params.append(grp)
+        if member_id:
+            where.append("member_id = ?")
+            params.append(member_id)
+        if msg_type:
+            where.append("message_type = ?")
+            params.append(msg_type)
+        if after is not None:
+            where.append("(msg_seq, id) > (?, ?)")
+            params.extend(after)
+            offset = 0
+        sql = f"SELECT {columns} FROM messages"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY msg_seq ASC, id ASC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        return sql, params
+
+    def activity_histogram(self, since: str) -> List[Dict[str, Any]]:
+        """按成员统计 since（yyyyMMddHHmmss，UTC）以来每个 (星期, 小时) 的发帖数，供自适应轮询估计活跃度。
+        weekday 与 SQLite strftime('%w') 一致：0 为星期日。
+        """
+        sql = """
+            SELECT grp, member_id,
+              CAST(strftime('%w', substr(published_at, 1, 4) || '-' || substr(published_at, 5, 2) || '-' || substr(published_at, 7, 2)) AS INTEGER) AS weekday,
+              CAST(substr(published_at, 9, 2) AS INTEGER) AS hour,
+              COUNT(*) AS n
+            FROM messages
+            WHERE published_at >= ? AND grp IS NOT NULL AND member_id IS NOT NULL
+            GROUP BY grp, member_id, weekday, hour
+        """
+        with self.reader() as conn:
+            rows = conn.execute(sql, (since,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def list_message_stats(
+        self,
+        grp: str | None = None,
+        member_id: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        msg_type: str | None = None,
+    ) -> List[Dict[str, Any]]:
+        """读取预汇总的每日统计；date_from/date_to 为 yyyyMMdd（闭区间）。"""
+        sql = "SELECT * FROM message_stats WHERE 1=1"
+        params: List[Any] = []
+        if grp:
+            sql += " AND grp = ?"
+            params.append(grp)
+        if member_id:
+            sql += " AND member_id = ?"
+            params.append(member_id)
+        if date_from:
+            sql += " AND day >= ?"
+            params.append(date_from)
+        if date_to:
+            sql += " AND day <= ?"
+            params.append(date_to)
+        if msg_type:
+            sql += " AND message_type = ?"
+            params.append(msg_type)
+        sql += " ORDER BY grp, member_id, day, message_type"
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    def iter_export(
+        self,
+        since: str | None = None,
+        grp: str | None = None,
+        member_id: str | None = None,
+        after: Tuple[int, int] | None = None,
+        batch_size: int = 1000,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """按 (msg_seq, id) 顺序分批读出消息，供流式导出使用。
+        使用独占的只读连接和服务端游标（fetchmany），内存占用与导出总量无关，也不占用连接池。
+        """
+        where = []
+        params: List[Any] = []
+        if since:
+            where.append("published_at >= ?")
+            params.append(since)
+        if grp:
+            where.append("grp = ?")
+            params.append(grp)
+        if member_id:
+            where.append("member_id = ?")
+            params.append(member_id)
+        if after is not None:
+            where.append("(msg_seq, id) > (?, ?)")
+            params.extend(after)
+        sql = "SELECT * FROM messages"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY msg_seq ASC, id ASC"
+        conn = self.open_reader()
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(r) for r in rows]
+        finally:
+            conn.close()
+
+    def list_changes(self, since: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """change_seq 大于 since 的消息（插入或内容有变化），按 change_seq 升序；走 change_seq 索引。"""
+        with self.reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE change_seq > ? ORDER BY change_seq ASC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def max_change_seq(self) -> int:
+        with self.reader() as conn:
+            row = conn.execute("SELECT seq FROM change_counter WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def max_event_seq(self) -> int:
+        with self.reader() as conn:
+            row = conn.execute("SELECT MAX(seq) FROM message_events").fetchone()
+        return row[0] or 0
+
+    def list_events(
+        self,
+        after_seq: int,
+        limit: int = 500,
+        grp: str | None = None,
+        member_id: str | None = None,
+    ) -> List[Dict[str, Any]]:
+        """读取 after_seq 之后的消息变更（附带消息当前内容），按 seq 升序。"""
+        sql = "SELECT e.seq AS event_seq, m.* FROM message_events e JOIN messages m ON m.id = e.row_id WHERE e.seq > ?"
+        params: List[Any] = [after_seq]
+        if grp:
+            sql += " AND e.grp = ?"
+            params.append(grp)
+        if member_id:
+            sql += " AND e.member_id = ?"
+            params.append(member_id)
+        sql += " ORDER BY e.seq ASC LIMIT ?"
+        params.append(limit)
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+    def search_messages(
+        self,
+        query: str,
+        limit: int = 50,
+        grp: str | None = None,
+        member_id: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        after: Tuple[float, int] | None = None,
+    ) -> List[Dict[str, Any]]:
+        """全文检索：按相关度（bm25，越小越相关）排序，返回带高亮片段的消息。
+        - 按空白拆分为多个词，全部命中才返回；trigram 分词要求词长至少 3 个字符，更短的词以 LIKE 过滤；
+        - date_from/date_to：YYYYMMDD，闭区间；
+        - after：游标 (rank, id)，键集分页。
+        """
+        terms = [t for t in query.split() if t]
+        match_terms = [t for t in terms if len(t) >= 3]
+        like_terms = [t for t in terms if len(t) < 3]
+        where = []
+        params: List[Any] = []
+        if match_terms:
+            sql = (
+                "SELECT m.*, bm25(messages_fts) AS rank, "
+                "snippet(messages_fts, 0, '<mark>', '</mark>', '…', 24) AS snippet "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+            )
+            where.append("messages_fts MATCH ?")
+            params.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in match_terms))
+        else:
+            # 只有短词时无法使用索引匹配，退化为 LIKE 扫描，不计算相关度
+            sql = "SELECT m.*, 0.0 AS rank, m.text_content AS snippet FROM messages m"
+        for t in like_terms:
+            where.append("m.text_content LIKE ? ESCAPE '\\'")
+            params.append("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if grp:
+            where.append("m.grp = ?")
+            params.append(grp)
+        if member_id:
+            where.append("m.member_id = ?")
+            params.append(member_id)
+        if date_from:
+            where.append("m.published_at >= ?")
+            params.append(date_from)
+        if date_to:
+            next_day = (datetime.strptime(date_to, "%Y%m%d") + timedelta(days=1)).strftime("%Y%m%d")
+            where.append("m.published_at < ?")
+            params.append(next_day)
+        sql = f"SELECT * FROM ({sql}{' WHERE ' + ' AND '.join(where) if where else ''})"
+        if after is not None:
+            sql += " WHERE (rank, id) > (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY rank ASC, id ASC LIMIT ?"
+        params.append(limit)
+        with self.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
         return [dict(r) for r in rows]
 
 
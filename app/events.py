@@ -0,0 +1,121 @@
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .db import get_db
+from .config import EVENTS_POLL_INTERVAL, EVENTS_ERROR_BACKOFF_MAX, SSE_QUEUE_SIZE
+
+
+class Subscription:
+    """一个推送订阅：按组/成员过滤，带有界缓冲队列。"""
+
+    def __init__(self, grp: Optional[str] = None, member_id: Optional[str] = None):
+        self.grp = grp
+        self.member_id = member_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        # 缓冲区溢出（消费过慢）时置为 True，连接随后断开
+        self.overflowed = False
+
+    def accepts(self, event: Dict[str, Any]) -> bool:
+        if self.grp and event.get("grp") != self.grp:
+            return False
+        if self.member_id and event.get("member_id") != self.member_id:
+            return False
+        return True
+
+
+class EventBroker:
+    """跟踪 message_events 变更日志并分发给本进程内的所有订阅者。
+    每个 API 进程只有一个跟踪任务：通过独占只读连接的 PRAGMA data_version 判断其它连接（包括调度器进程）
+    是否有新提交，有变化时才查询日志，订阅者数量不影响数据库负载。
+    出错时记录日志、重新打开连接并退避重试，跟踪任务不会因一次异常而停止。
+    """
+
+    def __init__(self, formatter: Callable[[List[dict]], List[dict]]):
+        self.formatter = formatter
+        self.subscribers: Set[Subscription] = set()
+        self.last_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def subscribe(self, grp: Optional[str] = None, member_id: Optional[str] = None) -> Subscription:
+        sub = Subscription(grp, member_id)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers.discard(sub)
+
+    def to_events(self, rows: List[dict]) -> List[Dict[str, Any]]:
+        return [{**out, "event_seq": r["event_seq"]} for out, r in zip(self.formatter(rows), rows)]
+
+    def _dispatch(self, events: List[Dict[str, Any]]):
+        for sub in list(self.subscribers):
+            if sub.overflowed:
+                continue
+            for event in events:
+                if not sub.accepts(event):
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    sub.overflowed = True
+                    break
+
+    async def _run(self):
+        db = get_db()
+        conn = None
+        started = False
+        version = None
+        delay = EVENTS_POLL_INTERVAL
+        try:
+            while True:
+                try:
+                    if conn is None:
+                        conn = await db.arun(db.open_reader)
+                        # 连接重建后 data_version 不可比较，先完整查询一次日志
+                        version = None
+                    if not started:
+                        self.last_seq = await db.arun(db.max_event_seq)
+                        started = True
+                    current = await db.arun(lambda: conn.execute("PRAGMA data_version").fetchone()[0])
+                    if current != version:
+                        version = current
+                        while True:
+                            rows = await db.arun(db.list_events, self.last_seq)
+                            if not rows:
+                                break
+                            self.last_seq = rows[-1]["event_seq"]
+                            if self.subscribers:
+                                self._dispatch(self.to_events(rows))
+                    delay = EVENTS_POLL_INTERVAL
+                except asyncio.CancelledError:
+                    raise
+                except Exception as ex:
+                    print(f"跟踪消息变更日志出错，{delay:g} 秒后重试：{ex!r}")
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, EVENTS_ERROR_BACKOFF_MAX)
+                    continue
+                await asyncio.sleep(EVENTS_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = json.dumps({k: v for k, v in event.items() if k != "event_seq"}, ensure_ascii=False)
+    return f"id: {event['event_seq']}\nevent: message\ndata: {data}\n\n"
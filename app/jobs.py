@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from .db import get_db
+from .progress import Progress
+from .config import JOB_HEARTBEAT_SECONDS, JOB_PROGRESS_INTERVAL, JOB_STALE_SECONDS
+from .tasks.gettoken import run_gettoken
+from .tasks.getmessage import run_getmessage
+
+
+# 任务类型 -> 任务函数（函数需接受 progress 关键字参数）
+JOB_FUNCS: Dict[str, Callable[..., dict]] = {
+    "getmessage": run_getmessage,
+    "gettoken": run_gettoken,
+}
+
+
+class JobProgress(Progress):
+    """把进度节流写入 jobs 表，同时作为心跳。
+    任务运行期间另有心跳线程按 JOB_HEARTBEAT_SECONDS 刷新，长时间没有进度事件的任务不会被判定为已中断。
+    """
+
+    def __init__(self, job_id: str):
+        super().__init__()
+        self.job_id = job_id
+        self._last_flush = 0.0
+        self._stopped = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+
+    def start_heartbeat(self):
+        self._heartbeat = threading.Thread(target=self._beat, name=f"job-heartbeat-{self.job_id[:8]}", daemon=True)
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def _beat(self):
+        while not self._stopped.wait(JOB_HEARTBEAT_SECONDS):
+            if time.monotonic() - self._last_flush < JOB_HEARTBEAT_SECONDS:
+                continue
+            try:
+                self.flush()
+            except Exception as ex:
+                # 数据库暂时不可写：下一次心跳再试
+                print(f"任务 {self.job_id} 心跳写入失败：{ex}")
+
+    def changed(self):
+        now = time.monotonic()
+        if now - self._last_flush >= JOB_PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self, **fields):
+        self._last_flush = time.monotonic()
+        get_db().update_job(self.job_id, progress=json.dumps(self.snapshot(), ensure_ascii=False), **fields)
+
+
+def _summary(result: Any) -> str:
+    # 消息明细可能很大，只保存汇总
+    if isinstance(result, dict) and "items" in result:
+        result = {k: v for k, v in result.items() if k != "items"}
+    return json.dumps(result, ensure_ascii=False, default=str)
+
+
+def job_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    for key in ("progress", "result"):
+        out[key] = json.loads(out[key]) if out.get(key) else None
+    return out
+
+
+class JobRunner:
+    """后台任务执行器：手动触发与定时任务共用。
+    同一类任务同时只有一个运行（跨进程由 jobs 表保证），重复触发会附加到正在运行的那一次；
+    分片抓取时按 shard（执行进程）分别单飞，各进程抓取各自持有的成员。
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=len(JOB_FUNCS), thread_name_prefix="job")
+
+    def _claim(self, kind: str, shard: str = ""):
+        if kind not in JOB_FUNCS:
+            raise KeyError(kind)
+        job_id = uuid.uuid4().hex
+        job = get_db().claim_job(kind, job_id, self.owner, JOB_STALE_SECONDS, shard)
+        return job, job["id"] == job_id
+
+    def _execute(self, job_id: str, kind: str, kwargs: Dict[str, Any]) -> dict | None:
+        progress = JobProgress(job_id)
+        progress.start_heartbeat()
+        try:
+            result = JOB_FUNCS[kind](progress=progress, **kwargs)
+        except Exception as ex:
+            progress.stop_heartbeat()
+            progress.flush(status="failed", error=str(ex))
+            return None
+        progress.stop_heartbeat()
+        progress.flush(status="succeeded", result=_summary(result))
+        return result
+
+    def submit(self, kind: str, **kwargs) -> Dict[str, Any]:
+        """在后台线程启动任务并立即返回任务信息；已有同类任务运行时返回那一次（attached=True）。"""
+        job, created = self._claim(kind)
+        if created:
+            self._executor.submit(self._execute, job["id"], kind, kwargs)
+        return {**job_to_dict(job), "attached": not created}
+
+    def run(self, kind: str, shard: str = "", **kwargs) -> dict | None:
+        """在当前线程执行任务（定时任务使用）；已有同类任务（同一分片）运行时直接跳过。"""
+        job, created = self._claim(kind, shard)
+        if not created:
+            print(f"任务 {kind} 正在运行（{job['id']}），跳过本次")
+            return None
+        return self._execute(job["id"], kind, kwargs)
+
+
+_runner: JobRunner | None = None
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner()
+    return _runner
@@ -0,0 +1,71 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Set, Tuple
+
+from .db import get_db
+from .config_loader import load_group_configs
+from .config import WORKER_LEASE_SECONDS
+
+
+class MemberLeases:
+    """分片抓取（main.py --scheduler --worker）：本进程通过 member_leases 表持有一部分成员。
+    - heartbeat() 由调度器每 WORKER_HEARTBEAT_SECONDS 调用：续约、按存活进程数重新均衡、接管已退出进程的成员；
+    - members() 返回本进程当前持有的成员（{组: [成员ID]}，与 run_getmessage 的 members 参数一致）；
+    - hold() 标记正在抓取的成员，均衡时不会释放，避免交接期间两个进程同时抓取同一成员；
+    - take_request() 领取手动触发的抓取请求，由本进程在自己的分片内执行。
+    """
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self._busy: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def heartbeat(self) -> List[Tuple[str, str]]:
+        configured = [
+            (grp, str(mem.get("id")))
+            for grp, cfg in load_group_configs().items()
+            for mem in cfg.members
+        ]
+        with self._lock:
+            busy = set(self._busy)
+        return get_db().balance_member_leases(self.owner, configured, WORKER_LEASE_SECONDS, busy)
+
+    def take_request(self) -> bool:
+        """领取手动触发的抓取请求（POST /getMessage 在分片模式下转交给各进程）。"""
+        return get_db().take_worker_request(self.owner)
+
+    def members(self) -> Dict[str, List[str]]:
+        held: Dict[str, List[str]] = {}
+        for row in get_db().list_member_leases(self.owner):
+            held.setdefault(row["grp"], []).append(row["member_id"])
+        return held
+
+    @contextmanager
+    def hold(self, members: Dict[str, List[str]]):
+        keys = {(grp, mid) for grp, ids in members.items() for mid in ids}
+        with self._lock:
+            self._busy |= keys
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._busy -= keys
+
+    def run_getmessage(self, runner, members: Dict[str, List[str]] | None = None) -> dict | None:
+        """在本进程的分片内执行一次 getmessage；members 为空时抓取当前持有的全部成员。
+        只抓取仍由本进程持有的成员；同一分片的运行互斥（jobs.shard），不同进程的分片可并行。
+        """
+        held = self.members()
+        if members is not None:
+            held = {
+                grp: [mid for mid in ids if mid in held.get(grp, [])]
+                for grp, ids in members.items()
+            }
+            held = {grp: ids for grp, ids in held.items() if ids}
+        if not held:
+            return None
+        with self.hold(held):
+            return runner.run("getmessage", shard=self.owner, members=held)
+
+    def release(self):
+        get_db().release_member_leases(self.owner)
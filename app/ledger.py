@@ -0,0 +1,125 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from .db import get_db
+from .upstream import describe_failure
+from .config import INGEST_RUNS_KEEP
+
+
+# 记录耗时的阶段：token 获取、时间线请求、数据库写入、媒体下载
+STAGES = ("token", "timeline", "db_write", "download")
+
+
+class MemberStats:
+    """一次抓取中单个成员的统计：游标、页数、按类型的消息数、下载字节数、各阶段累计耗时与错误。"""
+
+    def __init__(self, grp: str, member_id: str, member_name: str):
+        self.grp = grp
+        self.member_id = member_id
+        self.member_name = member_name
+        self.started_at = datetime.utcnow().isoformat()
+        self.finished_at: Optional[str] = None
+        self.cursor_from: Optional[str] = None
+        self.cursor_to: Optional[str] = None
+        self.pages = 0
+        self.counts: Dict[str, int] = {}
+        self.bytes_downloaded = 0
+        self.stages: Dict[str, float] = {}
+        self.errors: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_page(self, records: List[Dict[str, Any]]):
+        self.pages += 1
+        for r in records:
+            self.counts[r["msg_type"]] = self.counts.get(r["msg_type"], 0) + 1
+            if r.get("published_at") and (self.cursor_to is None or r["published_at"] > self.cursor_to):
+                self.cursor_to = r["published_at"]
+
+    def add_error(self, target: str, error: Any):
+        self.errors.append(describe_failure(target, error))
+
+    def finish(self):
+        self.finished_at = datetime.utcnow().isoformat()
+        self.duration = time.perf_counter() - self._t0
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "grp": self.grp,
+            "member_id": self.member_id,
+            "member_name": self.member_name,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+            "cursor_from": self.cursor_from,
+            "cursor_to": self.cursor_to,
+            "pages": self.pages,
+            "messages": sum(self.counts.values()),
+            "counts": json.dumps(self.counts),
+            "bytes_downloaded": self.bytes_downloaded,
+            "stages": json.dumps({k: round(v, 6) for k, v in self.stages.items()}),
+            "errors": json.dumps(self.errors, ensure_ascii=False) if self.errors else None,
+        }
+
+
+class IngestRun:
+    """一次抓取运行的台账：开始时登记 ingest_runs，结束时一次写入汇总与各成员明细。"""
+
+    def __init__(self, kind: str, job_id: Optional[str] = None):
+        self.kind = kind
+        self.job_id = job_id
+        self.members: List[MemberStats] = []
+        self.errors: List[Dict[str, Any]] = []
+        self.id: Optional[int] = None
+        self._t0 = time.perf_counter()
+
+    def start(self) -> int:
+        self.id = get_db().start_ingest_run(self.kind, self.job_id)
+        return self.id
+
+    def member(self, grp: str, member_id: str, member_name: str) -> MemberStats:
+        stats = MemberStats(grp, member_id, member_name)
+        self.members.append(stats)
+        return stats
+
+    def add_error(self, target: str, error: Any):
+        self.errors.append(describe_failure(target, error))
+
+    def finish(self, status: str):
+        counts: Dict[str, int] = {}
+        stages: Dict[str, float] = {}
+        for m in self.members:
+            for k, v in m.counts.items():
+                counts[k] = counts.get(k, 0) + v
+            for k, v in m.stages.items():
+                stages[k] = stages.get(k, 0.0) + v
+        errors = self.errors + [e for m in self.members for e in m.errors]
+        summary = {
+            "status": status,
+            "duration": time.perf_counter() - self._t0,
+            "members": len(self.members),
+            "messages": sum(counts.values()),
+            "counts": json.dumps(counts),
+            "bytes_downloaded": sum(m.bytes_downloaded for m in self.members),
+            "stages": json.dumps({k: round(v, 6) for k, v in stages.items()}),
+            "errors": json.dumps(errors, ensure_ascii=False) if errors else None,
+        }
+        get_db().finish_ingest_run(self.id, summary, [m.to_row() for m in self.members], keep=INGEST_RUNS_KEEP)
+
+
+def run_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(row)
+    for key in ("counts", "stages", "errors"):
+        out[key] = json.loads(out[key]) if out.get(key) else ({} if key != "errors" else [])
+    return out
@@ -1,15 +1,47 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import atexit
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from concurrent.futures import BrokenExecutor
+from functools import partial
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from .db import get_db
-from .tasks.gettoken import run_gettoken
-from .tasks.getmessage import run_getmessage
+from apscheduler.triggers.interval import IntervalTrigger
+from .db import get_db, encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor, message_items
+from .jobs import get_job_runner, job_to_dict
+from .polling import AdaptivePoller
+from .leases import MemberLeases
+from .thumbnails import ThumbnailUnavailable, get_thumbnails, snap_width
+from .ledger import run_to_dict
+from .cache import ResponseCache
+from .events import EventBroker, format_sse
+from .metrics import REGISTRY, API_MESSAGES_SECONDS, RESPONSE_CACHE_REQUESTS, render as render_metrics
 from fastapi.staticfiles import StaticFiles
-from .config import MESSAGE_DIR, FILE_BASE_URL
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库（输出相同，只是更慢）
+    orjson = None
+from .config import (
+    MESSAGE_DIR,
+    FILE_BASE_URL,
+    RESPONSE_CACHE_SIZE,
+    SSE_HEARTBEAT_SECONDS,
+    EXPORT_BATCH_SIZE,
+    ADAPTIVE_POLLING,
+    POLL_TICK_SECONDS,
+    METRICS_PUSH_SECONDS,
+    WORKER_HEARTBEAT_SECONDS,
+    WORKER_LEASE_SECONDS,
+)
 
 
 app = FastAPI(title="MessageBackend (Python)")
@@ -19,8 +51,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 浏览器端需要读取分页游标与缓存校验头
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# /messages 响应缓存（按数据代数失效）
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
 
 class MessageOut(BaseModel):
     msg_id: str
@@ -34,6 +71,41 @@ class MessageOut(BaseModel):
     published_at: Optional[str] = None
 
 
+class SearchItem(MessageOut):
+    snippet: Optional[str] = None    # 命中片段，关键词以 <mark></mark> 标出
+    rank: float = 0.0                # bm25 相关度，越小越相关
+
+
+class SearchOut(BaseModel):
+    items: List[SearchItem]
+    next: Optional[str] = None       # 下一页游标，传入 after 参数
+
+
+class ChangeItem(MessageOut):
+    change_seq: int                  # 该消息最近一次插入或内容变化的变更序号
+
+
+class ChangesOut(BaseModel):
+    items: List[ChangeItem]
+    next_since: int                  # 下一次请求传入的 since
+    has_more: bool                   # 为 true 时应立即用 next_since 继续拉取
+
+
+class StatOut(BaseModel):
+    grp: str
+    member_id: str
+    day: str                         # yyyyMMdd
+    msg_type: str
+    count: int
+    first_published_at: str
+    last_published_at: str
+
+
+def _check_date(name: str, value: str | None):
+    if value is not None and (len(value) != 8 or not value.isdigit()):
+        raise HTTPException(status_code=400, detail=f"{name} 参数需要为YYYYMMDD八位数字")
+
+
 @app.on_event("startup")
 async def on_startup():
     # 初始化数据库
@@ -42,10 +114,32 @@ async def on_startup():
     # 挂载静态文件目录以提供本地文件服务（/data/messages/...）
     app.mount("/data/messages", StaticFiles(directory=str(MESSAGE_DIR)), name="data-messages")
 
+    # 跟踪消息变更日志，向 /messages/stream 订阅者推送
+    event_broker.start()
 
-def start_scheduler(loop=None) -> AsyncIOScheduler:
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await event_broker.stop()
+
+
+def publish_metrics(process: str):
+    get_db().save_metrics_snapshot(process, json.dumps(REGISTRY.dump()))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 指标：本进程（process="api"）与调度器等进程最近一次写入的快照。"""
+    db = get_db()
+    dumps = {p: json.loads(d) for p, d in (await db.arun(db.list_metrics_snapshots)).items() if p != "api"}
+    dumps["api"] = REGISTRY.dump()
+    return PlainTextResponse(render_metrics(dumps), media_type="text/plain; version=0.0.4")
+
+
+def start_scheduler(loop=None, worker: bool = False) -> AsyncIOScheduler:
     """启动独立的定时任务调度器（不绑定到 FastAPI 事件）。
     可选传入已创建的事件循环以避免在未运行循环时出错。
+    worker=True 时为分片模式：可同时启动多个调度器进程，各自通过租约表认领一部分成员，只抓取自己持有的成员。
     """
     # 确保数据库可用
     get_db().init_db()
@@ -53,89 +147,168 @@ def start_scheduler(loop=None) -> AsyncIOScheduler:
     # 绑定到传入的事件循环（如果提供）
     scheduler = AsyncIOScheduler(event_loop=loop)
 
+    # 定时任务与手动触发共用任务执行器，同类任务不会重叠运行
+    runner = get_job_runner()
+
+    leases = None
+    if worker:
+        leases = MemberLeases(runner.owner)
+        # 启动时先认领一份成员，之后定期续约；正常退出时释放，其它进程下一次心跳即可接管
+        leases.heartbeat()
+        atexit.register(leases.release)
+
+        def heartbeat():
+            leases.heartbeat()
+            # 手动触发的抓取（POST /getMessage）：在本进程的分片内立即执行一次
+            if leases.take_request():
+                scheduler.add_job(
+                    func=partial(leases.run_getmessage, runner),
+                    id="job_getmessage_manual",
+                    replace_existing=True,
+                )
+
+        scheduler.add_job(
+            func=heartbeat,
+            trigger=IntervalTrigger(seconds=WORKER_HEARTBEAT_SECONDS),
+            id="job_member_leases",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+    # getmessage 定时任务：分片模式只抓取本进程持有的成员
+    getmessage_job = partial(leases.run_getmessage, runner) if leases else partial(runner.run, "getmessage")
+
     # gettoken: 8-23 每10分钟
     scheduler.add_job(
-        func=run_gettoken,
+        func=runner.run,
+        args=["gettoken"],
+        # 定时任务只在 token 即将过期时刷新；抓取中遇到 401 会按需刷新
+        kwargs={"force": False},
         trigger=CronTrigger(minute="*/10", hour="8-23"),
         id="job_gettoken",
         replace_existing=True,
     )
 
-    # getmessage: 8-19 每小时（整点）
-    scheduler.add_job(
-        func=run_getmessage,
-        trigger=CronTrigger(minute="0", hour="8-19"),
-        id="job_getmessage_hourly",
-        replace_existing=True,
-    )
+    if ADAPTIVE_POLLING:
+        # getmessage: 按成员活跃度自适应轮询，每轮只抓取到期的成员
+        poller = AdaptivePoller(runner, leases)
+        scheduler.add_job(
+            func=poller.tick,
+            trigger=IntervalTrigger(seconds=POLL_TICK_SECONDS),
+            # 启动后立即运行首轮（此时所有成员均到期）
+            next_run_time=datetime.now(),
+            id="job_getmessage_adaptive",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+    else:
+        # getmessage: 8-19 每小时（整点）
+        scheduler.add_job(
+            func=getmessage_job,
+            trigger=CronTrigger(minute="0", hour="8-19"),
+            id="job_getmessage_hourly",
+            replace_existing=True,
+        )
 
-    # getmessage: 20-23 每10分钟
+        # getmessage: 20-23 每10分钟
+        scheduler.add_job(
+            func=getmessage_job,
+            trigger=CronTrigger(minute="*/10", hour="20-23"),
+            id="job_getmessage_evening",
+            replace_existing=True,
+        )
+
+    # 调度器进程没有 HTTP 服务，指标定期写入数据库，由 API 进程的 /metrics 输出；
+    # 分片模式下各进程分别写入（process 标签为 host:pid），避免互相覆盖
     scheduler.add_job(
-        func=run_getmessage,
-        trigger=CronTrigger(minute="*/10", hour="20-23"),
-        id="job_getmessage_evening",
+        func=publish_metrics,
+        args=[runner.owner if worker else "scheduler"],
+        trigger=IntervalTrigger(seconds=METRICS_PUSH_SECONDS),
+        id="job_publish_metrics",
         replace_existing=True,
     )
 
     scheduler.start()
     # 启动后立刻各运行一次，便于初始化与首轮抓取
     try:
-        run_gettoken()
-    except Exception:
-        pass
-    try:
-        run_getmessage()
+        runner.run("gettoken", force=False)
     except Exception:
         pass
+    if not ADAPTIVE_POLLING:
+        try:
+            getmessage_job()
+        except Exception:
+            pass
     return scheduler
 
 
 @app.post("/manual/getToken")
 async def manual_gettoken():
-    # 直接执行一次获取 token 任务
-    result = run_gettoken()
-    return JSONResponse({"ok": True, "result": result})
+    # 提交后台任务并立即返回任务ID，进度通过 GET /jobs/{id} 查询
+    job = await asyncio.to_thread(get_job_runner().submit, "gettoken")
+    return JSONResponse({"ok": True, "job_id": job["id"], "attached": job["attached"], "status": job["status"]})
 
 
 @app.post("/manual/getMessage")
 async def manual_getmessage():
-    # 直接执行一次获取消息任务
-    result = run_getmessage()
-    return JSONResponse({"ok": True, "result": result})
+    # 分片模式（有存活的 --worker 调度器）：转交给各进程在自己持有的成员上执行，本进程不抓取，避免与分片任务重叠
+    db = get_db()
+    workers = await asyncio.to_thread(db.request_worker_runs, WORKER_LEASE_SECONDS)
+    if workers:
+        return JSONResponse({"ok": True, "job_id": None, "attached": False, "status": "requested", "workers": workers})
+    # 提交后台任务并立即返回任务ID；已有抓取在运行时附加到该次运行
+    job = await asyncio.to_thread(get_job_runner().submit, "getmessage")
+    return JSONResponse({"ok": True, "job_id": job["id"], "attached": job["attached"], "status": job["status"]})
 
 
-@app.get("/messages", response_model=List[MessageOut])
-async def list_messages(limit: int = 100, offset: int = 0, msg_id: str | None = None, date: str | None = None):
-    """
-    - 当传入 date=YYYYMMDD 时，仅返回该日期的记录，按 msg_id 升序排序。
-    - 文本消息忽略 file_path；媒体消息返回基于文件服务器的 URL。
-    """
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    db = get_db()
+    job = await db.arun(db.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return JSONResponse(job_to_dict(job))
+
+
+@app.get("/runs")
+async def list_runs(limit: int = 50, before: int | None = None, kind: str | None = None):
+    """抓取台账：按 id 倒序返回运行汇总；翻页时传入上一页最后一个 id 作为 before。"""
+    limit = max(1, min(limit, 500))
+    db = get_db()
+    rows = await db.arun(db.list_ingest_runs, limit=limit, before=before, kind=kind)
+    return JSONResponse([run_to_dict(r) for r in rows])
+
+
+@app.get("/runs/{run_id}")
+async def get_run(run_id: int):
+    """单次运行的汇总与各成员明细（按耗时倒序）。"""
+    db = get_db()
+    run = await db.arun(db.get_ingest_run, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="运行记录不存在")
+    out = run_to_dict(run)
+    out["member_runs"] = [run_to_dict(m) for m in run["member_runs"]]
+    return JSONResponse(out)
+
+
+@app.get("/runs/members/{grp}/{member_id}")
+async def list_member_runs(grp: str, member_id: str, limit: int = 50):
+    """单个成员最近的抓取明细，用于观察该成员的抓取耗时趋势。"""
+    limit = max(1, min(limit, 500))
     db = get_db()
-    rows = db.list_messages(limit=limit, offset=offset, msg_id=msg_id)
-
-    # 可选按日期过滤（优先使用 published_at 前缀，回退到文件名中的发布时间）
-    if date is not None:
-        if len(date) != 8 or not date.isdigit():
-            raise HTTPException(status_code=400, detail="date 参数需要为YYYYMMDD八位数字")
-        def _match_date(r):
-            pub = (r.get("published_at") or "")
-            if pub.startswith(date):
-                return True
-            fp = r.get("file_path") or ""
-            # 期望文件名形如：{msg_id}_{typeIndex}_{YYYYMMDDHHmmss}.ext
-            try:
-                import os
-                name = os.path.basename(fp)
-                stem = os.path.splitext(name)[0]
-                parts = stem.split("_")
-                if len(parts) >= 3:
-                    ts = parts[2]
-                    return ts.startswith(date)
-            except Exception:
-                return False
-            return False
-        rows = [r for r in rows if _match_date(r)]
+    rows = await db.arun(db.list_member_runs, grp, member_id, limit)
+    return JSONResponse([run_to_dict(r) for r in rows])
+
+
+def _dump_json(content) -> bytes:
+    """与 JSONResponse.render 输出字节一致（紧凑、不转义非 ASCII），优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
 
+def _to_message_out(rows: List[dict]) -> List[dict]:
     # 构造返回：仅返回所需字段；文本消息不返回URL；媒体消息返回URL
     result: List[dict] = []
     for r in rows:
@@ -143,7 +316,6 @@ async def list_messages(limit: int = 100, offset: int = 0, msg_id: str | None =
         fp = r.get("file_path")
         url = None
         if mt in ("image", "audio", "video") and fp:
-            import os
             member_name = r.get("member_name") or ""
             filename = os.path.basename(fp)
             url = f"{FILE_BASE_URL}/data/messages/{member_name}/{filename}"
@@ -158,15 +330,329 @@ async def list_messages(limit: int = 100, offset: int = 0, msg_id: str | None =
             "created_at": r.get("created_at"),
             "published_at": r.get("published_at"),
         })
-
-    # 始终按 msg_id 升序（优先数字，其次字符串）
-    def _msg_id_key(x):
-        s = str(x.get("msg_id") or "")
-        return (0, int(s)) if s.isdigit() else (1, s)
-    result.sort(key=_msg_id_key)
     return result
 
 
+# 新消息推送：跟踪变更日志并分发给 SSE 订阅者
+event_broker = EventBroker(_to_message_out)
+
+
+@app.get("/messages", response_model=List[MessageOut])
+async def list_messages(
+    request: Request,
+    limit: int = 100,
+    offset: int = 0,
+    msg_id: str | None = None,
+    date: str | None = None,
+    grp: str | None = None,
+    member_id: str | None = None,
+    type: str | None = None,
+    after: str | None = None,
+):
+    """
+    - 按 msg_id 数字升序返回；date=YYYYMMDD、grp、member_id、type 均在 SQL 中过滤。
+    - 传入 after=<游标> 进行键集分页；下一页游标在响应头 X-Next-Cursor 中返回（无更多数据时不返回）。
+    - 文本消息忽略 file_path；媒体消息返回基于文件服务器的 URL。
+    - 响应按查询参数缓存，ETag 由数据代数生成；If-None-Match 命中时返回 304。
+    - limit 取值范围 1-1000（超出时取边界值），避免单个请求读取整表并占满响应缓存。
+    """
+    _check_date("date", date)
+    limit = max(1, min(limit, 1000))
+    offset = max(0, offset)
+    try:
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after 游标无效")
+
+    db = get_db()
+    params = {
+        "limit": limit,
+        "offset": offset,
+        "msg_id": msg_id,
+        "date": date,
+        "grp": grp,
+        "member_id": member_id,
+        "type": type,
+        "after": after,
+    }
+    key = ResponseCache.make_key("/messages", params)
+    generation = await db.arun(db.get_generation)
+    etag = ResponseCache.etag(key, generation)
+    if ResponseCache.matches(request.headers.get("if-none-match"), etag):
+        RESPONSE_CACHE_REQUESTS.inc(result="not_modified")
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = response_cache.get(key, generation)
+    if cached is not None:
+        RESPONSE_CACHE_REQUESTS.inc(result="hit")
+        body, headers = cached
+        return Response(content=body, media_type="application/json", headers=headers)
+    RESPONSE_CACHE_REQUESTS.inc(result="miss")
+
+    # 快速路径：SQL 只取输出字段，逐行构造一次输出字典（跳过模型校验），orjson 序列化
+    with API_MESSAGES_SECONDS.time(stage="sql"):
+        rows = await db.arun(
+            db.list_message_rows,
+            limit=limit,
+            offset=offset,
+            msg_id=msg_id,
+            date=date,
+            grp=grp,
+            member_id=member_id,
+            msg_type=type,
+            after=after_key,
+        )
+    with API_MESSAGES_SECONDS.time(stage="transform"):
+        items, last_key = message_items(rows)
+    headers = {"ETag": etag}
+    if items and len(items) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(*last_key)
+    with API_MESSAGES_SECONDS.time(stage="serialize"):
+        body = _dump_json(items)
+    response_cache.put(key, generation, body, headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/messages/search", response_model=SearchOut)
+async def search_messages(
+    q: str,
+    limit: int = 50,
+    grp: str | None = None,
+    member_id: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    after: str | None = None,
+):
+    """
+    - 全文检索消息文本（FTS5 trigram 索引），按相关度排序，返回高亮片段；
+    - 可选过滤：grp、member_id、date_from/date_to（YYYYMMDD，闭区间）；
+    - 键集分页：返回体中的 next 作为下一次请求的 after。
+    """
+    db = get_db()
+    if not db.fts_enabled:
+        raise HTTPException(status_code=503, detail="当前 SQLite 不支持 FTS5 trigram 全文检索")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q 参数不能为空")
+    _check_date("date_from", date_from)
+    _check_date("date_to", date_to)
+    try:
+        after_key = decode_rank_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after 游标无效")
+
+    rows = await db.arun(
+        db.search_messages,
+        q,
+        limit=limit,
+        grp=grp,
+        member_id=member_id,
+        date_from=date_from,
+        date_to=date_to,
+        after=after_key,
+    )
+    items = [
+        {**out, "snippet": r.get("snippet"), "rank": r.get("rank") or 0.0}
+        for out, r in zip(_to_message_out(rows), rows)
+    ]
+    next_cursor = encode_rank_cursor(rows[-1]["rank"], rows[-1]["id"]) if rows and len(rows) == limit else None
+    return {"items": items, "next": next_cursor}
+
+
+@app.get("/messages/changes", response_model=ChangesOut)
+async def list_changes(since: int = 0, limit: int = 500):
+    """
+    - 增量同步：返回 change_seq 大于 since 的消息（新插入或内容有变化），按 change_seq 升序；
+    - 客户端保存返回的 next_since，下次以它作为 since 请求；since=0 表示全量；
+    - limit 范围 1~5000；has_more 为 true 表示还有后续变更。
+    """
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since 不能为负数")
+    limit = max(1, min(limit, 5000))
+    db = get_db()
+    rows = await db.arun(db.list_changes, since, limit)
+    items = [{**out, "change_seq": r["change_seq"]} for out, r in zip(_to_message_out(rows), rows)]
+    next_since = rows[-1]["change_seq"] if rows else since
+    return {"items": items, "next_since": next_since, "has_more": len(rows) == limit}
+
+
+@app.get("/stats", response_model=List[StatOut])
+async def list_stats(
+    grp: str | None = None,
+    member_id: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    msg_type: str | None = None,
+):
+    """
+    - 每个成员每天按类型的消息数及首末发布时间（读取预汇总表，不扫描 messages）；
+    - 可选过滤：grp、member_id、date_from/date_to（YYYYMMDD，闭区间）、msg_type。
+    """
+    _check_date("date_from", date_from)
+    _check_date("date_to", date_to)
+    db = get_db()
+    rows = await db.arun(
+        db.list_message_stats,
+        grp=grp,
+        member_id=member_id,
+        date_from=date_from,
+        date_to=date_to,
+        msg_type=msg_type,
+    )
+    return [
+        {
+            "grp": r["grp"],
+            "member_id": r["member_id"],
+            "day": r["day"],
+            "msg_type": r["message_type"],
+            "count": r["count"],
+            "first_published_at": r["first_published_at"],
+            "last_published_at": r["last_published_at"],
+        }
+        for r in rows
+    ]
+
+
+@app.get("/media/{msg_id}/thumb")
+async def media_thumbnail(msg_id: str, w: int = 320):
+    """
+    - 图片消息返回缩略图，视频消息返回封面帧（JPEG）；宽度 w 向上取整到 THUMB_WIDTHS 中的档位，不放大原图；
+    - 首次请求时在进程池中生成并缓存，同一变体的并发请求共用一次生成；
+    - 语音消息、文件缺失或无法解码时返回 404；生成进程异常退出时返回 503（进程池已重建，可重试）。
+    """
+    if w <= 0:
+        raise HTTPException(status_code=400, detail="w 需要为正整数")
+    db = get_db()
+    row = await db.arun(db.get_message, msg_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="消息不存在")
+    try:
+        fut = await asyncio.to_thread(get_thumbnails().get, row, snap_width(w))
+        # shield：客户端断开时不取消共用的生成任务
+        path = await asyncio.shield(asyncio.wrap_future(fut))
+    except ThumbnailUnavailable as ex:
+        raise HTTPException(status_code=404, detail=str(ex))
+    except BrokenExecutor:
+        raise HTTPException(status_code=503, detail="缩略图生成进程异常退出，请重试", headers={"Retry-After": "1"})
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=86400"})
+
+
+@app.get("/messages/stream")
+async def stream_messages(
+    request: Request,
+    grp: str | None = None,
+    member_id: str | None = None,
+    last_event_id: str | None = None,
+):
+    """
+    - SSE 推送新增或更新的消息（event: message，id 为变更序号）；可按 grp、member_id 订阅；
+    - 重连时浏览器自动携带 Last-Event-ID 头（也可用 last_event_id 参数），从该序号之后补发；
+    - 消费过慢导致缓冲区溢出时服务端断开连接，客户端重连后凭 Last-Event-ID 补齐。
+    """
+    db = get_db()
+    resume = request.headers.get("last-event-id") or last_event_id
+    # 先订阅再补发，补发期间到达的新事件按序号去重
+    sub = event_broker.subscribe(grp, member_id)
+
+    async def _events():
+        try:
+            seq = int(resume) if resume and resume.isdigit() else event_broker.last_seq
+            yield "retry: 3000\n\n"
+            while True:
+                rows = await db.arun(db.list_events, seq, 500, grp, member_id)
+                if not rows:
+                    break
+                for event in event_broker.to_events(rows):
+                    seq = event["event_seq"]
+                    yield format_sse(event)
+            while not sub.overflowed:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if event["event_seq"] <= seq:
+                    continue
+                seq = event["event_seq"]
+                yield format_sse(event)
+        finally:
+            event_broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+EXPORT_FIELDS = list(MessageOut.model_fields) + ["cursor"]
+
+
+def _export_lines(fmt: str, since, grp, member_id, after_key):
+    """逐批生成导出内容；每行附带 cursor，中断后可用 after=<cursor> 续传。"""
+    db = get_db()
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        yield buf.getvalue()
+    for rows in db.iter_export(since, grp, member_id, after_key, EXPORT_BATCH_SIZE):
+        items = [
+            {**out, "cursor": encode_cursor(r["msg_seq"], r["id"])}
+            for out, r in zip(_to_message_out(rows), rows)
+        ]
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+            writer.writerows(items)
+            yield buf.getvalue()
+        else:
+            yield "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.get("/messages/export")
+async def export_messages(
+    request: Request,
+    format: str = "ndjson",
+    since: str | None = None,
+    grp: str | None = None,
+    member_id: str | None = None,
+    after: str | None = None,
+):
+    """
+    - 流式导出消息：format=ndjson | csv；按 msg_id 数字升序；
+    - since：YYYYMMDD 或 yyyyMMddHHmmss，按发布时间过滤；可选 grp、member_id；
+    - 每行带 cursor 字段，中断后传入 after=<cursor> 从断点继续；
+    - 请求头 Accept-Encoding 含 gzip 时以 gzip 压缩传输。
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format 参数需要为 ndjson 或 csv")
+    if since is not None and (len(since) not in (8, 14) or not since.isdigit()):
+        raise HTTPException(status_code=400, detail="since 参数需要为YYYYMMDD或yyyyMMddHHmmss")
+    try:
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after 游标无效")
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="messages.{format}"'}
+    body = _export_lines(format, since, grp, member_id, after_key)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        body = _gzip_stream(body)
+    # 同步生成器由 Starlette 在线程池中迭代，不阻塞事件循环
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
 if __name__ == "__main__":
     import argparse
     import asyncio
@@ -0,0 +1,155 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+
+# 耗时（秒）与大小（字节）的默认分桶
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dump(self) -> Dict[str, Any]:
+        with self._lock:
+            series = [[list(k), v] for k, v in self._series.items()]
+        return {"type": self.kind, "help": self.help, "labelnames": list(self.labelnames), "series": series}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # 各桶只记自身计数，导出时再累加为 Prometheus 的累计桶
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._series.get(key)
+            if entry is None:
+                entry = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            entry["counts"][idx] += 1
+            entry["sum"] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def dump(self) -> Dict[str, Any]:
+        with self._lock:
+            series = [[list(k), {"counts": list(v["counts"]), "sum": v["sum"]}] for k, v in self._series.items()]
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets),
+            "series": series,
+        }
+
+
+class Registry:
+    """进程内的指标集合。调度器进程定期把 dump() 写入数据库，API 进程的 /metrics 合并输出。"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def dump(self) -> Dict[str, Any]:
+        return {name: m.dump() for name, m in self._metrics.items()}
+
+
+def _fmt_labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def render(dumps: Dict[str, Dict[str, Any]]) -> str:
+    """按 Prometheus 文本格式输出多个进程的指标；dumps 为 进程名 -> Registry.dump()，进程名作为 process 标签。"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for process, dump in dumps.items():
+        for name, metric in dump.items():
+            target = merged.setdefault(name, {**metric, "series": []})
+            for labels, value in metric["series"]:
+                target["series"].append(([("process", process)] + list(zip(metric["labelnames"], labels)), value))
+
+    lines: List[str] = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for pairs, value in metric["series"]:
+            if metric["type"] == "counter":
+                lines.append(f"{name}{_fmt_labels(pairs)} {_fmt_value(value)}")
+                continue
+            cumulative = 0
+            bounds = list(metric["buckets"]) + [math.inf]
+            for bound, count in zip(bounds, value["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_fmt_labels(pairs + [('le', _fmt_value(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_fmt_labels(pairs)} {_fmt_value(value['sum'])}")
+            lines.append(f"{name}_count{_fmt_labels(pairs)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# 抓取
+UPSTREAM_SECONDS = REGISTRY.histogram("upstream_request_seconds", "上游单次请求耗时（秒）", ["grp", "endpoint"])
+UPSTREAM_REQUESTS = REGISTRY.counter("upstream_requests_total", "上游请求次数（按状态码，连接错误为 error）", ["grp", "endpoint", "status"])
+MEDIA_DOWNLOAD_BYTES = REGISTRY.histogram("media_download_bytes", "单个媒体文件下载字节数", ["type"], SIZE_BUCKETS)
+MEDIA_DOWNLOAD_SECONDS = REGISTRY.histogram("media_download_seconds", "单个媒体文件下载耗时（秒）", ["type"])
+MESSAGES_INGESTED = REGISTRY.counter("messages_ingested_total", "写入的消息条数（按类型）", ["type"])
+ERRORS = REGISTRY.counter("errors_total", "任务中记录的失败次数（按原因）", ["reason"])
+
+# 数据库
+SQLITE_WRITE_SECONDS = REGISTRY.histogram("sqlite_write_seconds", "SQLite 写操作耗时（秒，含提交）", ["op"])
+SQLITE_COMMIT_SECONDS = REGISTRY.histogram("sqlite_commit_seconds", "SQLite 提交耗时（秒）")
+
+# 接口
+API_MESSAGES_SECONDS = REGISTRY.histogram("api_messages_seconds", "/messages 各阶段耗时（秒）：sql、transform、serialize", ["stage"])
+THUMBNAIL_REQUESTS = REGISTRY.counter("thumbnail_requests_total", "缩略图请求：hit、miss（新生成）、shared（等待同一变体的生成）", ["result"])
+THUMBNAIL_RENDER_SECONDS = REGISTRY.histogram("thumbnail_render_seconds", "生成单个缩略图耗时（秒，含排队）", ["type"])
+RESPONSE_CACHE_REQUESTS = REGISTRY.counter("response_cache_requests_total", "/messages 响应缓存：hit、miss、not_modified", ["result"])
@@ -0,0 +1,188 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from .db import get_db
+from .jobs import JobRunner
+from .leases import MemberLeases
+from .config_loader import load_group_configs
+from .config import (
+    POLL_MIN_INTERVAL,
+    POLL_MAX_INTERVAL,
+    POLL_TARGET_MESSAGES,
+    POLL_HISTORY_DAYS,
+    POLL_MODEL_REFRESH_SECONDS,
+    POLL_BUDGET_PER_HOUR,
+    POLL_BUDGET_BURST,
+    POLL_BACKOFF_MAX_EXP,
+)
+
+
+# 平滑：各时段速率与成员全周平均速率按该比例混合，避免历史上没发过帖的时段永远不被轮询
+PRIOR_WEIGHT = 0.2
+
+
+def _bucket(when: datetime) -> int:
+    # 与 SQLite strftime('%w') 对齐：0 为星期日
+    return ((when.weekday() + 1) % 7) * 24 + when.hour
+
+
+class ActivityModel:
+    """每个成员 168 个时段（星期 x 小时，UTC）的历史发帖数，用于估计当前时段的发帖速率。"""
+
+    def __init__(self, rows: List[Dict], days: int):
+        self.weeks = max(days / 7, 1.0)
+        self.days = max(days, 1)
+        self.counts: Dict[Tuple[str, str], List[int]] = {}
+        self.totals: Dict[Tuple[str, str], int] = {}
+        for r in rows:
+            key = (r["grp"], r["member_id"])
+            hist = self.counts.setdefault(key, [0] * 168)
+            hist[r["weekday"] * 24 + r["hour"]] += r["n"]
+            self.totals[key] = self.totals.get(key, 0) + r["n"]
+
+    @classmethod
+    def load(cls, days: int = POLL_HISTORY_DAYS) -> "ActivityModel":
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y%m%d%H%M%S")
+        return cls(get_db().activity_histogram(since), days)
+
+    def rate(self, grp: str, member_id: str, when: datetime) -> float:
+        """预计每秒发帖数。"""
+        key = (grp, member_id)
+        total = self.totals.get(key, 0)
+        if not total:
+            return 0.0
+        bucket_rate = self.counts[key][_bucket(when)] / (self.weeks * 3600)
+        mean_rate = total / (self.days * 86400)
+        return (1 - PRIOR_WEIGHT) * bucket_rate + PRIOR_WEIGHT * mean_rate
+
+
+class MemberState:
+    def __init__(self, grp: str, member_id: str):
+        self.grp = grp
+        self.member_id = member_id
+        # 0 表示尚未轮询过，启动后首轮即到期
+        self.next_due = 0.0
+        self.last_polled = 0.0
+        # 连续没有新消息的轮询次数
+        self.empty_streak = 0
+
+
+class AdaptivePoller:
+    """替代固定 CronTrigger 的 getmessage 调度：
+    - 每个成员按当前时段的预计发帖速率决定轮询间隔（活跃时段更频繁），连续无新消息时按 2^n 退避；
+    - 每组一个令牌桶（POLL_BUDGET_PER_HOUR），到期成员按“预计积压消息数”排序，超出预算的顺延到下一轮；
+    - 每轮把选中的成员交给任务执行器的一次 getmessage 运行，与手动触发共用同一单飞约束；
+    - 分片抓取时（传入 leases）只轮询本进程持有的成员，预算按持有比例分摊。
+    """
+
+    def __init__(self, runner: JobRunner, leases: MemberLeases | None = None):
+        self.runner = runner
+        self.leases = leases
+        self.model: ActivityModel | None = None
+        self._model_loaded = 0.0
+        self.members: Dict[Tuple[str, str], MemberState] = {}
+        self.tokens: Dict[str, float] = {}
+        self.share: Dict[str, float] = {}
+        self._last_tick = 0.0
+        self._lock = threading.Lock()
+
+    def _sync_members(self):
+        # 配置文件可在运行中修改：新增成员立即到期，移除的成员不再轮询
+        wanted = set()
+        held = self.leases.members() if self.leases else None
+        self.share = {}
+        for grp, cfg in load_group_configs().items():
+            ids = [str(mem.get("id")) for mem in cfg.members]
+            if held is not None:
+                self.share[grp] = len(held.get(grp, [])) / len(ids) if ids else 0.0
+                ids = [mid for mid in ids if mid in held.get(grp, [])]
+            for mid in ids:
+                key = (grp, mid)
+                wanted.add(key)
+                if key not in self.members:
+                    self.members[key] = MemberState(*key)
+        for key in list(self.members):
+            if key not in wanted:
+                del self.members[key]
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_tick if self._last_tick else None
+        self._last_tick = now
+        for grp in {s.grp for s in self.members.values()}:
+            # 分片时各进程只用本组预算中与持有成员比例相当的一份，合计不超过 POLL_BUDGET_PER_HOUR
+            share = self.share.get(grp, 1.0) if self.leases else 1.0
+            burst = max(POLL_BUDGET_BURST * share, 1.0)
+            if elapsed is None or grp not in self.tokens:
+                # 启动时额度为满，首轮可覆盖尽量多的成员
+                self.tokens[grp] = burst
+            else:
+                self.tokens[grp] = min(burst, self.tokens[grp] + elapsed * POLL_BUDGET_PER_HOUR * share / 3600)
+
+    def interval(self, state: MemberState, when: datetime) -> float:
+        rate = self.model.rate(state.grp, state.member_id, when) if self.model else 0.0
+        base = POLL_TARGET_MESSAGES / rate if rate > 0 else POLL_MAX_INTERVAL
+        base = min(max(base, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+        backoff = 2 ** min(state.empty_streak, POLL_BACKOFF_MAX_EXP)
+        return min(base * backoff, POLL_MAX_INTERVAL)
+
+    def select_due(self, now: float) -> Dict[str, List[str]]:
+        """按预算挑出本轮要轮询的成员：{组: [成员ID]}"""
+        when = datetime.fromtimestamp(now, timezone.utc)
+        by_grp: Dict[str, List[Tuple[float, MemberState]]] = {}
+        for state in self.members.values():
+            if state.next_due > now:
+                continue
+            # 优先级：自上次轮询以来预计积压的消息数；从未轮询的成员最优先
+            waited = now - state.last_polled if state.last_polled else float("inf")
+            rate = self.model.rate(state.grp, state.member_id, when) if self.model else 0.0
+            priority = waited * max(rate, 1e-9)
+            by_grp.setdefault(state.grp, []).append((priority, state))
+        selected: Dict[str, List[str]] = {}
+        for grp, items in by_grp.items():
+            items.sort(key=lambda x: x[0], reverse=True)
+            budget = int(self.tokens.get(grp, 0))
+            chosen = [s.member_id for _, s in items[:budget]]
+            if chosen:
+                self.tokens[grp] -= len(chosen)
+                selected[grp] = chosen
+        return selected
+
+    def tick(self):
+        """调度器每 POLL_TICK_SECONDS 调用一次（阻塞直到本轮抓取结束）。"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            if self.model is None or now - self._model_loaded >= POLL_MODEL_REFRESH_SECONDS:
+                self.model = ActivityModel.load()
+                self._model_loaded = now
+            self._sync_members()
+            self._refill(now)
+            selected = self.select_due(now)
+            if not selected:
+                return
+            db = get_db()
+            before = {
+                (grp, mid): (db.get_sync_cursor(grp, mid) or {}).get("last_published_at")
+                for grp, ids in selected.items() for mid in ids
+            }
+            if self.leases:
+                result = self.leases.run_getmessage(self.runner, selected)
+            else:
+                result = self.runner.run("getmessage", members=selected)
+            finished = time.time()
+            when = datetime.fromtimestamp(finished, timezone.utc)
+            for key, last in before.items():
+                state = self.members.get(key)
+                if state is None:
+                    continue
+                # result 为 None：本轮失败，或已有 getmessage 在运行（手动触发会覆盖全部成员），不调整退避
+                if result is not None:
+                    current = (db.get_sync_cursor(*key) or {}).get("last_published_at")
+                    state.empty_streak = 0 if current != last else state.empty_streak + 1
+                state.last_polled = finished
+                state.next_due = finished + self.interval(state, when)
+        finally:
+            self._lock.release()
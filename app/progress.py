@@ -0,0 +1,59 @@
+from typing import Any, Dict, List, Optional
+
+from .metrics import ERRORS
+from .upstream import describe_failure
+
+
+# 进度中最多保留的错误条数
+MAX_ERRORS = 100
+
+
+class Progress:
+    """抓取任务的进度计数（成员数、消息数、下载字节数、错误）。
+    任务函数接收一个 Progress，默认实例只在内存中计数；后台任务使用子类在 changed() 中持久化。
+    """
+
+    def __init__(self):
+        self.members_total = 0
+        self.members_done = 0
+        self.messages = 0
+        self.bytes_downloaded = 0
+        self.errors: List[Dict[str, Any]] = []
+        # 所属后台任务（JobProgress 设置），写入抓取台账以便关联
+        self.job_id: Optional[str] = None
+
+    def set_total(self, members: int):
+        self.members_total = members
+        self.changed()
+
+    def member_done(self):
+        self.members_done += 1
+        self.changed()
+
+    def add_messages(self, count: int):
+        self.messages += count
+        self.changed()
+
+    def add_bytes(self, count: int):
+        self.bytes_downloaded += count
+        self.changed()
+
+    def add_error(self, target: str, error: Any):
+        """记录一次失败：target 为出错对象（组、组/成员、下载地址），error 为异常或说明文字。"""
+        failure = describe_failure(target, error)
+        ERRORS.inc(reason=failure.get("reason") or (type(error).__name__ if isinstance(error, Exception) else "other"))
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(failure)
+        self.changed()
+
+    def changed(self):
+        pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "members_total": self.members_total,
+            "members_done": self.members_done,
+            "messages": self.messages,
+            "bytes_downloaded": self.bytes_downloaded,
+            "errors": list(self.errors),
+        }
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from ..db import get_db
+from ..progress import Progress
+from ..upstream import describe_failure
+from ..config_loader import load_group_configs
+from ..config import BACKFILL_WINDOW_DAYS, BACKFILL_CONCURRENCY
+from .tokens import get_token_manager
+from .getmessage import (
+    CrawlExecutors,
+    build_session,
+    iter_timeline,
+    prepare_member_dir,
+    run_in_thread,
+    start_media_stage,
+    stop_media_stage,
+    store_messages,
+)
+
+
+def _parse_since(value: str) -> datetime:
+    """支持 YYYYMMDD、YYYY-MM-DD、yyyyMMddHHmmss 三种格式。"""
+    for fmt in ("%Y%m%d%H%M%S", "%Y%m%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析日期：{value}")
+
+
+def _split_windows(since: datetime, until: datetime, days: int) -> List[Tuple[str, str]]:
+    """从 since 开始按固定天数切分时间窗口（yyyyMMddHHmmss），窗口起点固定便于续跑。"""
+    windows = []
+    start = since
+    step = timedelta(days=days)
+    while start < until:
+        end = min(start + step, until)
+        windows.append((start.strftime("%Y%m%d%H%M%S"), end.strftime("%Y%m%d%H%M%S")))
+        start = start + step
+    return windows
+
+
+async def run_backfill_async(grp: str, member: str, since: str) -> dict:
+    """把成员自 since 以来的历史拆分为时间窗口并行抓取，已完成的窗口记录在数据库中，重复执行时跳过。"""
+    db = get_db()
+    configs = load_group_configs()
+    cfg = configs.get(grp)
+    if cfg is None:
+        raise ValueError(f"未找到组配置：{grp}")
+    mem = next((m for m in cfg.members if str(m.get("id")) == member or str(m.get("name")) == member), None)
+    if mem is None:
+        raise ValueError(f"组 {grp} 中未找到成员：{member}")
+    # 时间窗口请求与媒体下载各用专用线程池，大小与各自的并发上限一致
+    executors = CrawlExecutors(BACKFILL_CONCURRENCY)
+    if not await run_in_thread(executors.fetch, get_token_manager().get_token, grp):
+        executors.shutdown()
+        raise ValueError(f"组 {grp} 没有可用的 token，请先执行 gettoken")
+
+    member_id = str(mem.get("id"))
+    member_name = str(mem.get("name"))
+    member_dir = prepare_member_dir(cfg, member_name)
+
+    done = db.get_backfill_windows(grp, member_id)
+    windows = _split_windows(_parse_since(since), datetime.utcnow(), BACKFILL_WINDOW_DAYS)
+    # 已完成且覆盖到同一终点的窗口跳过（最后一个窗口的终点随当前时间变化，会重新抓取）
+    pending = [(s, e) for s, e in windows if done.get(s, "") < e]
+
+    result = {"processed": 0, "items": [], "windows": len(windows), "skipped": len(windows) - len(pending), "errors": []}
+    session = build_session(grp)
+    sem = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    progress = Progress()
+    media_queue, workers = start_media_stage(progress, executors.media)
+
+    async def _fetch_window(start: str, end: str):
+        window_result = {"processed": 0, "items": []}
+        try:
+            async for page in iter_timeline(session, grp, member_id, start, sem, until=end, executor=executors.fetch):
+                await store_messages(grp, member_id, member_name, member_dir, session, page, media_queue, window_result, progress, executor=executors.fetch)
+        except Exception as ex:
+            result["errors"].append({**describe_failure(f"{grp}/{member_name}", ex), "window": [start, end]})
+            return
+        db.mark_backfill_window(grp, member_id, start, end, window_result["processed"])
+        result["processed"] += window_result["processed"]
+        result["items"].extend(window_result["items"])
+
+    try:
+        await asyncio.gather(*(_fetch_window(s, e) for s, e in pending))
+        await media_queue.join()
+    finally:
+        await stop_media_stage(workers)
+        executors.shutdown()
+        session.close()
+    result["bytes_downloaded"] = progress.bytes_downloaded
+    result["errors"].extend(progress.errors)
+    return result
+
+
+def run_backfill(grp: str, member: str, since: str) -> dict:
+    """历史回填的同步封装，供命令行调用。"""
+    print(f"开始回填 {grp}/{member} 自 {since} 以来的消息")
+    result = asyncio.run(run_backfill_async(grp, member, since))
+    print(f"回填完成：{result['processed']} 条消息，跳过 {result['skipped']} 个已完成窗口，失败 {len(result['errors'])} 个窗口")
+    return result
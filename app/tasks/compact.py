@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from ..config_loader import load_group_configs
+from ..textarchive import compact_member_dir
+
+
+def run_compact_text(keep_files: bool = False) -> dict:
+    """把所有已配置成员目录中的单条 .txt 文件迁移到按月压缩归档。"""
+    print("开始整理文字文件")
+    configs = load_group_configs()
+    results = {}
+    for grp, cfg in configs.items():
+        for mem in cfg.members:
+            member_name = str(mem.get("name"))
+            member_dir = Path(cfg.root_path) / member_name
+            if not member_dir.is_dir():
+                continue
+            try:
+                results[f"{grp}/{member_name}"] = compact_member_dir(member_dir, keep_files=keep_files)
+            except Exception as ex:
+                results[f"{grp}/{member_name}"] = {"error": str(ex)}
+    print("整理文字文件完成")
+    return {"members": results}
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from ..blobstore import get_blob_store
+from ..upstream import request
+from ..config import DOWNLOAD_CHUNK_SIZE
+
+
+PART_SUFFIX = ".part"
+# 与 .part 同时写入的传输信息（ETag / Last-Modified 与期望大小），中断后续传时用于 If-Range 与完整性判断
+PART_META_SUFFIX = ".part.json"
+
+
+def _part_path(path: Path) -> Path:
+    return path.with_name(path.name + PART_SUFFIX)
+
+
+def _meta_path(path: Path) -> Path:
+    return path.with_name(path.name + PART_META_SUFFIX)
+
+
+def _read_part_meta(path: Path) -> dict:
+    try:
+        meta = json.loads(_meta_path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def _write_part_meta(path: Path, meta: dict):
+    tmp = _meta_path(path).with_name(_meta_path(path).name + ".tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, _meta_path(path))
+
+
+def _discard_part(path: Path):
+    for p in (_part_path(path), _meta_path(path)):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+
+def _content_range_total(value: Optional[str]) -> Optional[int]:
+    """Content-Range（bytes a-b/total 或 bytes */total）中的总大小。"""
+    if value and "/" in value:
+        total = value.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    return None
+
+
+def _hash_existing(path: Path, hasher) -> int:
+    """按块读取已下载的部分文件，补齐哈希状态，返回已有字节数。"""
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _fsync_dir(dir_path: Path):
+    # Windows 不支持对目录 fsync，忽略即可
+    try:
+        fd = os.open(str(dir_path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def is_complete(path: Path, manifest: Optional[dict]) -> bool:
+    """文件存在且大小与下载记录一致才视为完成；没有记录的旧文件会被重新下载。"""
+    if not manifest or not path.exists():
+        return False
+    expected = manifest.get("expected_size")
+    return expected is not None and path.stat().st_size == expected
+
+
+def stream_download(
+    session: requests.Session,
+    file_url: str,
+    path: Path,
+    timeout: int,
+    etag: Optional[str] = None,
+    grp: str = "",
+) -> dict:
+    """流式下载到 .part 临时文件，校验大小后 fsync，按 SHA-256 放入内容寻址存储并原子链接到目标路径。
+    如存在上次中断留下的 .part 文件，使用 Range 请求续传：If-Range 取自开始传输时写入的 .part.json
+    （没有时退回调用方传入的 etag）；.part 已达到期望大小（写完后、提交前中断）时直接提交，
+    服务器返回 416 时按 Content-Range 判断 .part 是否完整，不完整则删除后重新下载。
+    返回 {"size", "sha256", "etag"}，供调用方写入下载记录。
+    """
+    part = _part_path(path)
+    hasher = hashlib.sha256()
+    offset = _hash_existing(part, hasher) if part.exists() else 0
+    meta = _read_part_meta(path) if offset else {}
+    if meta.get("size") is not None:
+        if offset == meta["size"]:
+            return _commit_part(path, hasher, offset, meta.get("etag") or etag)
+        if offset > meta["size"]:
+            _discard_part(path)
+            offset = 0
+            hasher = hashlib.sha256()
+            meta = {}
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        # 远端文件已变化时服务器会返回完整内容（200），此时从头下载
+        validator = (meta.get("etag") or meta.get("last_modified")) if meta else etag
+        if validator:
+            headers["If-Range"] = validator
+
+    with request(session, "GET", file_url, rate_limited=False, grp=grp, endpoint="media", headers=headers, timeout=timeout, stream=True) as resp:
+        if offset and resp.status_code == 416:
+            # 续传起点超出远端文件：.part 恰好完整（旧版本未记录大小）则直接提交，否则内容已不一致，从头下载
+            complete = _content_range_total(resp.headers.get("Content-Range")) == offset
+        else:
+            complete = None
+            resp.raise_for_status()
+            if offset and resp.status_code != 206:
+                offset = 0
+                hasher = hashlib.sha256()
+            # 期望总大小：206 从 Content-Range 取，200 从 Content-Length 取
+            expected = None
+            if resp.status_code == 206:
+                expected = _content_range_total(resp.headers.get("Content-Range"))
+            elif resp.headers.get("Content-Length", "").isdigit() and "Content-Encoding" not in resp.headers:
+                expected = int(resp.headers["Content-Length"])
+            new_etag = resp.headers.get("ETag") or (meta.get("etag") if offset else None) or etag
+            # 写入数据前先记录校验信息与期望大小，首次下载中断后也能带 If-Range 续传
+            _write_part_meta(path, {
+                "etag": new_etag,
+                "last_modified": resp.headers.get("Last-Modified") or (meta.get("last_modified") if offset else None),
+                "size": expected,
+            })
+
+            written = offset
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    written += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+    if complete is not None:
+        if complete:
+            return _commit_part(path, hasher, offset, etag)
+        _discard_part(path)
+        return stream_download(session, file_url, path, timeout, etag, grp)
+
+    if expected is not None and written != expected:
+        # 保留 .part 与 .part.json，下次继续续传
+        raise IOError(f"incomplete download {file_url}: {written}/{expected} bytes")
+    return _commit_part(path, hasher, written, new_etag)
+
+
+def _commit_part(path: Path, hasher, size: int, etag: Optional[str]) -> dict:
+    """已完整写入并 fsync 的 .part：放入内容寻址存储、链接到目标路径并清理传输信息。"""
+    sha256 = hasher.hexdigest()
+    get_blob_store().commit(_part_path(path), path, sha256)
+    _fsync_dir(path.parent)
+    _discard_part(path)
+    return {"size": size, "sha256": sha256, "etag": etag}
@@ -1,10 +1,26 @@
+import asyncio
+import functools
+import time
 import requests
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from requests.adapters import HTTPAdapter
 
 from ..db import get_db
-from ..config_loader import load_group_configs
+from ..blobstore import get_blob_store
+from ..progress import Progress
+from ..ledger import IngestRun, MemberStats
+from ..config_loader import GroupConfig, load_group_configs
+from .download import is_complete, stream_download
+from .tokens import get_token_manager
+from ..upstream import request
+from ..metrics import MEDIA_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_SECONDS, MESSAGES_INGESTED
+from ..textarchive import append_texts
+from ..thumbnails import THUMB_TYPES, get_thumbnails
+from ..config import API_BASE_URL, TEXT_STORAGE, MEMBER_CONCURRENCY, MEDIA_CONCURRENCY, MEDIA_QUEUE_SIZE, TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGES, THUMB_PREGENERATE_WIDTHS
 
 
 HEADERS_MAP = {
@@ -22,10 +38,13 @@ HEADERS_MAP = {
     },
 }
 
-BASE_URL = {
-    "nogi": "https://api.n46.glastonr.net",
-    "saku": "https://api.s46.glastonr.net",
-    "hina": "https://api.kh.glastonr.net",
+BASE_URL = API_BASE_URL
+
+# 媒体类型：API类型 -> (数据库类型, 文件名类型序号, 扩展名, 下载超时秒数)
+MEDIA_SPEC = {
+    "picture": ("image", 1, ".jpg", 60),
+    "voice": ("audio", 3, ".m4a", 120),
+    "video": ("video", 2, ".mp4", 180),
 }
 
 
@@ -33,198 +52,439 @@ def _ensure_dir(path: Path):
     path.mkdir(parents=True, exist_ok=True)
 
 
-def _latest_file_timestamp(dir_path: Path) -> Optional[str]:
-    """返回最近文件名中的发布时间（yyyyMMddHHmmss）；不存在则返回None。"""
-    if not dir_path.exists():
-        return None
-    files = [p for p in dir_path.iterdir() if p.is_file() and p.suffix in {".txt", ".mp4", ".jpg", ".m4a"}]
-    if not files:
-        return None
-    latest = max(files, key=lambda p: p.stat().st_ctime)
-    # 期望文件名格式：{id}_{typeIndex}_{publishedAt}{ext}
-    try:
-        name_no_ext = latest.stem  # 去掉扩展名
-        parts = name_no_ext.split("_")
-        if len(parts) >= 3:
-            timestamp = parts[2][:14]
-            return timestamp
-    except Exception:
-        return None
-    return None
-
-
 def _save_text(path: Path, text: str):
     path.parent.mkdir(parents=True, exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
         f.write(text)
 
 
-def run_getmessage() -> dict:
-    """调用远程API拉取消息，按配置成员与命名规则保存到各自目录，并写入数据库。"""
-    print("开始更新所有组的消息")
+def build_session(grp: str) -> requests.Session:
+    """为每个组创建一个带连接池的 keep-alive 会话，组内所有请求复用连接。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MEMBER_CONCURRENCY + MEDIA_CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Language": "ja-JP",
+        "Accept-Encoding": "gzip",
+        "TE": "gzip, deflate; q=0.5",
+        **HEADERS_MAP.get(grp, {}),
+    })
+    return session
+
+
+def prepare_member_dir(cfg: GroupConfig, member_name: str) -> Path:
+    member_dir = Path(cfg.root_path) / member_name
+    _ensure_dir(member_dir)
+    # 旧版布局下如目录为空，创建占位文本（与C#一致）
+    if TEXT_STORAGE == "files" and not any(member_dir.iterdir()):
+        placeholder = member_dir / f"0_0_{datetime.utcnow().strftime('%Y%m%d')}000000.txt"
+        _save_text(placeholder, "DON'T DELETE ME！")
+    return member_dir
+
+
+def to_api_time(ts: str) -> str:
+    """yyyyMMddHHmmss -> YYYY-MM-DDTHH:mm:ssZ"""
+    return datetime.strptime(ts[:14], "%Y%m%d%H%M%S").strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _stage(stats: Optional[MemberStats], name: str):
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+def _normalize_published_at(value: Any) -> str:
+    # published_at 格式调整为 yyyyMMddHHmmss
+    return (
+        str(value or "")
+        .replace("-", "")
+        .replace(":", "")
+        .replace("T", "")
+        .replace("Z", "")
+    )
+
+
+async def run_in_thread(executor: Optional[Executor], fn, *args, **kwargs):
+    """在指定线程池中执行阻塞调用；executor 为 None 时使用事件循环的默认线程池。"""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class CrawlExecutors:
+    """抓取流水线的专用线程池：时间线请求（含 token、入库）与媒体下载各用一个，大小与各自的并发上限一致。
+    默认线程池只有 min(32, CPU+4) 个线程，长时间的视频下载、限速等待与退避会占住时间线请求需要的线程。
+    """
+
+    def __init__(self, fetch_workers: int, media_workers: int = MEDIA_CONCURRENCY):
+        self.fetch = ThreadPoolExecutor(max_workers=max(1, fetch_workers), thread_name_prefix="fetch")
+        self.media = ThreadPoolExecutor(max_workers=max(1, media_workers), thread_name_prefix="media")
+
+    def shutdown(self):
+        # 流水线结束时所有调用都已返回；被取消的调用不等待（其线程在请求超时后自行结束）
+        self.fetch.shutdown(wait=False, cancel_futures=True)
+        self.media.shutdown(wait=False, cancel_futures=True)
+
+
+async def media_worker(queue: asyncio.Queue, progress: Progress, active: Set[str], executor: Optional[Executor] = None):
+    """媒体下载阶段：从有界队列中取任务，下载完成后再把文件路径写入数据库并删除待下载记录。
+    active 为本阶段正在下载的文件，同一文件重复入队（续传的待下载记录与时间线中的同一条消息）时只下载一次。
+    """
     db = get_db()
-    configs = load_group_configs()
-    result = {"processed": 0, "items": []}
-
-    # 需要授权的token从数据库最新一条读取（按组）
-    # 如果需要更复杂的token管理，可扩展为缓存或单独表。
-    for grp, cfg in configs.items():
-        headers_base = {
-            "Accept": "application/json",
-            "Accept-Language": "ja-JP",
-            "Accept-Encoding": "gzip",
-            "TE": "gzip, deflate; q=0.5",
-            **HEADERS_MAP.get(grp, {}),
-        }
-
-        # 遍历成员
-        for mem in cfg.members:
-            member_id = str(mem.get("id"))
-            member_name = str(mem.get("name"))
-            member_dir = Path(cfg.root_path) / member_name
-            _ensure_dir(member_dir)
-            # 如目录为空，创建占位文本（与C#一致）
-            if not any(member_dir.iterdir()):
-                placeholder = member_dir / f"0_0_{datetime.utcnow().strftime('%Y%m%d')}000000.txt"
-                _save_text(placeholder, "DON'T DELETE ME！")
-
-            latest_ts = _latest_file_timestamp(member_dir)
-            if latest_ts is None:
-                # 默认当天零点
-                latest_ts = datetime.utcnow().strftime("%Y%m%d") + "000000"
-            # 转换为 created_from=YYYY-MM-DDTHH:mm:ssZ
-            created_from = datetime.strptime(latest_ts, "%Y%m%d%H%M%S").strftime("%Y-%m-%dT%H:%M:%SZ")
-
-            url = f"{BASE_URL[grp]}/v2/groups/{member_id}/timeline?count=100&order=asc&created_from={requests.utils.quote(created_from, safe='') }"
-
-            # 取最近token作为授权（如果没有则跳过该组成员）
-            # 简化：直接读取最新token
-            token_row = db.conn.execute(
-                "SELECT token FROM tokens WHERE grp = ? ORDER BY id DESC LIMIT 1",
-                (grp,),
-            ).fetchone()
-            if not token_row:
+    while True:
+        job = await queue.get()
+        stats = job.get("stats")
+        path = job["path"]
+        if str(path) in active:
+            queue.task_done()
+            continue
+        active.add(str(path))
+        try:
+            manifest = db.get_media_file(str(path))
+            downloaded = None
+            if not is_complete(path, manifest):
+                # 同一源地址已下载过且内容仍在存储中：直接链接，不再下载
+                known = db.find_media_by_url(job["file_url"])
+                if known and get_blob_store().link(known["sha256"], path):
+                    info = {"size": known["expected_size"], "sha256": known["sha256"], "etag": known["etag"]}
+                else:
+                    started = time.perf_counter()
+                    with _stage(stats, "download"):
+                        info = await run_in_thread(
+                            executor,
+                            stream_download,
+                            job["session"],
+                            job["file_url"],
+                            path,
+                            job["timeout"],
+                            (manifest or {}).get("etag"),
+                            job["record"]["grp"],
+                        )
+                    media_type = job["record"]["msg_type"]
+                    MEDIA_DOWNLOAD_SECONDS.observe(time.perf_counter() - started, type=media_type)
+                    MEDIA_DOWNLOAD_BYTES.observe(info["size"], type=media_type)
+                    progress.add_bytes(info["size"])
+                    if stats is not None:
+                        stats.bytes_downloaded += info["size"]
+                downloaded = {
+                    "file_url": job["file_url"],
+                    "expected_size": info["size"],
+                    "sha256": info["sha256"],
+                    "etag": info["etag"],
+                }
+            db.complete_media(str(path), job["record"], downloaded)
+            if THUMB_PREGENERATE_WIDTHS and job["record"]["msg_type"] in THUMB_TYPES:
+                # 预先生成常用宽度的缩略图（在进程池中进行，不等待结果）
+                await run_in_thread(
+                    executor,
+                    get_thumbnails().pregenerate,
+                    {"message_type": job["record"]["msg_type"], "file_path": str(path)},
+                    THUMB_PREGENERATE_WIDTHS,
+                )
+        except Exception as ex:
+            # 单个文件下载失败不影响其它任务；待下载记录保留，下次抓取该成员时会再次尝试
+            progress.add_error(job["file_url"], ex)
+            if stats is not None:
+                stats.add_error(job["file_url"], ex)
+        finally:
+            active.discard(str(path))
+            queue.task_done()
+
+
+def start_media_stage(progress: Progress, executor: Optional[Executor] = None) -> Tuple[asyncio.Queue, List[asyncio.Task]]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+    active: Set[str] = set()
+    workers = [asyncio.create_task(media_worker(queue, progress, active, executor)) for _ in range(MEDIA_CONCURRENCY)]
+    return queue, workers
+
+
+async def stop_media_stage(workers: List[asyncio.Task]):
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def _get_authorized(
+    session: requests.Session,
+    grp: str,
+    url: str,
+    sem: asyncio.Semaphore,
+    stats: Optional[MemberStats] = None,
+    executor: Optional[Executor] = None,
+) -> requests.Response:
+    """携带缓存的 access token 请求；401 时刷新一次（同组单飞）后重试。"""
+    manager = get_token_manager()
+    with _stage(stats, "token"):
+        # 缓存缺失或即将过期时会同步刷新（最长约 30 秒），放到线程中执行，不阻塞事件循环上的其它成员
+        token = await run_in_thread(executor, manager.get_token, grp)
+    async with sem:
+        with _stage(stats, "timeline"):
+            r = await run_in_thread(executor, request, session, "GET", url, grp=grp, endpoint="timeline", headers={"Authorization": f"Bearer {token}"}, timeout=30)
+    if r.status_code != 401:
+        return r
+    with _stage(stats, "token"):
+        token = await run_in_thread(executor, manager.refresh, grp, token)
+    async with sem:
+        with _stage(stats, "timeline"):
+            return await run_in_thread(executor, request, session, "GET", url, grp=grp, endpoint="timeline", headers={"Authorization": f"Bearer {token}"}, timeout=30)
+
+
+async def iter_timeline(
+    session: requests.Session,
+    grp: str,
+    member_id: str,
+    created_from: str,
+    sem: asyncio.Semaphore,
+    until: Optional[str] = None,
+    stats: Optional[MemberStats] = None,
+    executor: Optional[Executor] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """从 created_from（yyyyMMddHHmmss）开始按发布时间升序连续翻页，直到接口取完。
+    until（yyyyMMddHHmmss）用于回填时截断时间窗口。
+    """
+    since = to_api_time(created_from)
+    seen = set()
+    for _ in range(TIMELINE_MAX_PAGES):
+        url = (
+            f"{BASE_URL[grp]}/v2/groups/{member_id}/timeline"
+            f"?count={TIMELINE_PAGE_SIZE}&order=asc&created_from={requests.utils.quote(since, safe='')}"
+        )
+        r = await _get_authorized(session, grp, url, sem, stats, executor)
+        r.raise_for_status()
+        messages = r.json().get("messages") or []
+
+        # created_from 包含边界时间，上一页最后几条会再次出现，按 id 去重
+        page = []
+        reached_end = False
+        for ep in messages:
+            msg_id = str(ep.get("id"))
+            if msg_id in seen:
                 continue
-            access_token = token_row[0]
-            headers = {**headers_base, "Authorization": f"Bearer {access_token}"}
-
-            try:
-                r = requests.get(url, headers=headers, timeout=30)
-                r.raise_for_status()
-                data = r.json()
-                messages = data.get("messages") or []
-                if not messages:
-                    continue
+            seen.add(msg_id)
+            if until and _normalize_published_at(ep.get("published_at"))[:14] > until:
+                reached_end = True
+                break
+            page.append(ep)
+        if page:
+            yield page
 
-                for ep in messages:
-                    if ep.get("state") != "published":
-                        continue
-                    # published_at 格式调整为 yyyyMMddHHmmss
-                    published_at = (
-                        str(ep.get("published_at", ""))
-                        .replace("-", "")
-                        .replace(":", "")
-                        .replace("T", "")
-                        .replace("Z", "")
-                    )
-                    msg_id = str(ep.get("id"))
-                    msg_type = str(ep.get("type"))
-                    text_content = ep.get("text") or ""
-                    file_url = ep.get("file")
-
-                    # 命名与C#保持一致
-                    if msg_type == "picture":
-                        name = f"{msg_id}_1_{published_at}"
-                        # 文本
-                        _save_text(member_dir / f"{name}.txt", text_content)
-                        # 图片下载
-                        if file_url:
-                            img_path = member_dir / f"{name}.jpg"
-                            resp = requests.get(file_url, timeout=60)
-                            resp.raise_for_status()
-                            img_path.write_bytes(resp.content)
-                            file_path_db = str(img_path)
-                        else:
-                            file_path_db = None
-                        # 合并为一条记录（图片消息可能同时拥有文本与文件）
-                        db.upsert_message(
-                            msg_id=msg_id,
-                            msg_type="image",
-                            text_content=text_content,
-                            file_path=file_path_db,
-                            grp=grp,
-                            member_id=member_id,
-                            member_name=member_name,
-                            published_at=published_at,
-                        )
+        if reached_end or not page or len(messages) < TIMELINE_PAGE_SIZE:
+            return
+        since = str(messages[-1].get("published_at") or since)
 
-                    elif msg_type == "text":
-                        name = f"{msg_id}_0_{published_at}.txt"
-                        path = member_dir / name
-                        _save_text(path, text_content)
-                        db.upsert_message(
-                            msg_id=msg_id,
-                            msg_type="text",
-                            text_content=text_content,
-                            file_path=None,  # 文本消息不记录文件路径
-                            grp=grp,
-                            member_id=member_id,
-                            member_name=member_name,
-                            published_at=published_at,
-                        )
 
-                    elif msg_type == "voice":
-                        name = f"{msg_id}_3_{published_at}.m4a"
-                        if file_url:
-                            path = member_dir / name
-                            resp = requests.get(file_url, timeout=120)
-                            resp.raise_for_status()
-                            path.write_bytes(resp.content)
-                            file_path_db = str(path)
-                        else:
-                            file_path_db = None
-                        db.upsert_message(
-                            msg_id=msg_id,
-                            msg_type="audio",
-                            text_content=text_content or None,
-                            file_path=file_path_db,
-                            grp=grp,
-                            member_id=member_id,
-                            member_name=member_name,
-                            published_at=published_at,
-                        )
+async def store_messages(
+    grp: str,
+    member_id: str,
+    member_name: str,
+    member_dir: Path,
+    session: requests.Session,
+    messages: List[Dict[str, Any]],
+    media_queue: asyncio.Queue,
+    result: dict,
+    progress: Optional[Progress] = None,
+    stats: Optional[MemberStats] = None,
+    executor: Optional[Executor] = None,
+):
+    """保存一页消息：整页记录一次批量入库，媒体文件随后交给下载阶段。
+    文字文件（或归档）写入与入库都包含 fsync，在 executor 中执行，不阻塞事件循环。
+    """
+    records = []
+    media_jobs = []
+    # 文字内容：(文件名不含扩展名, 归档条目)
+    texts = []
+    for ep in messages:
+        if ep.get("state") != "published":
+            continue
+        published_at = _normalize_published_at(ep.get("published_at"))
+        msg_id = str(ep.get("id"))
+        msg_type = str(ep.get("type"))
+        text_content = ep.get("text") or ""
+        file_url = ep.get("file")
+
+        # 命名与C#保持一致
+        if msg_type == "text":
+            texts.append((f"{msg_id}_0_{published_at}", {"id": msg_id, "type": "text", "published_at": published_at, "text": text_content}))
+            records.append({
+                "msg_id": msg_id,
+                "msg_type": "text",
+                "text_content": text_content,
+                "file_path": None,  # 文本消息不记录文件路径
+                "grp": grp,
+                "member_id": member_id,
+                "member_name": member_name,
+                "published_at": published_at,
+            })
+
+        elif msg_type in MEDIA_SPEC:
+            db_type, type_index, ext, timeout = MEDIA_SPEC[msg_type]
+            name = f"{msg_id}_{type_index}_{published_at}"
+            if msg_type == "picture":
+                # 图片消息可能同时拥有文本与文件，文本单独保存
+                texts.append((name, {"id": msg_id, "type": "image", "published_at": published_at, "text": text_content}))
+            else:
+                text_content = text_content or None
+            record = {
+                "msg_id": msg_id,
+                "msg_type": db_type,
+                "text_content": text_content,
+                "grp": grp,
+                "member_id": member_id,
+                "member_name": member_name,
+                "published_at": published_at,
+            }
+            # 先写入消息记录，文件路径在下载完成后补齐
+            records.append({**record, "file_path": None})
+            if file_url:
+                media_jobs.append({
+                    "session": session,
+                    "file_url": file_url,
+                    "path": member_dir / f"{name}{ext}",
+                    "timeout": timeout,
+                    "record": record,
+                    "stats": stats,
+                })
+
+        result["processed"] += 1
+        result["items"].append({
+            "grp": grp,
+            "member": member_name,
+            "id": msg_id,
+            "type": msg_type,
+            "published_at": published_at,
+        })
+
+    pending = [
+        {"file_path": str(job["path"]), "file_url": job["file_url"], "timeout": job["timeout"], "record": job["record"]}
+        for job in media_jobs
+    ]
+    with _stage(stats, "db_write"):
+        await run_in_thread(executor, _persist_page, member_dir, texts, records, pending)
+    if stats is not None:
+        stats.add_page(records)
+    for r in records:
+        MESSAGES_INGESTED.inc(type=r["msg_type"])
+    if progress is not None:
+        progress.add_messages(len(records))
+    for job in media_jobs:
+        await media_queue.put(job)
+
+
+def _persist_page(member_dir: Path, texts: List[Tuple[str, Dict[str, Any]]], records: List[Dict[str, Any]], pending: List[Dict[str, Any]]):
+    # 先写文字文件再入库：入库后同步游标才会前进
+    if TEXT_STORAGE == "files":
+        for name, entry in texts:
+            _save_text(member_dir / f"{name}.txt", entry["text"])
+    else:
+        append_texts(member_dir, [entry for _, entry in texts])
+    get_db().bulk_upsert_messages(records, pending)
 
-                    elif msg_type == "video":
-                        name = f"{msg_id}_2_{published_at}.mp4"
-                        if file_url:
-                            path = member_dir / name
-                            resp = requests.get(file_url, timeout=180)
-                            resp.raise_for_status()
-                            path.write_bytes(resp.content)
-                            file_path_db = str(path)
-                        else:
-                            file_path_db = None
-                        db.upsert_message(
-                            msg_id=msg_id,
-                            msg_type="video",
-                            text_content=text_content or None,
-                            file_path=file_path_db,
-                            grp=grp,
-                            member_id=member_id,
-                            member_name=member_name,
-                            published_at=published_at,
-                        )
 
-                    result["processed"] += 1
-                    result["items"].append({
-                        "grp": grp,
-                        "member": member_name,
-                        "id": msg_id,
-                        "type": msg_type,
-                        "published_at": published_at,
-                    })
-            except Exception:
-                # 柔性跳过个别成员错误
+async def _fetch_member(
+    grp: str,
+    cfg: GroupConfig,
+    mem: Dict[str, Any],
+    session: requests.Session,
+    sem: asyncio.Semaphore,
+    media_queue: asyncio.Queue,
+    result: dict,
+    progress: Progress,
+    run: IngestRun,
+    executor: Optional[Executor] = None,
+):
+    """抓取单个成员自同步游标以来的全部时间线。"""
+    db = get_db()
+    member_id = str(mem.get("id"))
+    member_name = str(mem.get("name"))
+    member_dir = prepare_member_dir(cfg, member_name)
+    stats = run.member(grp, member_id, member_name)
+
+    # 同步游标取自数据库（按成员主键读取），不再扫描目录
+    cursor = db.get_sync_cursor(grp, member_id)
+    latest_ts = (cursor or {}).get("last_published_at")
+    if not latest_ts:
+        # 默认当天零点
+        latest_ts = datetime.utcnow().strftime("%Y%m%d") + "000000"
+    stats.cursor_from = latest_ts
+
+    try:
+        # 先续传以前运行中未完成的媒体（下载失败或进程中途退出），它们的消息已在同步游标之前
+        for p in await run_in_thread(executor, db.list_pending_media, grp, member_id):
+            await media_queue.put({
+                "session": session,
+                "file_url": p["file_url"],
+                "path": Path(p["file_path"]),
+                "timeout": p["timeout"],
+                "record": p["record"],
+                "stats": stats,
+            })
+        async for page in iter_timeline(session, grp, member_id, latest_ts, sem, stats=stats, executor=executor):
+            await store_messages(grp, member_id, member_name, member_dir, session, page, media_queue, result, progress, stats, executor)
+    except Exception as ex:
+        # 柔性跳过个别成员错误
+        progress.add_error(f"{grp}/{member_name}", ex)
+        stats.add_error(f"{grp}/{member_name}", ex)
+    finally:
+        stats.finish()
+        progress.member_done()
+
+
+async def run_getmessage_async(
+    progress: Optional[Progress] = None,
+    members: Optional[Dict[str, List[str]]] = None,
+) -> dict:
+    """异步抓取流水线：每组一个连接池会话，成员时间线按组限流并发抓取，媒体下载为独立的有界阶段；
+    两者各用一个专用线程池（组数 × MEMBER_CONCURRENCY、MEDIA_CONCURRENCY），互不占用线程。
+    members：{组: [成员ID]}，只抓取其中的成员（自适应轮询使用）；为 None 时抓取全部配置成员。
+    每次运行记录到抓取台账（ingest_runs），result["run_id"] 为台账 id。
+    """
+    progress = progress or Progress()
+    configs = load_group_configs()
+    run = IngestRun("getmessage", progress.job_id)
+    result = {"processed": 0, "items": [], "run_id": run.start()}
+    status = "failed"
+
+    groups = [grp for grp in configs if members is None or members.get(grp)]
+    executors = CrawlExecutors(len(groups) * MEMBER_CONCURRENCY)
+    media_queue, workers = start_media_stage(progress, executors.media)
+    sessions = []
+    fetches = []
+    try:
+        for grp in groups:
+            cfg = configs[grp]
+            # token 由缓存提供，每组在开始前确认一次（缺失或过期时按需刷新）
+            if not await run_in_thread(executors.fetch, get_token_manager().get_token, grp):
+                progress.add_error(grp, "no access token")
+                run.add_error(grp, "no access token")
                 continue
+            session = build_session(grp)
+            sessions.append(session)
+            sem = asyncio.Semaphore(MEMBER_CONCURRENCY)
+            for mem in cfg.members:
+                if members is not None and str(mem.get("id")) not in members[grp]:
+                    continue
+                fetches.append(_fetch_member(grp, cfg, mem, session, sem, media_queue, result, progress, run, executors.fetch))
+
+        progress.set_total(len(fetches))
+        await asyncio.gather(*fetches)
+        # 等待媒体队列清空后再结束下载阶段
+        await media_queue.join()
+        status = "succeeded"
+    finally:
+        await stop_media_stage(workers)
+        executors.shutdown()
+        for session in sessions:
+            session.close()
+        run.finish(status)
+    return result
+
+
+def run_getmessage(
+    progress: Optional[Progress] = None,
+    members: Optional[Dict[str, List[str]]] = None,
+) -> dict:
+    """调用远程API拉取消息，按配置成员与命名规则保存到各自目录，并写入数据库。
+    同步封装，供 APScheduler 与命令行调用；异步环境中请直接 await run_getmessage_async()。
+    """
+    print("开始更新所有组的消息")
+    result = asyncio.run(run_getmessage_async(progress, members))
     print("更新所有组的消息完成")
-    return result
\ No newline at end of file
+    return result
@@ -1,60 +1,28 @@
-import requests
-from ..db import get_db
-from ..config_loader import load_group_configs
-
+from typing import Optional
 
-HEADERS_MAP = {
-    "nogi": {
-        "X-Talk-App-ID": "jp.co.sonymusic.communication.nogizaka 2.4",
-        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
-    },
-    "saku": {
-        "X-Talk-App-ID": "jp.co.sonymusic.communication.sakurazaka 2.4",
-        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
-    },
-    "hina": {
-        "X-Talk-App-ID": "jp.co.sonymusic.communication.keyakizaka 2.4",
-        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
-    },
-}
-
-TOKEN_URL = {
-    "nogi": "https://api.n46.glastonr.net/v2/update_token",
-    "saku": "https://api.s46.glastonr.net/v2/update_token",
-    "hina": "https://api.kh.glastonr.net/v2/update_token",
-}
+from ..config_loader import load_group_configs
+from ..progress import Progress
+from ..upstream import describe_failure
+from .tokens import get_token_manager
 
 
-def run_gettoken() -> dict:
-    """从远程API更新各组的临时token，并保存到数据库。"""
+def run_gettoken(force: bool = True, progress: Optional[Progress] = None) -> dict:
+    """从远程API更新各组的临时token，并保存到数据库。
+    force=False 时只刷新即将过期的token（定时任务使用），否则无条件刷新。
+    """
     print("开始更新所有组的token")
-    db = get_db()
+    manager = get_token_manager()
     configs = load_group_configs()
     results = {}
 
-    for grp, cfg in configs.items():
-        url = TOKEN_URL.get(grp)
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Accept-Language": "ja-JP",
-            "Accept-Encoding": "gzip",
-            "TE": "gzip, deflate; q=0.5",
-            **HEADERS_MAP.get(grp, {}),
-        }
-        payload = {"refresh_token": cfg.refresh_token}
+    for grp in configs:
         try:
-            r = requests.post(url, json=payload, headers=headers, timeout=20)
-            r.raise_for_status()
-            data = r.json()
-            access_token = data.get("access_token")
-            if access_token:
-                db.save_token(access_token, grp=grp)
-                results[grp] = {"ok": True, "access_token": access_token}
-            else:
-                results[grp] = {"ok": False, "error": "no access_token in response"}
+            access_token = manager.refresh(grp, force=force)
+            results[grp] = {"ok": True, "access_token": access_token}
         except Exception as ex:
-            results[grp] = {"ok": False, "error": str(ex)}
+            results[grp] = {"ok": False, **describe_failure(grp, ex)}
+            if progress is not None:
+                progress.add_error(grp, ex)
     print("更新所有组的token完成")
 
-    return {"groups": results}
\ No newline at end of file
+    return {"groups": results}
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from ..db import get_db
+from ..upstream import request
+from ..config_loader import load_group_configs
+from ..config import API_BASE_URL, TOKEN_TTL_SECONDS, TOKEN_REFRESH_MARGIN, TOKEN_KEEP_ROWS
+
+
+HEADERS_MAP = {
+    "nogi": {
+        "X-Talk-App-ID": "jp.co.sonymusic.communication.nogizaka 2.4",
+        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
+    },
+    "saku": {
+        "X-Talk-App-ID": "jp.co.sonymusic.communication.sakurazaka 2.4",
+        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
+    },
+    "hina": {
+        "X-Talk-App-ID": "jp.co.sonymusic.communication.keyakizaka 2.4",
+        "User-Agent": "Dalvik/2.1.0 (Linux; U; Android 6.0; Samsung Galaxy S7 for keyaki messages Build/MRA58K)",
+    },
+}
+
+TOKEN_URL = {grp: f"{base}/v2/update_token" for grp, base in API_BASE_URL.items()}
+
+
+def request_access_token(grp: str, refresh_token: str) -> Tuple[str, int]:
+    """用 refresh_token 换取新的 access token，返回 (token, 有效秒数)。"""
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Accept-Language": "ja-JP",
+        "Accept-Encoding": "gzip",
+        "TE": "gzip, deflate; q=0.5",
+        **HEADERS_MAP.get(grp, {}),
+    }
+    r = request(None, "POST", TOKEN_URL[grp], grp=grp, endpoint="update_token", json={"refresh_token": refresh_token}, headers=headers, timeout=20)
+    r.raise_for_status()
+    data = r.json()
+    access_token = data.get("access_token")
+    if not access_token:
+        raise ValueError("no access_token in response")
+    expires_in = data.get("expires_in")
+    return access_token, int(expires_in) if isinstance(expires_in, (int, float)) and expires_in > 0 else TOKEN_TTL_SECONDS
+
+
+class TokenManager:
+    """按组缓存 access token 及其过期时间。
+    - get_token：优先返回内存缓存，其次读取数据库最新一条，都过期时才刷新；
+    - refresh：收到 401 时调用，同一组同时只会有一次刷新请求，其余调用方复用结果。
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, grp: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(grp, threading.Lock())
+
+    def _valid(self, grp: str, margin: float = 0) -> Optional[str]:
+        entry = self._cache.get(grp)
+        if entry and entry[1] - margin > time.time():
+            return entry[0]
+        return None
+
+    def _load_from_db(self, grp: str):
+        row = get_db().latest_token(grp)
+        if not row:
+            return
+        expires_at = row.get("expires_at")
+        try:
+            if expires_at:
+                expiry = datetime.fromisoformat(expires_at).timestamp()
+            else:
+                # 旧记录没有过期时间：created_at 为 UTC，按默认有效期推算
+                created = datetime.fromisoformat(row["created_at"]).replace(tzinfo=timezone.utc)
+                expiry = created.timestamp() + TOKEN_TTL_SECONDS
+        except ValueError:
+            return
+        self._cache[grp] = (row["token"], expiry)
+
+    def _refresh_locked(self, grp: str) -> str:
+        cfg = load_group_configs().get(grp)
+        if cfg is None or not cfg.refresh_token:
+            raise ValueError(f"no refresh token configured for {grp}")
+        access_token, expires_in = request_access_token(grp, cfg.refresh_token)
+        expiry = time.time() + expires_in
+        db = get_db()
+        db.save_token(access_token, grp=grp, expires_at=datetime.fromtimestamp(expiry, timezone.utc).isoformat())
+        db.prune_tokens(grp, keep=TOKEN_KEEP_ROWS)
+        self._cache[grp] = (access_token, expiry)
+        return access_token
+
+    def get_token(self, grp: str) -> Optional[str]:
+        token = self._valid(grp)
+        if token:
+            return token
+        with self._lock(grp):
+            token = self._valid(grp)
+            if token:
+                return token
+            self._load_from_db(grp)
+            token = self._valid(grp)
+            if token:
+                return token
+            try:
+                return self._refresh_locked(grp)
+            except Exception:
+                return None
+
+    def refresh(self, grp: str, stale: Optional[str] = None, force: bool = True) -> str:
+        """刷新该组 token。传入 stale 时，如其它调用方已经换到新 token 则直接复用；
+        force=False 时仅在即将过期（TOKEN_REFRESH_MARGIN 内）才真正请求。
+        """
+        with self._lock(grp):
+            if grp not in self._cache:
+                self._load_from_db(grp)
+            current = self._valid(grp)
+            if stale is not None and current and current != stale:
+                return current
+            if not force and self._valid(grp, margin=TOKEN_REFRESH_MARGIN):
+                return current
+            return self._refresh_locked(grp)
+
+
+_manager: TokenManager | None = None
+
+
+def get_token_manager() -> TokenManager:
+    global _manager
+    if _manager is None:
+        _manager = TokenManager()
+    return _manager
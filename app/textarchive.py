@@ -0,0 +1,134 @@
+import json
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# 旧版文本文件名：{msg_id}_{typeIndex}_{yyyyMMddHHmmss}.txt
+TEXT_FILE_RE = re.compile(r"^(\d+)_(\d+)_(\d{14})\.txt$")
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx"
+
+# 同一成员目录的追加互斥（抓取在线程池中写入，回填的多个时间窗口可能同时写同一个月的归档）
+_dir_locks: Dict[str, threading.Lock] = {}
+_dir_locks_guard = threading.Lock()
+
+
+def _dir_lock(member_dir: Path) -> threading.Lock:
+    with _dir_locks_guard:
+        return _dir_locks.setdefault(str(member_dir), threading.Lock())
+
+
+def _archive_paths(member_dir: Path, month: str):
+    return member_dir / f"{month}{ARCHIVE_SUFFIX}", member_dir / f"{month}{INDEX_SUFFIX}"
+
+
+def _load_index(index_path: Path) -> Dict[str, int]:
+    index: Dict[str, int] = {}
+    if not index_path.exists():
+        return index
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) == 2 and parts[1].isdigit():
+                index[parts[0]] = int(parts[1])
+    return index
+
+
+def append_texts(member_dir: Path, entries: Iterable[Dict[str, Any]]) -> int:
+    """把文本追加到成员的按月归档（{yyyyMM}.jsonl.gz，每批写一个 gzip 成员）。
+    同目录的 {yyyyMM}.idx 记录 msg_id 与所在 gzip 成员的字节偏移；已归档的 msg_id 跳过。
+    entries 字段：id、type、published_at、text。返回新写入条数。
+    """
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for e in entries:
+        month = str(e.get("published_at") or "")[:6] or "000000"
+        by_month.setdefault(month, []).append(e)
+
+    with _dir_lock(member_dir):
+        return _append(member_dir, by_month)
+
+
+def _append(member_dir: Path, by_month: Dict[str, List[Dict[str, Any]]]) -> int:
+    written = 0
+    for month, items in by_month.items():
+        archive_path, index_path = _archive_paths(member_dir, month)
+        index = _load_index(index_path)
+        fresh = []
+        for e in items:
+            msg_id = str(e["id"])
+            if msg_id in index:
+                continue
+            index[msg_id] = -1
+            fresh.append(e)
+        if not fresh:
+            continue
+        member_dir.mkdir(parents=True, exist_ok=True)
+        payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in fresh).encode("utf-8")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        data = compressor.compress(payload) + compressor.flush()
+        with open(archive_path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # 先写归档再写索引：中途崩溃时最多留下未被索引的数据，下次会重新追加
+        with open(index_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{e['id']}\t{offset}\n" for e in fresh))
+            f.flush()
+            os.fsync(f.fileno())
+        written += len(fresh)
+    return written
+
+
+def read_text(member_dir: Path, month: str, msg_id: str) -> Optional[Dict[str, Any]]:
+    """通过索引定位并解压单个 gzip 成员，读取一条归档文本。"""
+    archive_path, index_path = _archive_paths(member_dir, month)
+    offset = _load_index(index_path).get(str(msg_id))
+    if offset is None or offset < 0:
+        return None
+    decompressor = zlib.decompressobj(31)
+    data = b""
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            data += decompressor.decompress(chunk)
+    for line in data.decode("utf-8").splitlines():
+        entry = json.loads(line)
+        if str(entry.get("id")) == str(msg_id):
+            return entry
+    return None
+
+
+def compact_member_dir(member_dir: Path, keep_files: bool = False) -> Dict[str, int]:
+    """把成员目录下旧版的单条 .txt 文件迁移到归档，成功后删除原文件（keep_files=True 时保留）。"""
+    entries = []
+    files = []
+    placeholders = []
+    for p in member_dir.iterdir():
+        m = TEXT_FILE_RE.match(p.name)
+        if not m or not p.is_file():
+            continue
+        msg_id, type_index, published_at = m.groups()
+        if msg_id == "0":
+            # C# 版本使用的占位文件，无消息内容
+            placeholders.append(p)
+            continue
+        entries.append({
+            "id": msg_id,
+            "type": "text" if type_index == "0" else "image",
+            "published_at": published_at,
+            "text": p.read_text(encoding="utf-8"),
+        })
+        files.append(p)
+    written = append_texts(member_dir, entries)
+    if not keep_files:
+        for p in files + placeholders:
+            p.unlink()
+    return {"files": len(files), "archived": written}
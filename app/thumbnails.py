@@ -0,0 +1,233 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+from .db import get_db
+from .metrics import THUMBNAIL_REQUESTS, THUMBNAIL_RENDER_SECONDS
+from .config import (
+    THUMB_DIR,
+    THUMB_WIDTHS,
+    THUMB_WORKERS,
+    THUMB_QUALITY,
+    THUMB_CACHE_MAX_BYTES,
+    THUMB_FFMPEG,
+    THUMB_VIDEO_SEEK,
+)
+
+
+# 可生成缩略图的消息类型（语音没有画面）
+THUMB_TYPES = ("image", "video")
+# 同一缩略图两次登记访问时间的最小间隔（秒），避免图库翻页时每个请求都写数据库
+TOUCH_INTERVAL = 60
+
+
+class ThumbnailUnavailable(Exception):
+    """源文件无法生成缩略图（格式不支持、ffmpeg 不可用等）。"""
+
+
+def snap_width(width: int) -> int:
+    """把请求的宽度向上取整到 THUMB_WIDTHS 中的档位。"""
+    for w in THUMB_WIDTHS:
+        if width <= w:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+def _resize_to_jpeg(img: Image.Image, dst: str, width: int, quality: int) -> int:
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if img.width > width:
+        # draft 已让 JPEG 解码时直接缩小，这里只做最后一步高质量缩放；不放大比目标更小的图片
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    tmp = dst + ".tmp"
+    img.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+def render_image(src: str, dst: str, width: int, quality: int) -> int:
+    """（在子进程中运行）生成图片缩略图，返回文件大小。"""
+    with Image.open(src) as img:
+        img.draft("RGB", (width, width))
+        return _resize_to_jpeg(img, dst, width, quality)
+
+
+def render_video(src: str, dst: str, width: int, quality: int, ffmpeg: str, seek: float) -> int:
+    """（在子进程中运行）用 ffmpeg 截取一帧作为封面，再按图片缩略图处理。"""
+    frame = b""
+    # 先尝试指定时间点（跳过片头黑屏），视频更短时退回第一帧
+    for ss in (seek, 0):
+        try:
+            proc = subprocess.run(
+                [ffmpeg, "-v", "error", "-ss", str(ss), "-i", src, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+                capture_output=True,
+                timeout=60,
+            )
+        except FileNotFoundError:
+            raise ThumbnailUnavailable(f"未找到 {ffmpeg}，无法生成视频封面")
+        frame = proc.stdout
+        if proc.returncode == 0 and frame:
+            break
+    if not frame:
+        raise ThumbnailUnavailable("无法从视频中截取画面")
+    with Image.open(io.BytesIO(frame)) as img:
+        return _resize_to_jpeg(img, dst, width, quality)
+
+
+class ThumbnailService:
+    """缩略图与视频封面（派生文件）：
+    - 在进程池中生成，不占用 API 事件循环与抓取线程的 CPU；
+    - 按源文件内容（sha256，无记录时用路径与修改时间）与宽度缓存在 THUMB_DIR，相同内容的多个消息共用；
+    - 同一变体的并发请求共用一次生成（进程内）；
+    - 缓存总大小受 THUMB_CACHE_MAX_BYTES 限制，按最近访问时间（thumbnails 表，跨进程共享）淘汰；
+    - 子进程异常退出（内存不足、解码器崩溃）时进程池不可再用：只让该进程池中的任务失败（BrokenExecutor），随后重建。
+    """
+
+    def __init__(self, root: Path = THUMB_DIR, workers: int = THUMB_WORKERS):
+        self.root = root
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._inflight: Dict[str, Future] = {}
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：API 与调度器进程中都有多个线程，fork 可能复制到被占用的锁
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _submit(self, *args):
+        """提交到进程池（调用方持有 _lock）；进程池已损坏时重建后重新提交。返回 (任务, 所在进程池)。"""
+        pool = self._executor()
+        try:
+            return pool.submit(*args), pool
+        except BrokenExecutor:
+            self._discard(pool)
+            pool = self._executor()
+            return pool.submit(*args), pool
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        # 调用方持有 _lock；只丢弃仍在使用的那个进程池，后续任务在新进程池中执行
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def variant(self, row: Dict, width: int) -> str:
+        """缓存文件相对路径：{key[:2]}/{key}-{宽度}.jpg"""
+        manifest = get_db().get_media_file(row["file_path"])
+        if manifest and manifest.get("sha256"):
+            key = manifest["sha256"]
+        else:
+            st = os.stat(row["file_path"])
+            key = hashlib.sha256(f"{row['file_path']}:{st.st_mtime_ns}:{st.st_size}".encode("utf-8")).hexdigest()
+        return f"{key[:2]}/{key}-{width}.jpg"
+
+    def get(self, row: Dict, width: int) -> Future:
+        """返回缩略图路径的 Future（已缓存时立即完成）。row 为 messages 表的一行。"""
+        if row.get("message_type") not in THUMB_TYPES or not row.get("file_path"):
+            raise ThumbnailUnavailable("该消息没有可生成缩略图的媒体文件")
+        try:
+            rel = self.variant(row, width)
+        except OSError:
+            raise ThumbnailUnavailable("源文件不存在")
+        path = self.root / rel
+        with self._lock:
+            fut = self._inflight.get(rel)
+            if fut is not None:
+                THUMBNAIL_REQUESTS.inc(result="shared")
+                return fut
+            cached = path.exists()
+            if not cached:
+                THUMBNAIL_REQUESTS.inc(result="miss")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if row["message_type"] == "video":
+                    args = (render_video, row["file_path"], str(path), width, THUMB_QUALITY, THUMB_FFMPEG, THUMB_VIDEO_SEEK)
+                else:
+                    args = (render_image, row["file_path"], str(path), width, THUMB_QUALITY)
+                started = time.perf_counter()
+                job, pool = self._submit(*args)
+                fut = Future()
+                self._inflight[rel] = fut
+        if cached:
+            THUMBNAIL_REQUESTS.inc(result="hit")
+            self._touch(rel, path)
+            fut = Future()
+            fut.set_result(path)
+            return fut
+        job.add_done_callback(lambda j: self._finished(j, pool, fut, rel, path, row["message_type"], started))
+        return fut
+
+    def _finished(self, job: Future, pool: ProcessPoolExecutor, fut: Future, rel: str, path: Path, msg_type: str, started: float):
+        try:
+            size = job.result()
+        except BrokenExecutor as ex:
+            # 子进程异常退出：该进程池中的任务都会失败，下一次请求在重建的进程池中生成
+            with self._lock:
+                self._discard(pool)
+            fut.set_exception(ex)
+        except ThumbnailUnavailable as ex:
+            fut.set_exception(ex)
+        except Exception as ex:
+            # 图片格式无法识别、找不到 ffmpeg、源文件在生成前被删除等
+            fut.set_exception(ThumbnailUnavailable(str(ex)))
+        else:
+            THUMBNAIL_RENDER_SECONDS.observe(time.perf_counter() - started, type=msg_type)
+            try:
+                get_db().touch_thumbnail(rel, size)
+                self._evict()
+            finally:
+                fut.set_result(path)
+        finally:
+            with self._lock:
+                self._inflight.pop(rel, None)
+
+    def _touch(self, rel: str, path: Path):
+        now = time.monotonic()
+        if now - self._touched.get(rel, 0.0) < TOUCH_INTERVAL:
+            return
+        self._touched[rel] = now
+        try:
+            get_db().touch_thumbnail(rel, path.stat().st_size)
+        except OSError:
+            # 刚被其它进程淘汰：下次请求会重新生成
+            pass
+
+    def _evict(self):
+        for rel in get_db().evict_thumbnails(THUMB_CACHE_MAX_BYTES):
+            self._touched.pop(rel, None)
+            try:
+                os.remove(self.root / rel)
+            except OSError:
+                pass
+
+    def pregenerate(self, row: Dict, widths) -> None:
+        """抓取阶段预先生成（不等待结果，失败时在首次请求时重试）；不向抓取流程抛出异常，媒体文件本身已保存成功。"""
+        for width in widths:
+            try:
+                self.get(row, width)
+            except (ThumbnailUnavailable, OSError):
+                return
+            except Exception as ex:
+                print(f"预生成缩略图失败：{row.get('file_path')}: {ex}")
+                return
+
+
+_service: ThumbnailService | None = None
+
+
+def get_thumbnails() -> ThumbnailService:
+    global _service
+    if _service is None:
+        _service = ThumbnailService()
+    return _service
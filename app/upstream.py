@@ -0,0 +1,238 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from .metrics import UPSTREAM_SECONDS, UPSTREAM_REQUESTS
+from .config import (
+    UPSTREAM_RATE,
+    UPSTREAM_MIN_RATE,
+    UPSTREAM_BURST,
+    UPSTREAM_MAX_ATTEMPTS,
+    UPSTREAM_BACKOFF_BASE,
+    UPSTREAM_BACKOFF_MAX,
+    UPSTREAM_BREAKER_THRESHOLD,
+    UPSTREAM_BREAKER_COOLDOWN,
+)
+
+
+# 可重试的状态码；429 只限速不计入熔断
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """上游请求最终失败（重试耗尽或熔断中），携带主机、状态码与原因，供进度与结果结构化记录。"""
+
+    def __init__(self, host: str, reason: str, status: Optional[int] = None, attempts: int = 0, message: str = ""):
+        super().__init__(message or f"{host}: {reason}")
+        self.host = host
+        self.reason = reason
+        self.status = status
+        self.attempts = attempts
+
+
+class TokenBucket:
+    """令牌桶限速，速率按 AIMD 自适应：收到 429 时减半（不低于 UPSTREAM_MIN_RATE），
+    之后每次成功请求缓慢回升到 UPSTREAM_RATE，以上游允许的最高速率运行而不触发封禁。
+    """
+
+    def __init__(self, rate: float = UPSTREAM_RATE, burst: int = UPSTREAM_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # Retry-After 要求的暂停截止时间
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def throttled(self, retry_after: Optional[float]):
+        with self._lock:
+            self.rate = max(UPSTREAM_MIN_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断 UPSTREAM_BREAKER_COOLDOWN 秒；冷却后放行一次试探请求，成功则恢复。
+    按请求计数（request 只记录每次请求重试后的最终结果），单个请求的多次重试不会独自触发熔断。
+    """
+
+    def __init__(self, threshold: int = UPSTREAM_BREAKER_THRESHOLD, cooldown: float = UPSTREAM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        # 持有试探名额的线程（request 在单个线程内完成一次请求）
+        self._probe_owner: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                self._probe_owner = threading.get_ident()
+                return True
+            # 试探请求自身的重试继续使用同一个名额
+            return state == "half_open" and self._probe_owner == threading.get_ident()
+
+    def release(self):
+        """试探请求没有得出结论（429 限流、非连接类异常）时交还试探名额，保持半开，下一次请求重新试探。
+        只对当前线程持有的名额生效，已经记录成功或失败时无操作。
+        """
+        with self._lock:
+            if self._probing and self._probe_owner == threading.get_ident():
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class HostGuard:
+    def __init__(self, host: str):
+        self.host = host
+        self.bucket = TokenBucket()
+        self.breaker = CircuitBreaker()
+
+
+_guards: Dict[str, HostGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_host_guard(url: str) -> HostGuard:
+    host = urlsplit(url).netloc
+    with _guards_lock:
+        guard = _guards.get(host)
+        if guard is None:
+            guard = _guards[host] = HostGuard(host)
+        return guard
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    # 全抖动指数退避
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+
+def request(
+    session: Optional[requests.Session],
+    method: str,
+    url: str,
+    max_attempts: int = UPSTREAM_MAX_ATTEMPTS,
+    rate_limited: bool = True,
+    grp: str = "",
+    endpoint: str = "",
+    **kwargs,
+) -> requests.Response:
+    """经过主机限速、重试与熔断的 HTTP 请求（阻塞，异步代码中放在线程里调用）。
+    429/5xx 与连接错误按 Retry-After 或抖动退避重试；其它状态码（包括 401、404）原样返回给调用方。
+    重试耗尽或熔断中时抛出 UpstreamError。
+    rate_limited=False 时不经过令牌桶（媒体下载已由下载阶段的并发数约束，受带宽而非请求数限制）。
+    grp、endpoint 仅用作指标标签。
+    """
+    guard = get_host_guard(url)
+    send = session.request if session is not None else requests.request
+    try:
+        for attempt in range(max_attempts):
+            if not guard.breaker.allow():
+                raise UpstreamError(guard.host, "circuit_open", attempts=attempt)
+            if rate_limited:
+                guard.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                resp = send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - start, grp=grp, endpoint=endpoint)
+                UPSTREAM_REQUESTS.inc(grp=grp, endpoint=endpoint, status="error")
+                if attempt + 1 >= max_attempts:
+                    # 熔断只记录请求的最终结果，中间的失败重试不计数
+                    guard.breaker.record_failure()
+                    raise UpstreamError(guard.host, "connection", attempts=attempt + 1, message=f"{guard.host}: {ex}") from ex
+                time.sleep(_backoff(attempt))
+                continue
+            # 流式响应只计到响应头返回为止
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, grp=grp, endpoint=endpoint)
+            UPSTREAM_REQUESTS.inc(grp=grp, endpoint=endpoint, status=resp.status_code)
+
+            if resp.status_code not in RETRY_STATUS:
+                guard.breaker.record_success()
+                guard.bucket.succeeded()
+                return resp
+
+            retry_after = _retry_after(resp)
+            if resp.status_code == 429:
+                guard.bucket.throttled(retry_after)
+            resp.close()
+            if attempt + 1 >= max_attempts:
+                # 最终为 5xx 时计一次熔断失败；429 说明主机可达、只是限流，不计入
+                if resp.status_code != 429:
+                    guard.breaker.record_failure()
+                raise UpstreamError(guard.host, f"http_{resp.status_code}", status=resp.status_code, attempts=attempt + 1)
+            time.sleep(min(retry_after, UPSTREAM_BACKOFF_MAX) if retry_after is not None else _backoff(attempt))
+        raise UpstreamError(guard.host, "no_attempts", attempts=0)
+    finally:
+        # 试探请求以 429 或其它异常（如 ChunkedEncodingError）结束时交还名额，不会卡在“试探中”
+        guard.breaker.release()
+
+
+def describe_failure(target: str, error: Any) -> Dict[str, Any]:
+    """把异常整理为结构化的失败记录：{"target", "error", 上游失败时附带 "host"/"status"/"reason"/"attempts"}。"""
+    out: Dict[str, Any] = {"target": target, "error": str(error)}
+    if isinstance(error, UpstreamError):
+        out.update(host=error.host, status=error.status, reason=error.reason, attempts=error.attempts)
+    elif isinstance(error, requests.HTTPError) and error.response is not None:
+        out.update(status=error.response.status_code, reason=f"http_{error.response.status_code}")
+    return out
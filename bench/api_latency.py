@@ -0,0 +1,181 @@
+"""/messages 延迟压测：生成指定行数的消息表，启动 API 服务后按几类典型查询统计 p50/p99。
+
+    python -m bench.api_latency --rows 1000000 --requests 500
+
+生成数据时会去掉 messages 表上的触发器（全文检索、变更日志等），只测量 /messages 的查询路径。
+--workdir 指定目录时保留生成的数据库，再次运行同一行数时直接复用。
+"""
+import argparse
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from bench.common import emit, free_port, percentiles, prepare_workdir
+
+
+MEMBERS = 40
+SEED_CHUNK = 500_000
+
+
+def seed(db_path: Path, rows: int) -> float:
+    """用递归 CTE 在 SQLite 内批量生成消息（按成员轮换、发布时间每行递增 1 分钟）。"""
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'messages'").fetchall():
+        conn.execute(f'DROP TRIGGER "{name}"')
+    done = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    while done < rows:
+        n = min(SEED_CHUNK, rows - done)
+        conn.execute(
+            """
+            WITH RECURSIVE seq(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO messages (message_type, text_content, file_path, grp, member_id, member_name, msg_id, published_at, created_at, msg_seq)
+            SELECT
+              CASE i % 4 WHEN 0 THEN 'text' WHEN 1 THEN 'image' WHEN 2 THEN 'audio' ELSE 'video' END,
+              'bench message ' || i,
+              CASE WHEN i % 4 = 0 THEN NULL ELSE 'data/messages/member' || (i % ?) || '/' || i || '.bin' END,
+              'nogi',
+              CAST(i % ? AS TEXT),
+              'member' || (i % ?),
+              CAST(i AS TEXT),
+              strftime('%Y%m%d%H%M%S', '2020-01-01', '+' || i || ' minutes'),
+              '2020-01-01T00:00:00',
+              i
+            FROM seq
+            """,
+            (done + 1, done + n, MEMBERS, MEMBERS, MEMBERS),
+        )
+        conn.commit()
+        done += n
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def _timed(session: requests.Session, url: str, samples: list, params: dict, headers: dict | None = None) -> requests.Response:
+    started = time.perf_counter()
+    r = session.get(url, params=params, headers=headers or {})
+    samples.append(time.perf_counter() - started)
+    r.raise_for_status()
+    return r
+
+
+def measure(base: str, rows: int, n: int) -> dict:
+    url = f"{base}/messages"
+    rnd = random.Random(rows)
+    results = {}
+    from app.db import encode_cursor
+
+    with requests.Session() as s:
+        # 预热：建立连接、填充只读连接池
+        for _ in range(5):
+            s.get(url, params={"limit": 1})
+
+        # 键集分页：从随机位置开始连续翻页（每个游标都是新查询，不命中响应缓存）
+        samples = []
+        cursor = None
+        for i in range(n):
+            if cursor is None or i % 20 == 0:
+                # 生成的数据中 msg_seq 与行 id 相同
+                start = rnd.randint(1, max(1, rows - 2000))
+                cursor = encode_cursor(start, start)
+            r = _timed(s, url, samples, {"limit": 100, "after": cursor})
+            cursor = r.headers.get("X-Next-Cursor")
+        results["keyset_page"] = percentiles(samples)
+
+        # 大页冷请求：limit=1000，每次都是新游标
+        samples = []
+        for _ in range(max(1, n // 5)):
+            start = rnd.randint(1, max(1, rows - 2000))
+            _timed(s, url, samples, {"limit": 1000, "after": encode_cursor(start, start)})
+        results["cold_page_1000"] = percentiles(samples)
+
+        # 按成员过滤
+        samples = []
+        for i in range(n):
+            _timed(s, url, samples, {"limit": 100, "member_id": str(rnd.randrange(MEMBERS)), "offset": i})
+        results["member_filter"] = percentiles(samples)
+
+        # 按日期过滤（数据中每天 1440 行）
+        days = max(1, rows // 1440)
+        samples = []
+        for i in range(n):
+            day = time.strftime("%Y%m%d", time.gmtime(1577836800 + rnd.randrange(days) * 86400))
+            _timed(s, url, samples, {"limit": 100, "date": day, "offset": i % 7})
+        results["date_filter"] = percentiles(samples)
+
+        # 深分页 offset（旧客户端的用法）
+        samples = []
+        for i in range(max(1, n // 5)):
+            _timed(s, url, samples, {"limit": 100, "offset": rnd.randint(0, max(0, rows - 100))})
+        results["deep_offset"] = percentiles(samples)
+
+        # 重复查询：命中响应缓存
+        samples = []
+        for _ in range(n):
+            _timed(s, url, samples, {"limit": 100})
+        results["cached"] = percentiles(samples)
+
+        # 条件请求：304
+        etag = s.get(url, params={"limit": 100}).headers.get("ETag")
+        samples = []
+        for _ in range(n):
+            _timed(s, url, samples, {"limit": 100}, {"If-None-Match": etag})
+        results["not_modified"] = percentiles(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/messages 延迟压测")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=300, help="每类查询的请求数")
+    parser.add_argument("--workdir", help="保留并复用生成的数据库")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="bench-api-"))
+    try:
+        prepare_workdir(workdir)
+        import uvicorn
+        from app.config import DB_PATH
+        from app.db import get_db
+
+        db = get_db()
+        db.init_db()
+        existing = db.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if existing > args.rows:
+            raise SystemExit(f"{DB_PATH} 已有 {existing} 行，多于 --rows {args.rows}")
+        seed_seconds = seed(DB_PATH, args.rows) if existing < args.rows else 0.0
+
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config("app.main:app", host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        try:
+            results = measure(f"http://127.0.0.1:{port}", args.rows, args.requests)
+        finally:
+            server.should_exit = True
+            thread.join()
+        emit({
+            "scenario": "api_latency",
+            "rows": args.rows,
+            "seed_seconds": round(seed_seconds, 1),
+            "db_mb": round(sum(p.stat().st_size for p in DB_PATH.parent.glob(DB_PATH.name + "*")) / 2 ** 20, 1),
+            **results,
+        })
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_workdir(workdir: Path, api_base_url: Optional[str] = None, members: int = 0) -> None:
+    """在导入 app 之前调用：数据目录、配置文件与上游地址都指向 workdir，互不影响正式数据。"""
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ["MESSAGE_BACKEND_DATA_DIR"] = str(workdir / "data")
+    if api_base_url:
+        os.environ["MESSAGE_BACKEND_API_BASE_URL"] = api_base_url
+    config_dir = workdir / "config"
+    config_dir.mkdir(exist_ok=True)
+    if members:
+        (config_dir / "nogiConfig.json").write_text(json.dumps({
+            "rootPath": str(workdir / "data" / "messages"),
+            "token": "bench-refresh-token",
+            "member": [{"id": str(i), "name": f"member{i}"} for i in range(1, members + 1)],
+        }), encoding="utf-8")
+    # config_loader 从当前目录下的 config/ 读取
+    os.chdir(workdir)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+
+
+def start_simulator_process(port: int, **options) -> subprocess.Popen:
+    """在独立进程中启动模拟器，避免与被测进程争用 CPU 与内存统计。"""
+    args = [sys.executable, "-m", "bench.simulator", "--port", str(port)]
+    for k, v in options.items():
+        args += [f"--{k.replace('_', '-')}", str(v)]
+    proc = subprocess.Popen(args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("simulator did not start")
+
+
+def current_rss() -> int:
+    """当前进程常驻内存（字节）；非 Linux 退化为历史峰值。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """后台线程定时采样 RSS，记录运行期间的峰值。"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "n": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def emit(result: dict) -> None:
+    """子进程以最后一行 JSON 输出结果，供 bench.run 汇总。"""
+    print(json.dumps(result, ensure_ascii=False), flush=True)
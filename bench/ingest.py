@@ -0,0 +1,76 @@
+"""端到端抓取压测：模拟器（独立进程）-> gettoken -> getmessage，统计吞吐与媒体下载期间的峰值内存。
+
+    python -m bench.ingest --members 20 --messages 500 --media-size 2000000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from bench.common import RssSampler, current_rss, emit, free_port, prepare_workdir, start_simulator_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端抓取压测")
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=500, help="每个成员的消息数")
+    parser.add_argument("--media-ratio", type=float, default=0.5)
+    parser.add_argument("--media-size", type=int, default=1_000_000)
+    parser.add_argument("--latency", type=float, default=20, help="模拟接口延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--workdir", help="默认使用临时目录，结束后删除")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="bench-ingest-"))
+    port = free_port()
+    sim = start_simulator_process(
+        port,
+        members=args.members,
+        messages=args.messages,
+        media_ratio=args.media_ratio,
+        media_size=args.media_size,
+        latency=args.latency,
+        error_rate=args.error_rate,
+    )
+    try:
+        prepare_workdir(workdir, api_base_url=f"http://127.0.0.1:{port}", members=args.members)
+        # 必须在 prepare_workdir 之后导入：配置在导入时读取环境变量
+        from app.db import get_db
+        from app.progress import Progress
+        from app.tasks.getmessage import run_getmessage
+        from app.tasks.gettoken import run_gettoken
+
+        get_db().init_db()
+        run_gettoken()
+        baseline = current_rss()
+        progress = Progress()
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            result = run_getmessage(progress)
+            elapsed = time.perf_counter() - started
+        emit({
+            "scenario": "ingest",
+            "members": args.members,
+            "messages_per_member": args.messages,
+            "media_size": args.media_size,
+            "latency_ms": args.latency,
+            "error_rate": args.error_rate,
+            "processed": result["processed"],
+            "seconds": round(elapsed, 3),
+            "messages_per_sec": round(result["processed"] / elapsed, 1) if elapsed else None,
+            "mb_downloaded": round(progress.bytes_downloaded / 1e6, 1),
+            "mb_per_sec": round(progress.bytes_downloaded / 1e6 / elapsed, 1) if elapsed else None,
+            "errors": len(progress.errors),
+            "rss_baseline_mb": round(baseline / 2 ** 20, 1),
+            "rss_peak_mb": round(sampler.peak / 2 ** 20, 1),
+        })
+    finally:
+        sim.terminate()
+        sim.wait()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""压测套件：依次运行各场景（每个场景一个子进程），结果写入仓库根目录的 bench_output.txt。
+
+    python -m bench.run                          # 完整套件：/messages 在 1万/100万/1000万 行上测量
+    python -m bench.run --quick                  # 快速检查：规模缩小，适合每次改动后运行
+    python -m bench.run --rows 10000,1000000 --cache-dir /tmp/bench-db   # 复用已生成的数据库
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from bench.common import ROOT
+
+
+OUTPUT = ROOT / "bench_output.txt"
+
+# 抓取场景：名称 -> bench.ingest 参数
+INGEST_SCENARIOS = {
+    "ingest_text_heavy": {"members": 40, "messages": 500, "media-ratio": 0.1, "media-size": 100_000},
+    "ingest_large_media": {"members": 10, "messages": 100, "media-ratio": 0.8, "media-size": 20_000_000},
+    "ingest_flaky_upstream": {"members": 20, "messages": 300, "media-size": 200_000, "error-rate": 0.05},
+}
+QUICK_INGEST_SCENARIOS = {
+    "ingest_text_heavy": {"members": 10, "messages": 200, "media-ratio": 0.1, "media-size": 100_000},
+    "ingest_large_media": {"members": 4, "messages": 40, "media-ratio": 0.8, "media-size": 5_000_000},
+    "ingest_flaky_upstream": {"members": 5, "messages": 100, "media-size": 200_000, "error-rate": 0.05},
+}
+ROWS = [10_000, 1_000_000, 10_000_000]
+QUICK_ROWS = [10_000, 100_000]
+
+
+def _run(module: str, args: Dict[str, object]) -> dict:
+    cmd = [sys.executable, "-m", module]
+    for k, v in args.items():
+        cmd += [f"--{k}", str(v)]
+    print("$", " ".join(cmd[1:]), flush=True)
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        return {"error": (proc.stderr or proc.stdout).strip().splitlines()[-5:]}
+    return json.loads(lines[-1])
+
+
+def _environment() -> List[str]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    return [
+        f"date: {datetime.now().isoformat(timespec='seconds')}",
+        f"commit: {rev or 'unknown'}",
+        f"python: {platform.python_version()}  sqlite: {sqlite3.sqlite_version}",
+        f"platform: {platform.platform()}  cpus: {os.cpu_count()}",
+    ]
+
+
+def _format_ingest(name: str, r: dict) -> str:
+    if "error" in r:
+        return f"{name:<24} ERROR {r['error']}"
+    return (
+        f"{name:<24} {r['processed']:>7} msgs {r['seconds']:>8.2f}s {r['messages_per_sec']:>9.1f} msg/s "
+        f"{r['mb_downloaded']:>8.1f} MB {r['mb_per_sec']:>7.1f} MB/s  rss {r['rss_baseline_mb']:.1f}->{r['rss_peak_mb']:.1f} MB"
+        f"  errors {r['errors']}"
+    )
+
+
+def _format_api(r: dict) -> List[str]:
+    if "error" in r:
+        return [f"  ERROR {r['error']}"]
+    lines = [f"rows={r['rows']:,}  db={r['db_mb']} MB  seed={r['seed_seconds']}s"]
+    for key, v in r.items():
+        if isinstance(v, dict) and "p50_ms" in v:
+            lines.append(f"  {key:<16} p50 {v['p50_ms']:>9.3f} ms  p99 {v['p99_ms']:>9.3f} ms  max {v['max_ms']:>9.3f} ms  (n={v['n']})")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测套件")
+    parser.add_argument("--quick", action="store_true", help="缩小规模")
+    parser.add_argument("--rows", help="逗号分隔的 /messages 数据规模，默认 10000,1000000,10000000")
+    parser.add_argument("--requests", type=int, default=300, help="/messages 每类查询的请求数")
+    parser.add_argument("--cache-dir", help="保存生成的数据库以便复用（按行数分目录）")
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--output", default=str(OUTPUT))
+    args = parser.parse_args()
+
+    rows = [int(x) for x in args.rows.split(",")] if args.rows else (QUICK_ROWS if args.quick else ROWS)
+    started = time.perf_counter()
+    report = ["# MessageBackend benchmark", *_environment(), ""]
+    raw: Dict[str, object] = {}
+
+    if not args.skip_ingest:
+        report.append("## ingest (simulator -> gettoken -> getmessage)")
+        for name, params in (QUICK_INGEST_SCENARIOS if args.quick else INGEST_SCENARIOS).items():
+            result = _run("bench.ingest", params)
+            raw[name] = result
+            report.append(_format_ingest(name, result))
+        report.append("")
+
+    if not args.skip_api:
+        report.append("## /messages latency")
+        for n in rows:
+            params: Dict[str, object] = {"rows": n, "requests": args.requests}
+            if args.cache_dir:
+                params["workdir"] = str(Path(args.cache_dir) / f"rows-{n}")
+            result = _run("bench.api_latency", params)
+            raw[f"api_{n}"] = result
+            report.extend(_format_api(result))
+        report.append("")
+
+    report.append(f"total: {time.perf_counter() - started:.1f}s")
+    report.append("")
+    report.append("## raw")
+    report.append(json.dumps(raw, ensure_ascii=False, indent=2))
+    text = "\n".join(report) + "\n"
+    Path(args.output).write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
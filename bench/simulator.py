@@ -0,0 +1,225 @@
+"""本地上游模拟器：实现 /v2/update_token、/v2/groups/{id}/timeline 与媒体下载，用于压测与本地调试。
+
+    python -m bench.simulator --members 40 --messages 500 --media-size 2000000 --latency 30 --error-rate 0.02
+
+应用通过环境变量 MESSAGE_BACKEND_API_BASE_URL=http://127.0.0.1:18765 指向模拟器。
+"""
+import argparse
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+TIMELINE_RE = re.compile(r"^/v2/groups/(\d+)/timeline$")
+MEDIA_RE = re.compile(r"^/media/(\d+)$")
+# 消息类型轮换顺序（media_ratio 决定其中媒体消息的比例）
+MEDIA_TYPES = ("picture", "voice", "video")
+
+
+class Simulator:
+    """按参数确定性地生成每个成员的时间线；媒体内容按消息 id 生成，边生成边发送，模拟器本身不占用大量内存。"""
+
+    def __init__(
+        self,
+        members: int = 5,
+        messages: int = 250,
+        media_ratio: float = 0.5,
+        media_size: int = 200_000,
+        latency_ms: float = 0,
+        error_rate: float = 0,
+        spacing_seconds: int = 10,
+        start: Optional[datetime] = None,
+        seed: int = 0,
+    ):
+        self.members = members
+        self.messages = messages
+        self.media_ratio = media_ratio
+        self.media_size = media_size
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.spacing = spacing_seconds
+        # 默认从当天零点（UTC）开始，与应用首次抓取的默认游标一致
+        self.start = start or datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.seed = seed
+        self.tokens = set()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 所有成员的发布时间相同，只需一份有序列表做二分查找
+        self.published = [
+            (self.start + timedelta(seconds=i * self.spacing)).strftime("%Y-%m-%dT%H:%M:%SZ") for i in range(messages)
+        ]
+
+    def count(self, kind: str):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def issue_token(self) -> str:
+        token = f"sim-{len(self.tokens) + 1}-{random.random():.6f}"
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def message(self, member_id: int, i: int, base_url: str) -> dict:
+        msg_id = member_id * 10_000_000 + i
+        rnd = random.Random(self.seed * 1_000_003 + msg_id)
+        is_media = rnd.random() < self.media_ratio
+        msg_type = MEDIA_TYPES[i % len(MEDIA_TYPES)] if is_media else "text"
+        msg = {
+            "id": msg_id,
+            "state": "published",
+            "type": msg_type,
+            "text": f"member {member_id} message {i} テスト本文 {rnd.randint(0, 10 ** 6)}",
+            "published_at": self.published[i],
+        }
+        if is_media:
+            msg["file"] = f"{base_url}/media/{msg_id}"
+        return msg
+
+    def timeline(self, member_id: int, created_from: str, count: int, base_url: str) -> List[dict]:
+        if member_id < 1 or member_id > self.members:
+            return []
+        lo = bisect.bisect_left(self.published, created_from) if created_from else 0
+        return [self.message(member_id, i, base_url) for i in range(lo, min(lo + count, self.messages))]
+
+    def media_chunk(self, msg_id: int, offset: int, length: int) -> bytes:
+        # 内容只取决于 id 与偏移，支持任意 Range 续传
+        pattern = (f"{msg_id:016d}".encode() * 64)[:1024]
+        start = offset % len(pattern)
+        reps = (start + length) // len(pattern) + 1
+        return (pattern * reps)[start:start + length]
+
+
+def _handler(sim: Simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: bytes = b"{}", headers: Optional[Dict[str, str]] = None):
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _inject(self) -> bool:
+            """模拟网络延迟与上游错误；返回 True 表示已发送错误响应。"""
+            if sim.latency:
+                time.sleep(sim.latency)
+            if sim.error_rate and random.random() < sim.error_rate:
+                if random.random() < 0.5:
+                    self._send(429, headers={"Retry-After": "1"})
+                else:
+                    self._send(503)
+                sim.count("error")
+                return True
+            return False
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if urlsplit(self.path).path != "/v2/update_token":
+                return self._send(404)
+            sim.count("update_token")
+            if self._inject():
+                return
+            body = json.dumps({"access_token": sim.issue_token(), "expires_in": 3600}).encode()
+            self._send(200, body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            m = TIMELINE_RE.match(url.path)
+            if m:
+                sim.count("timeline")
+                if self._inject():
+                    return
+                auth = self.headers.get("Authorization", "")
+                if auth[len("Bearer "):] not in sim.tokens:
+                    return self._send(401)
+                q = parse_qs(url.query)
+                base_url = f"http://{self.headers.get('Host')}"
+                messages = sim.timeline(
+                    int(m.group(1)),
+                    q.get("created_from", [""])[0],
+                    int(q.get("count", ["100"])[0]),
+                    base_url,
+                )
+                return self._send(200, json.dumps({"messages": messages}, ensure_ascii=False).encode())
+            m = MEDIA_RE.match(url.path)
+            if m:
+                sim.count("media")
+                return self._media(int(m.group(1)))
+            self._send(404)
+
+        def _media(self, msg_id: int):
+            size = sim.media_size
+            etag = f'"{msg_id}-{size}"'
+            offset = 0
+            rng = self.headers.get("Range")
+            if rng and self.headers.get("If-Range", etag) == etag:
+                offset = min(int(rng.split("=", 1)[1].split("-", 1)[0] or 0), size)
+            self.send_response(206 if offset else 200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size - offset))
+            self.send_header("ETag", etag)
+            if offset:
+                self.send_header("Content-Range", f"bytes {offset}-{size - 1}/{size}")
+            self.end_headers()
+            pos = offset
+            while pos < size:
+                n = min(64 * 1024, size - pos)
+                self.wfile.write(sim.media_chunk(msg_id, pos, n))
+                pos += n
+
+    return Handler
+
+
+def start_simulator(sim: Simulator, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """在后台线程启动模拟器；port=0 时自动选择端口（server.server_address[1]）。"""
+    server = ThreadingHTTPServer((host, port), _handler(sim))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游接口模拟器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--members", type=int, default=5, help="每组成员数（成员ID 1..N）")
+    parser.add_argument("--messages", type=int, default=250, help="每个成员的消息数")
+    parser.add_argument("--media-ratio", type=float, default=0.5, help="媒体消息比例")
+    parser.add_argument("--media-size", type=int, default=200_000, help="每个媒体文件字节数")
+    parser.add_argument("--latency", type=float, default=0, help="接口延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="接口返回 429/503 的比例")
+    parser.add_argument("--spacing", type=int, default=10, help="相邻消息的发布时间间隔（秒）")
+    args = parser.parse_args()
+
+    sim = Simulator(
+        members=args.members,
+        messages=args.messages,
+        media_ratio=args.media_ratio,
+        media_size=args.media_size,
+        latency_ms=args.latency,
+        error_rate=args.error_rate,
+        spacing_seconds=args.spacing,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), _handler(sim))
+    print(f"模拟器已启动：http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,17 @@ import argparse
 import asyncio
 import uvicorn
 
+from app.db import get_db
 from app.main import start_scheduler, app
+from app.tasks.backfill import run_backfill
+from app.tasks.compact import run_compact_text
 
 
-def run_scheduler():
+def run_scheduler(worker: bool = False):
     # 为 APScheduler 创建并设置独立事件循环
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    start_scheduler(loop)
+    start_scheduler(loop, worker=worker)
     try:
         loop.run_forever()
     except KeyboardInterrupt:
@@ -23,9 +26,28 @@ def run_api():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="MessageBackend entrypoint")
     parser.add_argument("--scheduler", action="store_true", help="启动独立定时任务调度器")
+    parser.add_argument("--worker", action="store_true", help="与 --scheduler 一起使用：分片模式，可启动多个进程分摊成员")
+    parser.add_argument("--backfill", action="store_true", help="回填指定成员的历史消息")
+    parser.add_argument("--group", help="回填的组：nogi | saku | hina")
+    parser.add_argument("--member", help="回填的成员ID或名称")
+    parser.add_argument("--since", help="回填起始日期：YYYYMMDD 或 YYYY-MM-DD")
+    parser.add_argument("--compact-text", action="store_true", help="把旧版单条 .txt 文件迁移到按月压缩归档")
+    parser.add_argument("--keep-files", action="store_true", help="与 --compact-text 一起使用：迁移后保留原 .txt 文件")
+    parser.add_argument("--rebuild-stats", action="store_true", help="从消息表全量重建每日统计")
     args = parser.parse_args()
 
-    if args.scheduler:
-        run_scheduler()
+    if args.rebuild_stats:
+        db = get_db()
+        db.init_db()
+        print("统计行数:", db.rebuild_message_stats())
+    elif args.compact_text:
+        for name, res in run_compact_text(keep_files=args.keep_files)["members"].items():
+            print(name, res)
+    elif args.backfill:
+        if not (args.group and args.member and args.since):
+            parser.error("--backfill 需要同时指定 --group、--member、--since")
+        run_backfill(args.group, args.member, args.since)
+    elif args.scheduler:
+        run_scheduler(worker=args.worker)
     else:
         run_api()
\ No newline at end of file